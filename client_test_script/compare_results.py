@@ -0,0 +1,78 @@
+"""
+Compare two load test result files written by test_client.py.
+
+Prints the p50/p95/p99 latencies of both runs side by side with the change
+in percent, and exits with status 1 when any percentile got slower by more
+than --threshold percent, so it can gate a commit.
+"""
+
+import argparse
+import json
+import sys
+
+PERCENTILES = ("p50", "p95", "p99")
+
+
+def change(before, after):
+    if not before:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(before, after, threshold):
+    regressions = []
+    print(f"{'request':<30}{'pct':>5}{'before':>12}{'after':>12}{'change':>10}")
+    categories = sorted(set(before["latency_ms"]) | set(after["latency_ms"]))
+    for category in categories:
+        old = before["latency_ms"].get(category, {})
+        new = after["latency_ms"].get(category, {})
+        for percentile in PERCENTILES:
+            if percentile not in old or percentile not in new:
+                continue
+            delta = change(old[percentile], new[percentile])
+            marker = ""
+            if delta is not None and delta > threshold:
+                marker = " !"
+                regressions.append((category, percentile, delta))
+            delta_text = f"{delta:+.1f}%" if delta is not None else "-"
+            print(f"{category:<30}{percentile:>5}{old[percentile]:>12}{new[percentile]:>12}{delta_text:>10}{marker}")
+
+    old = (before.get("vtn") or {}).get("loop_lag_ms", {})
+    new = (after.get("vtn") or {}).get("loop_lag_ms", {})
+    for percentile in PERCENTILES:
+        if old.get(percentile) is None or new.get(percentile) is None:
+            continue
+        delta = change(old[percentile], new[percentile])
+        delta_text = f"{delta:+.1f}%" if delta is not None else "-"
+        print(f"{'vtn loop lag':<30}{percentile:>5}{old[percentile]:>12}{new[percentile]:>12}{delta_text:>10}")
+
+    for name in ("rss_mb_max", "cpu_seconds"):
+        old = (before.get("vtn") or {}).get(name)
+        new = (after.get("vtn") or {}).get(name)
+        if old is not None and new is not None:
+            delta = change(old, new)
+            delta_text = f"{delta:+.1f}%" if delta is not None else "-"
+            print(f"{'vtn ' + name:<35}{old:>12}{new:>12}{delta_text:>10}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before", help="results of the baseline run")
+    parser.add_argument("after", help="results of the run to compare")
+    parser.add_argument("--threshold", type=float, default=10, help="allowed slowdown in percent")
+    options = parser.parse_args()
+    with open(options.before) as file:
+        before = json.load(file)
+    with open(options.after) as file:
+        after = json.load(file)
+    print(f"before: {before.get('commit')} ({before['config']['vens']} VENs), "
+          f"after: {after.get('commit')} ({after['config']['vens']} VENs)")
+    regressions = compare(before, after, options.threshold)
+    if regressions:
+        print(f"{len(regressions)} percentiles slower by more than {options.threshold}%")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
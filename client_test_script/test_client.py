@@ -1,63 +1,535 @@
-import sys
+"""
+Simulates VENs against the VTN server.
+
+Without arguments it connects four VENs (ven_1 to ven_4) that report a
+voltage every 10 seconds and opt in to every event, and runs until stopped.
+With --duration it becomes a load generator: VENs are spread over
+--processes worker processes, latencies of every OpenADR and /api/* request
+are recorded and a summary with p50/p95/p99 latencies, event loop lag and
+the VTN's memory use and event loop lag is written to --output. The VENs the
+script added to the VTN are removed again when it stops. Compare two result
+files with compare_results.py.
+"""
+
+import argparse
 import asyncio
-from datetime import timedelta
-from openleadr import OpenADRClient, enable_default_logging
+import json
+import os
 import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import aiohttp
+from openleadr import OpenADRClient, enable_default_logging
+
+SERVER_DIRECTORY = Path(__file__).resolve().parent.parent / "server"
+# group the load generator puts its VENs in, events are sent to this group
+LOAD_TEST_GROUP = "loadtest"
+LOOP_LAG_INTERVAL = 0.1
+
+VERBOSE = False
+
+
+def _request_category(service, message):
+    if service == "EiRegisterParty":
+        return "registration"
+    if service == "OadrPoll":
+        return "poll"
+    if service == "EiReport":
+        return "report_upload" if "oadrUpdateReport" in message else "report_registration"
+    if service == "EiEvent":
+        return "event_response"
+    return service
+
+
+class LatencyRecorder:
+    """Latency samples in milliseconds and error counts per request category."""
+
+    def __init__(self):
+        self.samples = dict()
+        self.errors = dict()
+
+    def record(self, category, started, ok=True):
+        self.samples.setdefault(category, []).append((time.perf_counter() - started) * 1000)
+        if not ok:
+            self.errors[category] = self.errors.get(category, 0) + 1
+
+    def merge(self, other):
+        for category, samples in other["samples"].items():
+            self.samples.setdefault(category, []).extend(samples)
+        for category, count in other["errors"].items():
+            self.errors[category] = self.errors.get(category, 0) + count
+
+    def as_dict(self):
+        return {"samples": self.samples, "errors": self.errors}
+
+
+class TimedClient(OpenADRClient):
+    """OpenADRClient that records the latency of every request it makes."""
+
+    def __init__(self, *args, recorder, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._recorder = recorder
+
+    async def _perform_request(self, service, message):
+        started = time.perf_counter()
+        result = await super()._perform_request(service, message)
+        ok = result is not None and result[0] is not None
+        self._recorder.record(_request_category(service, message), started, ok)
+        return result
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+
+    def at(fraction):
+        return round(samples[min(len(samples) - 1, int(fraction * len(samples)))], 3)
+
+    return {
+        "count": len(samples),
+        "mean": round(sum(samples) / len(samples), 3),
+        "p50": at(0.50),
+        "p95": at(0.95),
+        "p99": at(0.99),
+        "max": round(samples[-1], 3),
+    }
+
+
+def read_rss_mb(pid):
+    """Resident set size of a process in MB, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def read_cpu_seconds(pid):
+    """User + system CPU time of a process in seconds, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+async def monitor_loop_lag(lags):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lags.append((loop.time() - started - LOOP_LAG_INTERVAL) * 1000)
+
+
+async def add_vens(api_url, ven_names):
+    """
+    Add the VENs to the VTN registry, VENs that already exist are left as they
+    are. Returns the names of the VENs that were added.
+    """
+    added = []
+    async with aiohttp.ClientSession() as session:
+        for ven_name in ven_names:
+            async with session.post(f"{api_url}/api/ven",
+                                    json={"venName": ven_name, "groups": [LOAD_TEST_GROUP]}) as response:
+                await response.read()
+                if response.status == 200:
+                    added.append(ven_name)
+    return added
+
+
+async def remove_vens(api_url, ven_names):
+    """Remove the VENs from the VTN registry."""
+    async with aiohttp.ClientSession() as session:
+        for ven_name in ven_names:
+            async with session.post(f"{api_url}/api/remove_ven", json={"venName": ven_name}) as response:
+                await response.read()
+
+
+class Worker:
+    """Runs a slice of the simulated VENs in one process."""
+
+    def __init__(self, options, ven_names):
+        self.options = options
+        self.ven_names = ven_names
+        self.recorder = LatencyRecorder()
+        self.clients = dict()
+        self.loop_lags = []
+        self.events = {"received": 0, "opt_in": 0, "opt_out": 0}
+        self.churned = 0
+
+    def opts_out(self, ven_name):
+        # the same VENs opt out on every run
+        return random.Random(ven_name).random() < self.options.opt_out_ratio
+
+    async def start_ven(self, ven_name):
+        client = TimedClient(ven_name, self.options.url, recorder=self.recorder)
+        opt_type = "optOut" if self.opts_out(ven_name) else "optIn"
+
+        async def collect_report_value():
+            return round(random.uniform(80.5, 350.9))
+
+        async def handle_event(event):
+            self.events["received"] += 1
+            self.events["opt_out" if opt_type == "optOut" else "opt_in"] += 1
+            if VERBOSE:
+                print(f"----- EVENT for {ven_name} -----")
+                print(event)
+            return opt_type
+
+        client.add_report(callback=collect_report_value,
+                          resource_id="device001",
+                          measurement="voltage",
+                          sampling_rate=timedelta(seconds=self.options.report_interval),
+                          report_duration=timedelta(hours=1))
+        client.add_handler("on_event", handle_event)
+        client.add_handler("on_update_event", handle_event)
+        await client.run()
+        self.clients[ven_name] = client
+
+    async def stop_ven(self, ven_name):
+        client = self.clients.pop(ven_name, None)
+        if client is not None and client.client_session is not None:
+            await client.stop()
+
+    async def churn(self, rate):
+        # stop a random VEN and register it again, `rate` times per second
+        while True:
+            await asyncio.sleep(random.expovariate(rate))
+            if not self.clients:
+                continue
+            ven_name = random.choice(list(self.clients))
+            await self.stop_ven(ven_name)
+            await self.start_ven(ven_name)
+            self.churned += 1
+
+    async def run(self, duration):
+        lag_task = asyncio.create_task(monitor_loop_lag(self.loop_lags))
+        # spread registrations over the ramp up period
+        delay = self.options.ramp / max(1, len(self.ven_names))
+        starts = []
+        for ven_name in self.ven_names:
+            starts.append(asyncio.create_task(self.start_ven(ven_name)))
+            await asyncio.sleep(delay)
+        await asyncio.gather(*starts, return_exceptions=True)
+        churn_rate = self.options.churn_rate / self.options.processes
+        churn_task = asyncio.create_task(self.churn(churn_rate)) if churn_rate > 0 else None
+        if duration:
+            await asyncio.sleep(duration)
+        else:
+            await asyncio.Event().wait()
+        for task in (lag_task, churn_task):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*(self.stop_ven(ven_name) for ven_name in list(self.clients)),
+                             return_exceptions=True)
+
+    def results(self):
+        return {
+            "latency": self.recorder.as_dict(),
+            "loop_lags": self.loop_lags,
+            "events": self.events,
+            "churned": self.churned,
+            "rss_mb": read_rss_mb(os.getpid()),
+        }
+
+
+def run_worker(options, ven_names, duration):
+    # runs in a worker process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker = Worker(options, ven_names)
+    asyncio.run(worker.run(duration))
+    return worker.results()
+
+
+async def probe_api(api_url, recorder, interval):
+    """Time the read endpoints of the web app every `interval` seconds."""
+    paths = ["/api/list_vens?limit=100", "/api/all_events?limit=100", "/api/stats", "/api/ven_groups"]
+    async with aiohttp.ClientSession() as session:
+        while True:
+            for path in paths:
+                started = time.perf_counter()
+                try:
+                    async with session.get(f"{api_url}{path}") as response:
+                        await response.read()
+                        ok = response.status == 200
+                except aiohttp.ClientError:
+                    ok = False
+                recorder.record("api " + path.split("?")[0], started, ok)
+            await asyncio.sleep(interval)
+
+
+async def send_events(api_url, recorder, interval, sent):
+    """Send a SIMPLE event to every load test VEN every `interval` seconds."""
+    async with aiohttp.ClientSession() as session:
+        while True:
+            await asyncio.sleep(interval)
+            start = datetime.now(timezone.utc) + timedelta(minutes=random.randint(1, 60))
+            payload = {
+                "groups": [LOAD_TEST_GROUP],
+                "signalName": "SIMPLE",
+                "signalType": "level",
+                "startTime": start.strftime("%Y-%m-%dT%H:%M"),
+                "duration": random.randint(1, 30),
+                "level": random.randint(1, 3),
+            }
+            started = time.perf_counter()
+            try:
+                async with session.post(f"{api_url}/api/bulk_event", json=payload) as response:
+                    await response.read()
+                    ok = response.status == 202
+            except aiohttp.ClientError:
+                ok = False
+            recorder.record("api /api/bulk_event", started, ok)
+            sent[0] += ok
+
+
+async def scrape_loop_lag(api_url):
+    """
+    Cumulative bucket counts, sum and count of the VTN's event loop lag
+    histogram from /metrics, or None when it cannot be read.
+    """
+    buckets = dict()
+    total = {"sum": 0.0, "count": 0}
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{api_url}/metrics") as response:
+                if response.status != 200:
+                    return None
+                text = await response.text()
+    except aiohttp.ClientError:
+        return None
+    for line in text.splitlines():
+        if not line.startswith("vtn_event_loop_lag_seconds"):
+            continue
+        name, value = line.rsplit(" ", 1)
+        if name.startswith("vtn_event_loop_lag_seconds_bucket"):
+            bound = name.split('le="', 1)[1].split('"', 1)[0]
+            buckets[float(bound)] = float(value)
+        elif name == "vtn_event_loop_lag_seconds_sum":
+            total["sum"] = float(value)
+        elif name == "vtn_event_loop_lag_seconds_count":
+            total["count"] = float(value)
+    if not buckets:
+        return None
+    return {"buckets": buckets, **total}
+
+
+def loop_lag_percentiles(before, after):
+    """
+    Event loop lag of the VTN between two scrapes in milliseconds. The
+    percentiles are the upper bounds of the histogram buckets they fall in.
+    """
+    count = after["count"] - (before["count"] if before else 0)
+    if count <= 0:
+        return {"count": 0}
+    lag_sum = after["sum"] - (before["sum"] if before else 0)
+    bounds = sorted(after["buckets"])
+    counts = [after["buckets"][bound] - (before["buckets"].get(bound, 0) if before else 0) for bound in bounds]
+
+    def at(fraction):
+        for bound, cumulative in zip(bounds, counts):
+            if cumulative >= fraction * count:
+                return round(bound * 1000, 3) if bound != float("inf") else None
+        return None
+
+    return {
+        "count": int(count),
+        "mean": round(lag_sum / count * 1000, 3),
+        "p50": at(0.50),
+        "p95": at(0.95),
+        "p99": at(0.99),
+    }
+
+
+async def sample_vtn(pid, samples):
+    while True:
+        rss = read_rss_mb(pid)
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(1)
+
+
+def start_vtn(url, log_file, data_directory):
+    """Start server/main.py with its data in `data_directory` and wait until it accepts connections."""
+    process = subprocess.Popen([sys.executable, "main.py"], cwd=SERVER_DIRECTORY,
+                               env={**os.environ, "VTN_DATA_DIR": data_directory},
+                               stdout=log_file, stderr=subprocess.STDOUT)
+    address = urlsplit(url)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("The VTN server exited during startup, see its log")
+        try:
+            socket.create_connection((address.hostname, address.port or 80), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("The VTN server did not start listening within 30 seconds")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=SERVER_DIRECTORY, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
 
-enable_default_logging()
 
-async def collect_report_value():
-    # This callback is called when you need to collect a value for your Report
-    return round(random.uniform(80.5, 350.9))
+async def run_load_test(options, ven_names, vtn_pid):
+    loop = asyncio.get_running_loop()
+    recorder = LatencyRecorder()
+    vtn_rss = []
+    events_sent = [0]
+    background = [asyncio.create_task(probe_api(options.api_url, recorder, options.api_interval))]
+    if options.event_interval:
+        background.append(asyncio.create_task(
+            send_events(options.api_url, recorder, options.event_interval, events_sent)))
+    if vtn_pid:
+        background.append(asyncio.create_task(sample_vtn(vtn_pid, vtn_rss)))
+    vtn_cpu = read_cpu_seconds(vtn_pid) if vtn_pid else None
+    vtn_lag = await scrape_loop_lag(options.api_url)
 
-async def handle_event(event):
-    # This callback receives an Event dict.
-    # You should include code here that sends control signals to your resources.
-    print("----- EVENT -----")
-    print(event)
-    print("-----------------")
-    return "optIn"
+    started = time.monotonic()
+    slices = [ven_names[i::options.processes] for i in range(options.processes)]
+    with ProcessPoolExecutor(max_workers=options.processes) as pool:
+        results = await asyncio.gather(*(
+            loop.run_in_executor(pool, run_worker, options, ven_slice, options.duration)
+            for ven_slice in slices if ven_slice
+        ))
+    elapsed = time.monotonic() - started
+    for task in background:
+        task.cancel()
+    vtn_lag_end = await scrape_loop_lag(options.api_url)
 
-async def handle_update_event(event):
-    # This callback receives an Event dict for updated events.
-    # You should include code here that sends control signals to your resources.
-    print("----- UPDATED EVENT -----")
-    print(event)
-    print("-------------------------")
-    return "optIn"  # or "optOut" based on your logic
+    loop_lags = []
+    events = {"sent": events_sent[0], "received": 0, "opt_in": 0, "opt_out": 0}
+    for result in results:
+        recorder.merge(result["latency"])
+        loop_lags.extend(result["loop_lags"])
+        for key, count in result["events"].items():
+            events[key] += count
 
-async def run_ven(ven_name, vtn_url):
-    print(f"Connecting {ven_name} to: {vtn_url}")
+    vtn = dict()
+    if vtn_pid:
+        cpu = read_cpu_seconds(vtn_pid)
+        vtn["rss_mb_max"] = max(vtn_rss, default=None)
+        vtn["rss_mb_end"] = vtn_rss[-1] if vtn_rss else None
+        vtn["cpu_seconds"] = round(cpu - vtn_cpu, 2) if cpu is not None and vtn_cpu is not None else None
+    if vtn_lag_end is not None:
+        vtn["loop_lag_ms"] = loop_lag_percentiles(vtn_lag, vtn_lag_end)
+    return {
+        "commit": git_commit(),
+        "started": datetime.now(timezone.utc).isoformat(),
+        "duration": round(elapsed, 2),
+        "config": {key: value for key, value in vars(options).items() if key != "output"},
+        "latency_ms": {category: {**percentiles(samples), "errors": recorder.errors.get(category, 0)}
+                       for category, samples in sorted(recorder.samples.items())},
+        "throughput_per_second": {category: round(len(samples) / elapsed, 2)
+                                  for category, samples in sorted(recorder.samples.items())},
+        "generator_loop_lag_ms": percentiles(loop_lags),
+        "generator_rss_mb": [result["rss_mb"] for result in results],
+        "vtn": vtn,
+        "events": events,
+        "registrations_churned": sum(result["churned"] for result in results),
+    }
 
-    # Create the client object
-    client = OpenADRClient(ven_name, vtn_url)
 
-    # Add the report capability to the client
-    client.add_report(callback=collect_report_value,
-                      resource_id="device001",
-                      measurement="voltage",
-                      sampling_rate=timedelta(seconds=10))
+def print_summary(results):
+    print(f"{'request':<30}{'count':>8}{'errors':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for category, stats in results["latency_ms"].items():
+        print(f"{category:<30}{stats['count']:>8}{stats['errors']:>8}"
+              f"{stats.get('p50', 0):>10}{stats.get('p95', 0):>10}{stats.get('p99', 0):>10}")
+    print(f"generator loop lag p99: {results['generator_loop_lag_ms'].get('p99')} ms")
+    vtn = results["vtn"] or dict()
+    if "loop_lag_ms" in vtn:
+        print(f"VTN loop lag p99: {vtn['loop_lag_ms'].get('p99')} ms")
+    if "rss_mb_max" in vtn:
+        print(f"VTN RSS max: {vtn['rss_mb_max']} MB, CPU: {vtn['cpu_seconds']} s")
 
-    # Add event handling capability to the client
-    client.add_handler("on_event", handle_event)
 
-    # Add updated event handling capability to the client
-    client.add_handler("on_update_event", handle_update_event)
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8080/OpenADR2/Simple/2.0b", help="OpenADR URL of the VTN")
+    parser.add_argument("--vens", type=int, default=4, help="number of simulated VENs")
+    parser.add_argument("--prefix", default="ven_", help="VEN names are <prefix>1 to <prefix><vens>")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes the VENs are spread over")
+    parser.add_argument("--duration", type=float, default=0,
+                        help="seconds to run the load test for, 0 runs the VENs until stopped")
+    parser.add_argument("--ramp", type=float, default=0, help="seconds over which the VENs register")
+    parser.add_argument("--report-interval", type=float, default=10, help="seconds between report samples")
+    parser.add_argument("--opt-out-ratio", type=float, default=0, help="fraction of VENs that opt out of events")
+    parser.add_argument("--churn-rate", type=float, default=0,
+                        help="VENs stopped and registered again per second, across all processes")
+    parser.add_argument("--event-interval", type=float, default=0,
+                        help="seconds between events sent to every simulated VEN, 0 sends none")
+    parser.add_argument("--api-interval", type=float, default=5, help="seconds between /api/* probes")
+    parser.add_argument("--spawn-vtn", action="store_true",
+                        help="start server/main.py for the test, with its data in a temporary directory")
+    parser.add_argument("--vtn-pid", type=int, help="PID of an already running VTN, to sample its RSS and CPU")
+    parser.add_argument("--output", default="load_test_results.json", help="where to write the results")
+    parser.add_argument("--verbose", action="store_true", help="print events and the openleadr logs")
+    options = parser.parse_args()
+    address = urlsplit(options.url)
+    options.api_url = f"{address.scheme}://{address.netloc}"
+    return options
 
-    # Run the client
-    await client.run()
 
-vtn_url = "http://localhost:8080/OpenADR2/Simple/2.0b"
+def main():
+    global VERBOSE
+    options = parse_args()
+    VERBOSE = options.verbose or not options.duration
+    if VERBOSE:
+        enable_default_logging()
+    ven_names = [f"{options.prefix}{i}" for i in range(1, options.vens + 1)]
 
-# Create a list of VEN names
-ven_names = ["ven_1", "ven_2", "ven_3", "ven_4"]
+    vtn = None
+    data_directory = None
+    if options.spawn_vtn:
+        data_directory = tempfile.TemporaryDirectory(prefix="vtn-load-test-")
+        log_file = open(Path(options.output).with_suffix(".vtn.log"), "w")
+        vtn = start_vtn(options.url, log_file, data_directory.name)
+        options.vtn_pid = vtn.pid
+    added = []
+    try:
+        added = asyncio.run(add_vens(options.api_url, ven_names))
+        if not options.duration:
+            # simulate the VENs in this process until stopped
+            for ven_name in ven_names:
+                print(f"Connecting {ven_name} to: {options.url}")
+            try:
+                asyncio.run(Worker(options, ven_names).run(0))
+            except KeyboardInterrupt:
+                pass
+            return
+        results = asyncio.run(run_load_test(options, ven_names, options.vtn_pid))
+    finally:
+        if added and vtn is None:
+            asyncio.run(remove_vens(options.api_url, added))
+        if vtn is not None:
+            vtn.send_signal(signal.SIGTERM)
+            vtn.wait(timeout=30)
+        if data_directory is not None:
+            data_directory.cleanup()
+    with open(options.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print_summary(results)
+    print(f"Results written to {options.output}")
 
-# Run all VENs concurrently
-async def main():
-    tasks = [run_ven(ven_name, vtn_url) for ven_name in ven_names]
-    await asyncio.gather(*tasks)
 
 if __name__ == '__main__':
-    loop = asyncio.get_event_loop()
-    loop.create_task(main())
-    loop.run_forever()
+    main()
@@ -1,11 +1,12 @@
 //App.tsx
 
-import React, { useState, useEffect } from 'react';
+import React, { useState } from 'react';
 import axios from 'axios';
 import RegisterVen from './components/RegisterVen';
 import ScheduleEvent from './components/ScheduleEvent';
 import ViewEvents from './components/ViewEvents';
 import ListVens from './components/ListVens';
+import { useChangeFeed } from './changeFeed';
 import './App.css';
 
 
@@ -30,9 +31,20 @@ const App: React.FC = () => {
     }
   };
 
-  useEffect(() => {
-    fetchAllVens();
-  }, []);
+  // Load the VENs when the change feed connects, then apply its updates
+  useChangeFeed<Ven, unknown>({
+    onReady: fetchAllVens,
+    onFrame: (frame) => {
+      if (!frame.vens) return;
+      const { updated, removed } = frame.vens;
+      setVens(current => {
+        const byName = new Map(current.map(ven => [ven.ven_name, ven]));
+        removed.forEach(venName => byName.delete(venName));
+        updated.forEach(ven => byName.set(ven.ven_name, ven));
+        return Array.from(byName.values()).sort((a, b) => a.ven_name.localeCompare(b.ven_name));
+      });
+    },
+  });
 
   return (
     <div className="App">
@@ -0,0 +1,86 @@
+// changeFeed.ts
+
+import { useEffect, useRef } from 'react';
+
+const ENV_MODE = "DEV" // get from Vite or wherever
+const urlBase = ENV_MODE === "DEV" ? "http://127.0.0.1:8080" : "prod_stuff"
+const CHANGES_URL = `${urlBase}/api/changes`;
+// without a working stream the lists are reloaded at this interval instead
+const POLL_INTERVAL_MS = 5000;
+// how long to poll before the stream is tried again
+const STREAM_RETRY_MS = 60000;
+// stream errors without a ready event in between before falling back to polling
+const MAX_STREAM_ERRORS = 3;
+
+// One frame of /api/changes, changes are coalesced by the server so a frame holds the latest state
+export interface ChangeFrame<Ven, Event> {
+  vens?: { updated: Ven[]; removed: string[] };
+  events?: { added: Event[]; cancelled: string[]; removed: string[] };
+  responses?: { ven_id: string; event_id: string; opt_type: string }[];
+}
+
+interface ChangeFeedHandlers<Ven, Event> {
+  // called on every (re)connect, changes may have been missed so the lists should be reloaded.
+  // While the stream is unavailable it is called every POLL_INTERVAL_MS instead
+  onReady: () => void;
+  onFrame: (frame: ChangeFrame<Ven, Event>) => void;
+}
+
+export function useChangeFeed<Ven, Event>(handlers: ChangeFeedHandlers<Ven, Event>) {
+  const handlersRef = useRef(handlers);
+  handlersRef.current = handlers;
+
+  useEffect(() => {
+    let source: EventSource | null = null;
+    let pollTimer: number | undefined;
+    let retryTimer: number | undefined;
+    let errors = 0;
+
+    const stopPolling = () => {
+      window.clearInterval(pollTimer);
+      window.clearTimeout(retryTimer);
+    };
+
+    const startPolling = () => {
+      source?.close();
+      source = null;
+      handlersRef.current.onReady();
+      pollTimer = window.setInterval(() => handlersRef.current.onReady(), POLL_INTERVAL_MS);
+      if (typeof EventSource !== 'undefined') {
+        retryTimer = window.setTimeout(() => {
+          stopPolling();
+          connect();
+        }, STREAM_RETRY_MS);
+      }
+    };
+
+    const connect = () => {
+      if (typeof EventSource === 'undefined') {
+        startPolling();
+        return;
+      }
+      errors = 0;
+      // EventSource reconnects by itself when the stream ends
+      const stream = new EventSource(CHANGES_URL);
+      source = stream;
+      stream.addEventListener('ready', () => {
+        errors = 0;
+        handlersRef.current.onReady();
+      });
+      stream.onmessage = (message) => handlersRef.current.onFrame(JSON.parse(message.data));
+      // a stream that never gets going, for example through a proxy that buffers it, is given up for polling
+      stream.onerror = () => {
+        errors += 1;
+        if (stream.readyState === EventSource.CLOSED || errors >= MAX_STREAM_ERRORS) {
+          startPolling();
+        }
+      };
+    };
+
+    connect();
+    return () => {
+      stopPolling();
+      source?.close();
+    };
+  }, []);
+}
@@ -22,12 +22,6 @@ const urlBase = ENV_MODE === "DEV" ? "http://127.0.0.1:8080" : "prod_stuff"
 const ListVens: React.FC<ListVensProps> = ({ vens, fetchAllVens }) => {
   const [result, setResult] = useState<{ status: string, message: string } | null>(null);
 
-  useEffect(() => {
-    fetchAllVens();
-    const interval = setInterval(fetchAllVens, 5000);
-    return () => clearInterval(interval);
-  }, [fetchAllVens]);
-
   useEffect(() => {
     if (result) {
       const timer = setTimeout(() => setResult(null), 5000);
@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
+import { useChangeFeed } from '../changeFeed';
 
 interface Event {
   ven_id: string;
@@ -27,11 +28,22 @@ const ViewEvents: React.FC = () => {
     }
   };
 
-  useEffect(() => {
-    fetchAllEvents();
-    const interval = setInterval(fetchAllEvents, 5000);
-    return () => clearInterval(interval);
-  }, []);
+  // Load the events when the change feed connects, then apply its updates
+  useChangeFeed<unknown, Event>({
+    onReady: fetchAllEvents,
+    onFrame: (frame) => {
+      if (!frame.events) return;
+      const { added, removed } = frame.events;
+      setEvents(current => {
+        const removedIds = new Set(removed);
+        const addedIds = new Set(added.map(event => event.event_id));
+        return current
+          .filter(event => !removedIds.has(event.event_id) && !addedIds.has(event.event_id))
+          .concat(added.filter(event => !removedIds.has(event.event_id)))
+          .sort((a, b) => a.event_start.localeCompare(b.event_start));
+      });
+    },
+  });
 
   useEffect(() => {
     if (result) {
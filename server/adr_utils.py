@@ -1,38 +1,128 @@
-import asyncio
+import base64
+import json
+from bisect import bisect_left, bisect_right
 from functools import partial
 from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import logging
+import time
 from aiohttp import web
-from ven_registry import VenRegistry, UnknownVenError, DuplicateVenError
+from ven_registry import UnknownVenError, DuplicateVenError
+from response_cache import ResponseCache
+from log_config import log_category
+from change_feed import event_row
+from event_schedule import Schedule, expand_intervals
 
-# Define VEN registry variable to be set later
+# Define VEN registry and telemetry store variables to be set later
 VEN_REGISTRY = None
-
-# Set up logging
+VTN_SERVER = None
+TELEMETRY_STORE = None
+BULK_DISPATCHER = None
+EVENT_EXPIRY = None
+REPORT_INGEST = None
+METRICS = None
+CHANGE_FEED = None
+STARTUP_TIMER = None
+EVENT_SCHEDULER = None
+FLEET_AGGREGATOR = None
+REGISTRATION_GATE = None
+
+# default number of buckets for /api/reports when no resolution is given
+DEFAULT_REPORT_BUCKETS = 500
+# seconds the last report fields of a cached /api/list_vens page may lag behind, reports of
+# online VENs do not invalidate the page so polling clients keep getting 304s in between
+VEN_LIST_REPORT_REFRESH = 30
+# clock VEN_LIST_REPORT_REFRESH is measured with
+_clock = time.monotonic
+
+# Cache of serialized /api/list_vens and /api/all_events responses
+RESPONSE_CACHE = ResponseCache()
+# Flattened event rows for /api/all_events with the version they were built from
+_EVENT_ROWS = (None, [])
+# VEN_REGISTRY.report_version the /api/list_vens pages show and when it was taken
+_LISTED_REPORTS = (0, float("-inf"))
+
+# Logging is configured by main.py, see log_config.py
 logger = logging.getLogger('openleadr')
-logger.setLevel(logging.INFO)
 
 def set_ven_registry(ven_registry):
     global VEN_REGISTRY
     VEN_REGISTRY = ven_registry
 
-async def on_create_party_registration(registration_info):
-    ven_name = registration_info["ven_name"]
+def set_vtn_server(vtn_server):
+    global VTN_SERVER
+    VTN_SERVER = vtn_server
+
+def set_telemetry_store(telemetry_store):
+    global TELEMETRY_STORE
+    TELEMETRY_STORE = telemetry_store
+
+def set_bulk_dispatcher(bulk_dispatcher):
+    global BULK_DISPATCHER
+    BULK_DISPATCHER = bulk_dispatcher
+
+def set_event_expiry(event_expiry):
+    global EVENT_EXPIRY
+    EVENT_EXPIRY = event_expiry
+
+def set_report_ingest(report_ingest):
+    global REPORT_INGEST
+    REPORT_INGEST = report_ingest
+
+def set_metrics(metrics):
+    global METRICS
+    METRICS = metrics
+
+def set_change_feed(change_feed):
+    global CHANGE_FEED
+    CHANGE_FEED = change_feed
+
+def set_startup_timer(startup_timer):
+    global STARTUP_TIMER
+    STARTUP_TIMER = startup_timer
+
+def set_event_scheduler(event_scheduler):
+    global EVENT_SCHEDULER
+    EVENT_SCHEDULER = event_scheduler
+
+def set_fleet_aggregator(fleet_aggregator):
+    global FLEET_AGGREGATOR
+    FLEET_AGGREGATOR = fleet_aggregator
+
+def set_registration_gate(registration_gate):
+    global REGISTRATION_GATE
+    REGISTRATION_GATE = registration_gate
+
+def ven_lookup(ven_id):
+    """The VEN as openleadr's ven_lookup wants it, or None."""
     try:
-        ven_info = VEN_REGISTRY.get_ven_info_from_name(ven_name)
-        return (ven_info.ven_id, ven_info.registration_id)
+        ven_info = VEN_REGISTRY.get_ven_info_from_id(ven_id)
     except UnknownVenError:
-        logger.warning(f"An unknown VEN tried to connect: {ven_name}")
-    return False
+        return None
+    return {
+        "ven_id": ven_info.ven_id,
+        "ven_name": ven_info.ven_name,
+        "registration_id": ven_info.registration_id,
+        "fingerprint": ven_info.fingerprint,
+    }
+
+async def on_create_party_registration(registration_info):
+    ven_name = registration_info["ven_name"]
+    ids = REGISTRATION_GATE.lookup(ven_name)
+    if ids is None:
+        logger.warning("An unknown VEN tried to connect: %s", ven_name, extra=log_category("registration", ven_name))
+        return False
+    # the client certificate was checked against the VEN's fingerprint by the registration gate
+    return ids
 
 async def on_cancel_party_registration(payload):
     ven_id = payload['ven_id']
     try:
         ven_info = VEN_REGISTRY.get_ven_info_from_id(ven_id)
         VEN_REGISTRY.remove_ven(ven_info.ven_name)
-        logger.info(f"VEN {ven_info.ven_name} with ID {ven_id} has been deregistered.")
+        logger.info("VEN %s with ID %s has been deregistered.", ven_info.ven_name, ven_id)
     except UnknownVenError:
-        logger.warning(f"Attempted to deregister unknown VEN with ID {ven_id}")
+        logger.warning("Attempted to deregister unknown VEN with ID %s", ven_id)
     return None
 
 async def on_register_report(
@@ -44,8 +134,9 @@ async def on_register_report(
     min_sampling_interval,
     max_sampling_interval,
 ):
+    update_report = METRICS.instrumented("on_update_report", on_update_report) if METRICS else on_update_report
     callback = partial(
-        on_update_report,
+        update_report,
         ven_id=ven_id,
         resource_id=resource_id,
         measurement=measurement,
@@ -55,115 +146,122 @@ async def on_register_report(
 
 
 async def on_update_report(data, ven_id, resource_id, measurement):
-    logger.info("on update report")
-    logger.info(data)
-    for time, value in data:
-        logger.info(
-            f"Ven {ven_id} reported {measurement} = {value} at time {time} for resource {resource_id}"
-        )
-        # Update the registry with the last report value, units, and time
-        ven_info = VEN_REGISTRY.get_ven_info_from_id(ven_id)
-        VEN_REGISTRY.update_ven_report(ven_info.ven_name, value, measurement, time.isoformat())
+    # queued only, the registry and the telemetry store are updated in batches
+    # so the report is acknowledged right away
+    logger.debug("Ven %s reported %d %s samples for resource %s", ven_id, len(data), measurement, resource_id,
+                 extra=log_category("report", ven_id))
+    REPORT_INGEST.submit(ven_id, resource_id, measurement, data)
 
 async def event_response_callback(ven_id, event_id, opt_type):
-    logger.info(f"VEN {ven_id} responded to Event {event_id} with: {opt_type}")
+    logger.info("VEN %s responded to Event %s with: %s", ven_id, event_id, opt_type,
+                extra=log_category("event_response", ven_id))
+    CHANGE_FEED.event_response(ven_id, event_id, opt_type)
 
 async def on_request_event(ven_id):
     """
     Custom handler to provide events for a VEN when it requests them.
+    Only called by openleadr when polling is handled externally, the
+    server answers from its own pending events otherwise.
     """
-    # Here, you can add logic to determine which events should be sent to the VEN
-    events = VEN_REGISTRY.get_events_for_ven(ven_id)  # Assuming you have this method implemented
-    return events
+    return VTN_SERVER.pending_events(ven_id) or None
 
 async def on_created_event(ven_id, event_id, opt_type):
     """
     Custom handler to process the response from a VEN when they acknowledge the receipt of an event.
     """
-    logger.info(f"VEN {ven_id} responded to Event {event_id} with: {opt_type}")
+    logger.info("VEN %s responded to Event %s with: %s", ven_id, event_id, opt_type,
+                extra=log_category("event_response", ven_id))
+    CHANGE_FEED.event_response(ven_id, event_id, opt_type)
 
 
-async def handle_event_post(request):
-    payload = await request.json()
-    logger.info('Received Event Payload:', payload)
-    ven_ids = payload.get("ven_ids", [])
-    signal_name = payload.get("signalName")
-    signal_type = payload.get("signalType")
-    start_time = payload.get("startTime")
-    duration = payload.get("duration")
+SIGNAL_TYPES = ["level", "price", "priceRelative", "priceMultiplier", "setpoint", "delta", "multiplier"]
 
-    if not all([ven_ids, signal_name, signal_type, start_time, duration]):
-        logger.error("Error: Missing required event data")
-        raise web.HTTPBadRequest(text="Missing required event data")
 
-    signal_payload = None
+def _signal_payload(signal_name, values):
+    """The payload value of an interval, taken from the field that matches the signal name."""
     if signal_name == "SIMPLE":
-        signal_payload = payload.get("level", 1)
-    elif signal_name == "ELECTRICITY_PRICE":
-        signal_payload = payload.get("price")
+        return values.get("level", 1)
+    if signal_name == "ELECTRICITY_PRICE":
+        signal_payload = values.get("price")
         if signal_payload is None:
             raise web.HTTPBadRequest(text="Missing price for ELECTRICITY_PRICE event")
-    elif signal_name == "LOAD_DISPATCH":
-        signal_payload = payload.get("setpoint")
+        return signal_payload
+    if signal_name == "LOAD_DISPATCH":
+        signal_payload = values.get("setpoint")
         if signal_payload is None:
             raise web.HTTPBadRequest(text="Missing setpoint for LOAD_DISPATCH event")
-    else:
-        raise web.HTTPBadRequest(text=f"Unknown signal name {signal_name}")
-
-    intervals = [
-        {
-            "dtstart": datetime.strptime(start_time, "%Y-%m-%dT%H:%M").replace(tzinfo=timezone.utc),
-            "duration": timedelta(minutes=int(duration)),
-            "signal_payload": signal_payload,
-        }
-    ]
-
-    if signal_type not in [
-        "level",
-        "price",
-        "priceRelative",
-        "priceMultiplier",
-        "setpoint",
-        "delta",
-        "multiplier",
-    ]:
-        logger.error(f"Error: Unknown type {signal_type}")
+        return signal_payload
+    raise web.HTTPBadRequest(text=f"Unknown signal name {signal_name}")
+
+
+def _parse_event_template(payload):
+    """
+    Validate the signal part of an event request. Returns the signal name
+    and type, the start and the intervals as [(minutes, signal payload)].
+    A single interval is given by duration and level/price/setpoint, several
+    consecutive ones by "intervals": [{"duration", "level"/"price"/"setpoint"}].
+    """
+    signal_name = payload.get("signalName")
+    signal_type = payload.get("signalType")
+    start_time = payload.get("startTime")
+    items = payload.get("intervals") or [payload]
+
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        logger.error("Error: intervals must be a list of objects")
+        raise web.HTTPBadRequest(text="Invalid intervals, expected a list of objects")
+    if not all([signal_name, signal_type, start_time]) or not all(item.get("duration") for item in items):
+        logger.error("Error: Missing required event data")
+        raise web.HTTPBadRequest(text="Missing required event data")
+
+    try:
+        start = datetime.strptime(start_time, "%Y-%m-%dT%H:%M").replace(tzinfo=timezone.utc)
+        template = [(int(item["duration"]), _signal_payload(signal_name, item)) for item in items]
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text="Invalid startTime or duration")
+
+    if signal_type not in SIGNAL_TYPES:
+        logger.error("Error: Unknown type %s", signal_type)
         raise web.HTTPBadRequest(text=f"Unknown type {signal_type}")
 
+    return signal_name, signal_type, start, template
+
+
+def _parse_event_payload(payload):
+    """Validate the signal part of an event request and build its intervals."""
+    signal_name, signal_type, start, template = _parse_event_template(payload)
+    return signal_name, signal_type, expand_intervals(start, template)
+
+
+async def handle_event_post(request):
+    payload = await request.json()
+    logger.debug("Received Event Payload: %s", payload)
+    ven_ids = payload.get("ven_ids", [])
+    if not ven_ids:
+        logger.error("Error: Missing required event data")
+        raise web.HTTPBadRequest(text="Missing required event data")
+    signal_name, signal_type, intervals = _parse_event_payload(payload)
+
     responses = []
     for ven_id in ven_ids:
         try:
             ven = VEN_REGISTRY.get_ven_info_from_id(ven_id)
-            logger.info(f'VEN found: {ven}')
+            logger.debug("VEN found: %s", ven.ven_name, extra=log_category("ven_lookup", ven_id))
         except UnknownVenError:
-            logger.error(f"Error: VEN {ven_id} not found")
+            logger.error("Error: VEN %s not found", ven_id)
             responses.append({"status": "error", "message": f"VEN {ven_id} not found"})
             continue
 
-        # Check for existing events with the same parameters
-        existing_events = request.app["server"].events.get(ven_id, [])
-        is_duplicate = False
-        for event in existing_events:
-            existing_signal_name = event.event_signals[0].signal_name
-            existing_signal_type = event.event_signals[0].signal_type
-            existing_intervals = event.event_signals[0].intervals
-
-            if (existing_signal_name == signal_name and
-                existing_signal_type == signal_type and
-                existing_intervals == intervals):
-                logger.info(f"Duplicate event detected for VEN {ven_id}. Event not added.")
-                responses.append({"status": "error", "message": f"Duplicate event detected for VEN {ven_id}"})
-                is_duplicate = True
-                break
-        
-        if is_duplicate:
+        # Check for an existing event with the same parameters
+        if request.app["server"].find_duplicate(ven_id, signal_name, signal_type, intervals):
+            logger.info("Duplicate event detected for VEN %s. Event not added.", ven_id)
+            responses.append({"status": "error", "message": f"Duplicate event detected for VEN {ven_id}"})
             continue
 
         # If no duplicates found, add the event
         event_id = request.app["server"].add_event(
             ven_id, signal_name, signal_type, intervals, callback=event_response_callback
         )
-        logger.info(f"Sent event to {ven.ven_name}: {signal_name} ({signal_type})")
+        logger.info("Sent event to %s: %s (%s)", ven.ven_name, signal_name, signal_type)
         responses.append({"status": "success", "message": f"Event sent to {ven.ven_name}", "event_id": event_id})
 
     return web.json_response(responses)
@@ -171,49 +269,264 @@ async def handle_event_post(request):
 
 async def handle_ven_post(request):
     payload = await request.json()
-    logger.info('Received VEN Payload:', payload)
+    logger.debug("Received VEN Payload: %s", payload)
     ven_name = payload["venName"]
+    groups = payload.get("groups", [])
+    fingerprint = payload.get("fingerprint")
 
     try:
-        VEN_REGISTRY.add_ven(ven_name)
-        logger.info(f'VEN {ven_name} added successfully.')
+        VEN_REGISTRY.add_ven(ven_name, groups=groups, fingerprint=fingerprint)
+        logger.info("VEN %s added successfully.", ven_name)
         return web.json_response({"status": "success", "message": f"VEN {ven_name} added successfully"})
     except DuplicateVenError:
-        logger.warning(f'VEN {ven_name} already registered.')
+        logger.warning("VEN %s already registered.", ven_name)
         return web.json_response({"status": "error", "message": "VEN already registered"}, status=400)
 
+async def handle_ven_groups_post(request):
+    payload = await request.json()
+    ven_name = payload.get("venName")
+    groups = payload.get("groups")
+    if not ven_name or not isinstance(groups, list):
+        raise web.HTTPBadRequest(text="Missing venName or groups")
+
+    try:
+        VEN_REGISTRY.set_ven_groups(ven_name, groups)
+    except UnknownVenError:
+        return web.json_response({"status": "error", "message": f"VEN {ven_name} not found"}, status=404)
+    logger.info("VEN %s groups set to %s", ven_name, groups)
+    return web.json_response({"status": "success", "message": f"Groups of VEN {ven_name} updated"})
+
+async def handle_ven_fingerprint_post(request):
+    payload = await request.json()
+    ven_name = payload.get("venName")
+    if not ven_name or "fingerprint" not in payload:
+        raise web.HTTPBadRequest(text="Missing venName or fingerprint")
+
+    try:
+        VEN_REGISTRY.set_ven_fingerprint(ven_name, payload["fingerprint"])
+    except UnknownVenError:
+        return web.json_response({"status": "error", "message": f"VEN {ven_name} not found"}, status=404)
+    logger.info("VEN %s certificate fingerprint set to %s", ven_name, payload["fingerprint"])
+    return web.json_response({"status": "success", "message": f"Fingerprint of VEN {ven_name} updated"})
+
+async def handle_list_groups(request):
+    await VEN_REGISTRY.wait_loaded()
+    return web.json_response(VEN_REGISTRY.get_groups())
+
+async def handle_bulk_event_post(request):
+    """
+    Send the same event to every VEN (all), to VEN groups (groups) and/or to
+    explicit ven_ids. Events are created in the background, the response
+    carries a job_id for /api/bulk_event/{job_id}.
+    """
+    payload = await request.json()
+    signal_name, signal_type, intervals = _parse_event_payload(payload)
+    await VEN_REGISTRY.wait_loaded()
+
+    if payload.get("all"):
+        ven_ids = [ven.ven_id for ven in VEN_REGISTRY.get_all_vens()]
+    else:
+        ven_ids = [ven.ven_id for ven in VEN_REGISTRY.get_vens_in_groups(payload.get("groups", []))]
+        ven_ids.extend(payload.get("ven_ids", []))
+        ven_ids = list(dict.fromkeys(ven_ids))
+    if not ven_ids:
+        raise web.HTTPBadRequest(text="No VENs targeted, use all, groups or ven_ids")
+
+    job = BULK_DISPATCHER.submit(ven_ids, signal_name, signal_type, intervals)
+    logger.info("Bulk dispatch %s: %s (%s) to %d VENs", job.job_id, signal_name, signal_type, len(ven_ids))
+    return web.json_response(job.as_dict(), status=202)
+
+async def handle_bulk_event_status(request):
+    include_results = request.query.get("results", "false").lower() == "true"
+    job = await BULK_DISPATCHER.job_status(request.match_info["job_id"], include_results=include_results)
+    if job is None:
+        raise web.HTTPNotFound(text=f"Dispatch job {request.match_info['job_id']} not found")
+    return web.json_response(job)
+
+async def handle_schedule_post(request):
+    """
+    Schedule an event to be sent once, daily or weekly (repeat) to all VENs,
+    VEN groups and/or ven_ids, leadTime minutes before each start. Optional
+    count or until (%Y-%m-%dT%H:%M) end a repeating schedule. startTime and
+    until are in timeZone (an IANA name, UTC by default), repeats keep their
+    wall time in it across DST changes.
+    """
+    payload = await request.json()
+    signal_name, signal_type, start, template = _parse_event_template(payload)
+    targets = {
+        "all": bool(payload.get("all")),
+        "groups": payload.get("groups", []),
+        "ven_ids": payload.get("ven_ids", []),
+    }
+    if not any(targets.values()):
+        raise web.HTTPBadRequest(text="No VENs targeted, use all, groups or ven_ids")
+
+    try:
+        time_zone = payload.get("timeZone") or "UTC"
+        zone = ZoneInfo(time_zone)
+    except (ZoneInfoNotFoundError, TypeError, ValueError):
+        raise web.HTTPBadRequest(text=f"Unknown timeZone {time_zone}, use an IANA name like Europe/Amsterdam")
+
+    try:
+        # _parse_event_template reads startTime as UTC, it is the wall time in the schedule's zone
+        start = start.replace(tzinfo=zone)
+        until = payload.get("until")
+        if until:
+            until = datetime.strptime(until, "%Y-%m-%dT%H:%M").replace(tzinfo=zone)
+        count = payload.get("count")
+        schedule = Schedule(
+            name=payload.get("name") or f"{signal_name} {payload['startTime']}",
+            signal_name=signal_name,
+            signal_type=signal_type,
+            template=template,
+            first_start=start,
+            targets=targets,
+            repeat=payload.get("repeat", "once"),
+            count=int(count) if count is not None else None,
+            until=until or None,
+            lead_time=timedelta(minutes=float(payload["leadTime"])) if "leadTime" in payload
+            else EVENT_SCHEDULER.lead_time,
+            time_zone=time_zone,
+        )
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+
+    EVENT_SCHEDULER.add(schedule)
+    logger.info("Schedule %s added: %s (%s), %s", schedule.name, signal_name, signal_type, schedule.repeat)
+    return web.json_response(schedule.as_dict(), status=201)
+
+async def handle_list_schedules(request):
+    return web.json_response([schedule.as_dict() for schedule in EVENT_SCHEDULER.list()])
+
+async def handle_remove_schedule(request):
+    schedule_id = request.match_info["schedule_id"]
+    if EVENT_SCHEDULER.remove(schedule_id) is None:
+        raise web.HTTPNotFound(text=f"Schedule {schedule_id} not found")
+    logger.info("Schedule %s removed", schedule_id)
+    return web.json_response({"status": "success", "message": f"Schedule {schedule_id} removed"})
+
+def _encode_cursor(value: str) -> str:
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+def _decode_cursor(cursor: str) -> str:
+    try:
+        return base64.urlsafe_b64decode(cursor.encode()).decode()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Invalid cursor")
+
+def _parse_limit(request):
+    if "limit" not in request.query:
+        return None
+    try:
+        limit = int(request.query["limit"])
+    except ValueError:
+        raise web.HTTPBadRequest(text="limit must be an integer")
+    if limit < 1:
+        raise web.HTTPBadRequest(text="limit must be positive")
+    return limit
+
+def _parse_time(request, name):
+    if name not in request.query:
+        return None
+    try:
+        value = datetime.fromisoformat(request.query[name])
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"Invalid {name} time")
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def _cached_json_response(request, version, build):
+    """
+    Serve a JSON list from the response cache, or build it with `build()`,
+    which returns the items and the cursor of the next page (or None).
+    Answers 304 when the client already has this version.
+    """
+    key = request.path_qs
+    etag = RESPONSE_CACHE.etag(key, version)
+    if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+        return web.Response(status=304, headers={"ETag": etag})
+
+    cached = RESPONSE_CACHE.get(key, version)
+    if cached is None:
+        items, next_cursor = build()
+        headers = {"ETag": etag}
+        if next_cursor is not None:
+            headers["X-Next-Cursor"] = next_cursor
+        cached = (json.dumps(items).encode(), headers)
+        RESPONSE_CACHE.put(key, version, cached)
+    body, headers = cached
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+def _event_rows(server):
+    """All events as listing rows sorted by start time, rebuilt only when events or VENs change."""
+    global _EVENT_ROWS
+    version = (server.events_version, VEN_REGISTRY.names_version)
+    if _EVENT_ROWS[0] == version:
+        return _EVENT_ROWS[1]
+    rows = []
+    for ven_id, events in server.events.items():
+        try:
+            ven_name = VEN_REGISTRY.get_ven_info_from_id(ven_id).ven_name
+        except UnknownVenError:
+            ven_name = "Unknown VEN"
+        for event in events:
+            event_start = event.active_period['dtstart']
+            rows.append({
+                **event_row(ven_id, ven_name, event),
+                # used for filtering, dropped from the response
+                "_start": event_start,
+                "_end": event_start + event.active_period['duration'],
+                "_cursor": f"{event_start.isoformat()}|{event.event_descriptor.event_id}|{ven_id}",
+            })
+    rows.sort(key=lambda row: row["_cursor"])
+    _EVENT_ROWS = (version, rows)
+    return rows
+
 async def handle_list_all_events(request):
-    events_list = []
+    """
+    List events, optionally filtered with name_prefix (VEN name), signal_name
+    and a from/to time window, and paginated with limit and cursor. The
+    cursor of the next page is returned in the X-Next-Cursor header.
+    """
+    server = request.app["server"]
+    limit = _parse_limit(request)
+    cursor = request.query.get("cursor")
+    name_prefix = request.query.get("name_prefix")
+    signal_name = request.query.get("signal_name")
+    window_start = _parse_time(request, "from")
+    window_end = _parse_time(request, "to")
+    await VEN_REGISTRY.wait_loaded()
+
+    def build():
+        rows = _event_rows(server)
+        position = 0
+        if cursor is not None:
+            position = bisect_right(rows, _decode_cursor(cursor), key=lambda row: row["_cursor"])
+        items = []
+        for row in rows[position:]:
+            if name_prefix is not None and not row["ven_name"].startswith(name_prefix):
+                continue
+            if signal_name is not None and row["signal_name"] != signal_name:
+                continue
+            if window_start is not None and row["_end"] <= window_start:
+                continue
+            if window_end is not None and row["_start"] >= window_end:
+                continue
+            if limit is not None and len(items) == limit:
+                return items, _encode_cursor(items[-1]["_cursor"])
+            items.append(row)
+        return items, None
+
+    def build_response():
+        items, next_cursor = build()
+        return [{k: v for k, v in row.items() if not k.startswith("_")} for row in items], next_cursor
+
     try:
-        for ven_id, events in request.app["server"].events.items():
-            for event in events:
-                event_id = event.event_descriptor.event_id
-                signal_name = event.event_signals[0].signal_name
-                signal_type = event.event_signals[0].signal_type
-                event_start = event.active_period['dtstart']
-                event_duration = event.active_period['duration']
-
-                try:
-                    ven_info = VEN_REGISTRY.get_ven_info_from_id(ven_id)
-                    ven_name = ven_info.ven_name
-                except UnknownVenError:
-                    ven_name = "Unknown VEN"
-
-                # Print the specific details on a single line
-                logger.info(f"EVENTS - {ven_name}, Event Start: {event_start}, Event Duration: {event_duration}, Signal Type: {signal_type}")
-
-                events_list.append({
-                    "ven_id": ven_id,
-                    "ven_name": ven_name,
-                    "event_id": event_id,
-                    "signal_name": signal_name,
-                    "signal_type": signal_type,
-                    "event_start": event_start.isoformat(),
-                    "event_duration": event_duration.total_seconds() / 60
-                })
-        return web.json_response(events_list)
+        version = (server.events_version, VEN_REGISTRY.names_version)
+        return _cached_json_response(request, version, build_response)
+    except web.HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error listing events: {e}")
+        logger.error("Error listing events: %s", e)
         raise web.HTTPInternalServerError(text=str(e))
 
 async def handle_cancel_event(request):
@@ -232,19 +545,14 @@ async def handle_cancel_event(request):
         raise web.HTTPNotFound(text=f"VEN with id {ven_id} not found")
 
     # Retrieve event_name
-    event_name = None
-    existing_events = request.app["server"].events.get(ven_id, [])
-    for event in existing_events:
-        if event.event_descriptor.event_id == event_id:
-            event_name = event.event_signals[0].signal_name
-            break
-
-    if not event_name:
+    found = request.app["server"].find_event(event_id)
+    if found is None or found[0] != ven_id:
         raise web.HTTPNotFound(text=f"Event with id {event_id} not found for VEN {ven_id}")
+    event_name = found[1].event_signals[0].signal_name
 
     # Cancel the event using OpenADRServer's method
     request.app["server"].cancel_event(ven_id, event_id)
-    logger.info(f"Cancelled event {event_id} for VEN {ven_id}")
+    logger.info("Cancelled event %s for VEN %s", event_id, ven_id)
     return web.json_response({"status": "success", "message": f"Event '{event_name}' cancelled for VEN '{ven_name}'"})
 
 
@@ -257,24 +565,174 @@ async def handle_remove_ven(request):
 
     try:
         VEN_REGISTRY.remove_ven(ven_name)
-        logger.info(f"Removed VEN {ven_name} successfully.")
+        logger.info("Removed VEN %s successfully.", ven_name)
         return web.json_response({"status": "success", "message": f"VEN {ven_name} removed successfully"})
     except UnknownVenError:
-        logger.warning(f"VEN {ven_name} not found.")
+        logger.warning("VEN %s not found.", ven_name)
         return web.json_response({"status": "error", "message": f"VEN {ven_name} not found"}, status=404)
 
 
 async def handle_list_vens(request):
-    ven_list = VEN_REGISTRY.get_all_vens_with_quality()
-    return web.json_response([
-        {
-            "ven_name": ven["ven_name"],
-            "ven_id": ven["ven_id"],
-            "registration_id": ven["registration_id"],
-            "last_report": ven["last_report"],
-            "last_report_units": ven["last_report_units"],
-            "last_report_time": ven["last_report_time"],
-            "connection_quality": ven["connection_quality"]
-        }
-        for ven in ven_list
-    ])
+    """
+    List VENs sorted by name, optionally filtered with name_prefix and
+    online=true/false, and paginated with limit and cursor. The cursor of the
+    next page is returned in the X-Next-Cursor header.
+    """
+    limit = _parse_limit(request)
+    cursor = request.query.get("cursor")
+    name_prefix = request.query.get("name_prefix", "")
+    online = request.query.get("online")
+    if online is not None:
+        online = online.lower() == "true"
+    await VEN_REGISTRY.wait_loaded()
+
+    def build():
+        names = VEN_REGISTRY.sorted_ven_names()
+        if cursor is not None:
+            position = bisect_right(names, _decode_cursor(cursor))
+        else:
+            position = bisect_left(names, name_prefix)
+        items = []
+        for ven_name in names[position:]:
+            if not ven_name.startswith(name_prefix):
+                if ven_name > name_prefix:
+                    break
+                continue
+            ven = VEN_REGISTRY.get_ven_info_from_name(ven_name)
+            if online is not None and ven.online != online:
+                continue
+            if limit is not None and len(items) == limit:
+                return items, _encode_cursor(items[-1]["ven_name"])
+            items.append(VEN_REGISTRY.ven_with_quality(ven))
+        return items, None
+
+    version = (VEN_REGISTRY.listing_version, _listed_report_version())
+    return _cached_json_response(request, version, build)
+
+
+def _listed_report_version():
+    """The report_version of the registry, taken again at most every VEN_LIST_REPORT_REFRESH seconds."""
+    global _LISTED_REPORTS
+    report_version, taken = _LISTED_REPORTS
+    now = _clock()
+    if VEN_REGISTRY.report_version != report_version and now - taken >= VEN_LIST_REPORT_REFRESH:
+        _LISTED_REPORTS = (VEN_REGISTRY.report_version, now)
+    return _LISTED_REPORTS[0]
+
+
+async def handle_list_reports(request):
+    ven_id = request.query.get("ven_id")
+    if not ven_id:
+        raise web.HTTPBadRequest(text="Missing ven_id")
+
+    try:
+        end = datetime.fromisoformat(request.query["to"]) if "to" in request.query else datetime.now(timezone.utc)
+        start = datetime.fromisoformat(request.query["from"]) if "from" in request.query else end - timedelta(hours=1)
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+        if "resolution" in request.query:
+            resolution = float(request.query["resolution"])
+        else:
+            resolution = max(1.0, (end - start).total_seconds() / DEFAULT_REPORT_BUCKETS)
+        series = await TELEMETRY_STORE.query(
+            ven_id, start, end, resolution,
+            resource_id=request.query.get("resource_id"),
+            measurement=request.query.get("measurement"),
+        )
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+
+    return web.json_response({
+        "ven_id": ven_id,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "resolution": resolution,
+        "series": series
+    })
+
+
+async def handle_event_performance(request):
+    """
+    Load shed by the VEN of an event (event_id), or by every VEN of a bulk
+    dispatch (job_id), against each VEN's mean load over the `baseline`
+    minutes (default 60) before the event. ?vens=true adds the figures per VEN.
+    """
+    event_id = request.query.get("event_id")
+    job_id = request.query.get("job_id")
+    if job_id:
+        job = await BULK_DISPATCHER.job_status(job_id, include_results=True)
+        if job is None:
+            raise web.HTTPNotFound(text=f"Dispatch job {job_id} not found")
+        event_ids = [result["event_id"] for result in job["results"].values() if result["status"] == "success"]
+        if not event_ids:
+            raise web.HTTPNotFound(text=f"Dispatch job {job_id} did not create any events")
+    elif event_id:
+        event_ids = [event_id]
+    else:
+        raise web.HTTPBadRequest(text="Missing event_id or job_id")
+
+    periods = [FLEET_AGGREGATOR.event_period(event_id) for event_id in event_ids]
+    periods = [period for period in periods if period is not None]
+    if not periods:
+        found = request.app["server"].find_event(event_ids[0])
+        if found is None:
+            raise web.HTTPNotFound(text=f"Event {event_ids[0]} not found")
+        ven_id, event = found
+        start = event.active_period["dtstart"]
+        periods = [(ven_id, start.timestamp(), (start + event.active_period["duration"]).timestamp())]
+
+    try:
+        baseline = float(request.query.get("baseline", "60")) * 60
+    except ValueError:
+        raise web.HTTPBadRequest(text="Invalid baseline")
+    include_vens = request.query.get("vens", "false").lower() == "true"
+    # the events of a bulk dispatch share their active period
+    start = min(period[1] for period in periods)
+    end = max(period[2] for period in periods)
+    performance = FLEET_AGGREGATOR.performance([period[0] for period in periods], start, end, baseline,
+                                               include_vens=include_vens)
+    return web.json_response({"event_id": event_id, "job_id": job_id, **performance})
+
+
+def _message_auth_stats(server):
+    stats = {"tls": server.ssl_context is not None, "signed": server.signer.signed if server.signer else 0}
+    if server.authenticator is not None:
+        stats.update(server.authenticator.stats())
+    return stats
+
+async def handle_stats(request):
+    return web.json_response({
+        "events": {
+            "live": request.app["server"].event_count,
+            "retired": EVENT_EXPIRY.retired,
+            "archived": EVENT_EXPIRY.archived,
+        },
+        "report_ingest": REPORT_INGEST.stats(),
+        "change_feed": {
+            "clients": CHANGE_FEED.clients,
+            "frames": CHANGE_FEED.frames,
+            "disconnected": CHANGE_FEED.disconnected,
+        },
+        "startup": STARTUP_TIMER.as_dict(),
+        "registration": REGISTRATION_GATE.stats(),
+        "message_auth": _message_auth_stats(request.app["server"]),
+        "fleet_aggregator": {
+            "vens": FLEET_AGGREGATOR.vens,
+            "samples": FLEET_AGGREGATOR.samples,
+            "too_old": FLEET_AGGREGATOR.too_old,
+        },
+        "schedules": {
+            "active": len(EVENT_SCHEDULER.list()),
+            "released": EVENT_SCHEDULER.released_events,
+        },
+    })
+
+async def handle_metrics(request):
+    return web.Response(text=METRICS.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+async def handle_changes(request):
+    """Stream VEN and event changes to the GUI, see change_feed.py."""
+    return await CHANGE_FEED.handle(request)
@@ -0,0 +1,93 @@
+"""
+Benchmark of the load-shed figures for a fleet-wide event.
+
+Feeds `--hours` of 10 second RealPower reports of `--vens` VENs through
+FleetAggregator, with the load dropping during a one hour event, then
+times FleetAggregator.performance against the same figures computed with
+Python loops over the samples of every VEN.
+
+    python benchmarks/bench_event_performance.py [--vens 10000] [--hours 3]
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fleet_aggregator import FleetAggregator  # noqa: E402
+
+REPORT_INTERVAL = 10
+RESOLUTION = 60
+
+
+class _Registry:
+    def get_ven_info_from_id(self, ven_id):
+        return SimpleNamespace(groups=("all",))
+
+
+def python_performance(samples, start, end, baseline):
+    """Baseline, load and shed per bucket the way it would be done without arrays."""
+    buckets = dict()
+    for ven_samples in samples.values():
+        baseline_values = [value for ts, value in ven_samples if start - baseline <= ts < start]
+        if not baseline_values:
+            continue
+        ven_baseline = sum(baseline_values) / len(baseline_values)
+        ven_buckets = dict()
+        for ts, value in ven_samples:
+            if start <= ts < end:
+                ven_buckets.setdefault(int(ts // RESOLUTION), []).append(value)
+        for bucket, values in ven_buckets.items():
+            load = sum(values) / len(values)
+            totals = buckets.setdefault(bucket, [0.0, 0.0])
+            totals[0] += load
+            totals[1] += ven_baseline - load
+    return buckets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vens", type=int, default=10_000)
+    parser.add_argument("--hours", type=float, default=3)
+    args = parser.parse_args()
+
+    end_of_data = datetime(2024, 6, 1, 18, tzinfo=timezone.utc)
+    event_start = end_of_data - timedelta(hours=2)
+    event_end = event_start + timedelta(hours=1)
+    aggregator = FleetAggregator(_Registry(), SimpleNamespace(event_listeners=[]),
+                                 SimpleNamespace(batch_listeners=[]), resolution=RESOLUTION)
+    ven_ids = [f"ven_{i}" for i in range(args.vens)]
+    samples = {ven_id: [] for ven_id in ven_ids}
+
+    started = time.perf_counter()
+    steps = int(args.hours * 3600 / REPORT_INTERVAL)
+    for step in range(steps):
+        ts = end_of_data - timedelta(seconds=REPORT_INTERVAL * (steps - step))
+        value = 7.0 if event_start <= ts < event_end else 10.0
+        aggregator.add_batch([(ven_id, "meter", "RealPower", [(ts, value)]) for ven_id in ven_ids])
+        for ven_id in ven_ids:
+            samples[ven_id].append((ts.timestamp(), value))
+    fill = time.perf_counter() - started
+
+    start, end, baseline = event_start.timestamp(), event_end.timestamp(), 3600
+    started = time.perf_counter()
+    performance = aggregator.performance(ven_ids, start, end, baseline)
+    vectorized = time.perf_counter() - started
+    started = time.perf_counter()
+    python = python_performance(samples, start, end, baseline)
+    loops = time.perf_counter() - started
+
+    total_samples = steps * args.vens
+    print(f"{args.vens} VENs, {total_samples} samples, fed in {fill:.1f}s")
+    print(f"{'method':>12} {'seconds':>10} {'mean shed':>12}")
+    print(f"{'numpy':>12} {vectorized:>10.3f} {performance['mean_shed']:>12.1f}")
+    python_shed = sum(shed for _, shed in python.values()) / max(len(python), 1)
+    print(f"{'python':>12} {loops:>10.3f} {python_shed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
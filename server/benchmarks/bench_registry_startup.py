@@ -0,0 +1,88 @@
+"""
+Startup benchmark for the VEN registry backends.
+
+Writes 100k VENs that each reported CHECK_IN_WINDOW times to the json,
+sqlite and snapshot backends, then times for each of them:
+ - first lookup: opening the storage and looking up one VEN by ven_id,
+   what a VTN that loads lazily does before it can answer a VEN
+ - full load: load_all() and building every VenInfo, what the json backend
+   does before the listener is bound and preload() does in the background
+
+    python benchmarks/bench_registry_startup.py [--vens 100000]
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from registry_storage import create_storage  # noqa: E402
+from ven_registry import CHECK_IN_WINDOW, _record_to_ven_info  # noqa: E402
+
+BACKENDS = ["json", "sqlite", "snapshot"]
+
+
+def make_records(count: int) -> dict:
+    now = datetime.now(timezone.utc).timestamp()
+    return {
+        f"ven_{i}": {
+            "ven_name": f"ven_{i}",
+            "ven_id": str(uuid.uuid4()),
+            "registration_id": str(uuid.uuid4()),
+            "last_report": random.random() * 10,
+            "last_report_units": "RealPower",
+            "last_report_time": datetime.fromtimestamp(now, timezone.utc).isoformat(),
+            "check_in_times": [now - 10 * (CHECK_IN_WINDOW - j) for j in range(CHECK_IN_WINDOW)],
+            "connection_quality": 100.0,
+            "groups": ["site_a"] if i % 2 else [],
+        }
+        for i in range(count)
+    }
+
+
+def bench(backend: str, records: dict, directory: Path):
+    storage = create_storage(backend, directory)
+    storage.write({"upserts": records, "deletes": set()})
+    storage.close()
+    ven_id = random.choice(list(records.values()))["ven_id"]
+
+    started = time.perf_counter()
+    storage = create_storage(backend, directory)
+    if storage.lazy:
+        record = storage.get("ven_id", ven_id)
+    else:
+        record = next(r for r in storage.load_all().values() if r["ven_id"] == ven_id)
+    first_lookup = time.perf_counter() - started
+    assert record["ven_id"] == ven_id
+    storage.close()
+
+    started = time.perf_counter()
+    storage = create_storage(backend, directory)
+    ven_infos = [_record_to_ven_info(record) for record in storage.load_all().values()]
+    full_load = time.perf_counter() - started
+    assert len(ven_infos) == len(records)
+    storage.close()
+    return first_lookup, full_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vens", type=int, default=100_000)
+    args = parser.parse_args()
+    records = make_records(args.vens)
+
+    print(f"{'backend':>10} {'first lookup':>14} {'full load':>12}   ({args.vens} VENs, seconds)")
+    for backend in BACKENDS:
+        with tempfile.TemporaryDirectory() as tmp:
+            first_lookup, full_load = bench(backend, records, Path(tmp))
+        print(f"{backend:>10} {first_lookup:>14.4f} {full_load:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
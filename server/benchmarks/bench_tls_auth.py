@@ -0,0 +1,236 @@
+"""
+Benchmark of the TLS and XML signature work per VEN message.
+
+Makes a throwaway CA with a VTN and a VEN certificate, then measures the
+CPU time of:
+
+- a full TLS handshake with a client certificate and a handshake that
+  resumes the session from a ticket, a request on a kept-alive connection
+  needs neither;
+- signing a response with openleadr's create_message, which reloads the
+  private key each time, and with MessageSigner;
+- checking a signed VEN message with openleadr's authenticate_message and
+  with MessageAuthenticator, which caches the connection fingerprint and
+  the VEN's certificate.
+
+    python benchmarks/bench_tls_auth.py [--handshakes 200] [--messages 500]
+"""
+
+import argparse
+import asyncio
+import ssl
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cryptography import x509  # noqa: E402
+from cryptography.hazmat.primitives import hashes, serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+from cryptography.x509.oid import NameOID  # noqa: E402
+from openleadr import messaging, utils  # noqa: E402
+
+from message_auth import MessageSigner, MessageAuthenticator  # noqa: E402
+
+VEN_ID = "ven_id_1"
+
+
+def _key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def _cert(name, key, issuer_name=None, issuer_key=None, ca=False):
+    now = datetime.now(timezone.utc)
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)])
+    builder = (x509.CertificateBuilder()
+               .subject_name(subject)
+               .issuer_name(issuer_name or subject)
+               .public_key(key.public_key())
+               .serial_number(x509.random_serial_number())
+               .not_valid_before(now - timedelta(days=1))
+               .not_valid_after(now + timedelta(days=1))
+               .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True))
+    if not ca:
+        builder = builder.add_extension(x509.SubjectAlternativeName([x509.DNSName(name)]), critical=False)
+    return builder.sign(issuer_key or key, hashes.SHA256())
+
+
+def make_certificates(directory: Path):
+    """Write ca.crt and vtn/ven .crt and .key files, returns their paths by name."""
+    ca_key = _key()
+    ca_cert = _cert("bench-ca", ca_key, ca=True)
+    files = {"ca.crt": ca_cert.public_bytes(serialization.Encoding.PEM)}
+    for name in ("vtn", "ven"):
+        key = _key()
+        files[f"{name}.key"] = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                                 serialization.NoEncryption())
+        files[f"{name}.crt"] = _cert(f"{name}.local", key, ca_cert.subject, ca_key).public_bytes(
+            serialization.Encoding.PEM)
+    paths = dict()
+    for filename, data in files.items():
+        paths[filename] = directory / filename
+        paths[filename].write_bytes(data)
+    return paths
+
+
+def handshake(client_context, server_context, session=None):
+    """TLS handshake between two in-memory endpoints, returns the client and server ends."""
+    client_in, client_out, server_in, server_out = (ssl.MemoryBIO() for _ in range(4))
+    client = client_context.wrap_bio(client_in, client_out, server_hostname="vtn.local", session=session)
+    server = server_context.wrap_bio(server_in, server_out, server_side=True)
+    client_done = server_done = False
+    while not (client_done and server_done):
+        if not client_done:
+            try:
+                client.do_handshake()
+                client_done = True
+            except ssl.SSLWantReadError:
+                pass
+        server_in.write(client_out.read())
+        if not server_done:
+            try:
+                server.do_handshake()
+                server_done = True
+            except ssl.SSLWantReadError:
+                pass
+        client_in.write(server_out.read())
+    # TLS 1.3 session tickets arrive after the handshake
+    try:
+        client.read()
+    except ssl.SSLWantReadError:
+        pass
+    return client, server
+
+
+def bench_handshakes(paths, count):
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_verify_locations(paths["ca.crt"])
+    server_context.verify_mode = ssl.CERT_REQUIRED
+    server_context.load_cert_chain(paths["vtn.crt"], paths["vtn.key"])
+    server_context.minimum_version = ssl.TLSVersion.TLSv1_2
+    client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    client_context.load_verify_locations(paths["ca.crt"])
+    client_context.load_cert_chain(paths["ven.crt"], paths["ven.key"])
+
+    started = time.process_time()
+    for _ in range(count):
+        client, server = handshake(client_context, server_context)
+    full = (time.process_time() - started) / count
+
+    session = client.session
+    reused = 0
+    started = time.process_time()
+    for _ in range(count):
+        client, server = handshake(client_context, server_context, session=session)
+        reused += client.session_reused
+        session = client.session
+    resumed = (time.process_time() - started) / count
+    # the client certificate is still known on a resumed session
+    assert server.getpeercert(binary_form=True), "no client certificate on the resumed session"
+    return full, resumed, reused
+
+
+class _SslObject:
+    def __init__(self, der_bytes):
+        self._der_bytes = der_bytes
+
+    def getpeercert(self, binary_form=False):
+        return self._der_bytes
+
+
+class _Request(dict):
+    def __init__(self, ssl_object):
+        super().__init__()
+        self.secure = True
+        self.transport = SimpleNamespace(get_extra_info=lambda name: ssl_object)
+
+
+def _signed_messages(ven_signer, count):
+    messages = []
+    for i in range(count):
+        content = ven_signer.create_message("oadrRequestEvent", ven_id=VEN_ID, request_id=f"request-{i}")
+        tree = messaging.validate_xml_schema(content)
+        _, payload = messaging.parse_message(content)
+        messages.append((tree, payload))
+    return messages
+
+
+async def bench_messages(paths, count):
+    vtn_cert, vtn_key = paths["vtn.crt"].read_bytes(), paths["vtn.key"].read_bytes()
+    ven_cert, ven_key = paths["ven.crt"].read_bytes(), paths["ven.key"].read_bytes()
+    fingerprint = utils.certificate_fingerprint(ven_cert)
+    response = {"response_code": 200, "response_description": "OK", "request_id": "request-1"}
+    rows = []
+
+    # signing the responses of the VTN, fewer rounds for openleadr as each takes long
+    rounds = max(1, count // 10)
+    started = time.process_time()
+    for _ in range(rounds):
+        messaging.create_message("oadrResponse", cert=vtn_cert, key=vtn_key, ven_id=VEN_ID, response=response)
+    stock_sign = (time.process_time() - started) / rounds
+    signer = MessageSigner(vtn_cert, vtn_key)
+    started = time.process_time()
+    for _ in range(count):
+        signer.create_message("oadrResponse", ven_id=VEN_ID, response=response)
+    cached_sign = (time.process_time() - started) / count
+    rows.append(("sign response", stock_sign, cached_sign))
+
+    # checking the VEN's messages, each is signed with a fresh nonce
+    ven_signer = MessageSigner(ven_cert, ven_key)
+    registry = SimpleNamespace(listeners=[],
+                               get_ven_info_from_id=lambda ven_id: SimpleNamespace(fingerprint=fingerprint))
+    request = _Request(_SslObject(ssl.PEM_cert_to_DER_cert(ven_cert.decode())))
+
+    def lookup(ven_id):
+        return {"ven_id": ven_id, "registration_id": "reg", "fingerprint": fingerprint}
+
+    messaging.NONCE_CACHE.clear()
+    messages = _signed_messages(ven_signer, count)
+    started = time.process_time()
+    for tree, payload in messages:
+        await messaging.authenticate_message(request, tree, payload, ven_lookup=lookup)
+    stock_verify = (time.process_time() - started) / count
+
+    authenticator = MessageAuthenticator(registry)
+    messages = _signed_messages(ven_signer, count)
+    started = time.process_time()
+    for tree, payload in messages:
+        await authenticator.authenticate(request, tree, payload)
+    cached_verify = (time.process_time() - started) / count
+    rows.append(("verify message", stock_verify, cached_verify))
+
+    trusted = MessageAuthenticator(registry, trust_tls=True)
+    started = time.process_time()
+    for tree, payload in messages:
+        await trusted.authenticate(request, tree, payload)
+    rows.append(("trust TLS", stock_verify, (time.process_time() - started) / count))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--handshakes", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_certificates(Path(directory))
+        full, resumed, reused = bench_handshakes(paths, args.handshakes)
+        rows = asyncio.run(bench_messages(paths, args.messages))
+
+    print(f"TLS handshake, CPU ms of both ends per connection ({ssl.OPENSSL_VERSION})")
+    print(f"{'full':>12} {full * 1000:>10.2f}")
+    print(f"{'resumed':>12} {resumed * 1000:>10.2f}   ({reused}/{args.handshakes} sessions reused)")
+    print()
+    print("Per message, CPU ms")
+    print(f"{'':>16} {'openleadr':>10} {'cached':>10} {'speedup':>8}")
+    for name, before, after in rows:
+        print(f"{name:>16} {before * 1000:>10.3f} {after * 1000:>10.3f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark for VenRegistry lookups.
+
+Registers 10 to 100k VENs in a throwaway registry and times
+get_ven_info_from_id / get_ven_info_from_registration_id /
+get_ven_info_from_name. With the secondary indexes the time per lookup
+should stay flat as the fleet grows.
+
+    python benchmarks/bench_ven_lookup.py
+"""
+
+import asyncio
+import random
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ven_registry import VenRegistry  # noqa: E402
+
+FLEET_SIZES = [10, 100, 1_000, 10_000, 100_000]
+LOOKUPS = 10_000
+
+
+async def fill(registry: VenRegistry, size: int):
+    # run the write-behind flusher so filling the registry does not write per VEN
+    flusher = asyncio.create_task(registry.persistence.run())
+    await asyncio.sleep(0)
+    for i in range(size):
+        registry.add_ven(f"ven_{i}")
+    flusher.cancel()
+
+
+def bench(size: int, directory: Path):
+    registry = VenRegistry(directory, flush_interval=3600, flush_threshold=sys.maxsize)
+    asyncio.run(fill(registry, size))
+    vens = registry.get_all_vens()
+    ven_ids = [random.choice(vens).ven_id for _ in range(LOOKUPS)]
+    registration_ids = [random.choice(vens).registration_id for _ in range(LOOKUPS)]
+    ven_names = [random.choice(vens).ven_name for _ in range(LOOKUPS)]
+
+    def per_lookup(func, keys):
+        total = min(timeit.repeat(lambda: [func(k) for k in keys], number=1, repeat=5))
+        return total / len(keys) * 1e9
+
+    return (
+        per_lookup(registry.get_ven_info_from_id, ven_ids),
+        per_lookup(registry.get_ven_info_from_registration_id, registration_ids),
+        per_lookup(registry.get_ven_info_from_name, ven_names),
+    )
+
+
+def main():
+    print(f"{'VENs':>8} {'by ven_id':>12} {'by reg_id':>12} {'by name':>12}   (ns/lookup)")
+    for size in FLEET_SIZES:
+        with tempfile.TemporaryDirectory() as tmp:
+            by_id, by_registration_id, by_name = bench(size, Path(tmp))
+        print(f"{size:>8} {by_id:>12.0f} {by_registration_id:>12.0f} {by_name:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
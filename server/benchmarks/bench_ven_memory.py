@@ -0,0 +1,104 @@
+"""
+Memory benchmark for the VEN records of VenRegistry.
+
+Registers 100k VENs that each reported CHECK_IN_WINDOW times and prints
+the bytes per VEN held by the records and the id indexes, for the
+namedtuple records with a deque of datetimes the registry used before
+and for the current slotted VenInfo.
+
+    python benchmarks/bench_ven_memory.py [--vens 100000]
+"""
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import uuid
+from array import array
+from collections import deque, namedtuple
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ven_registry import VenRegistry, CHECK_IN_WINDOW  # noqa: E402
+
+# the record VenRegistry kept before VenInfo became a slotted class
+LegacyVenInfo = namedtuple("LegacyVenInfo", ["ven_name", "ven_id", "registration_id", "last_report",
+                                             "last_report_units", "last_report_time", "check_in_times",
+                                             "connection_quality", "online", "groups"],
+                           defaults=[0.0, False, ()])
+
+
+def deep_size(*roots) -> int:
+    """Bytes of the objects reachable from `roots`, each object counted once."""
+    seen = set()
+    stack = list(roots)
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or obj is None or isinstance(obj, (bool, type)):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (tuple, list, set, frozenset, deque)):
+            stack.extend(obj)
+        elif hasattr(type(obj), "__slots__") and not isinstance(obj, (str, bytes, int, float, array, datetime)):
+            stack.extend(getattr(obj, name) for name in type(obj).__slots__ if hasattr(obj, name))
+    return total
+
+
+def check_in_times(start: datetime):
+    return [start + timedelta(seconds=10 * i) for i in range(CHECK_IN_WINDOW)]
+
+
+def legacy_registry(count: int, start: datetime):
+    vens, ven_ids, registration_ids = dict(), dict(), dict()
+    for i in range(count):
+        ven_name = f"ven_{i}"
+        ven_info = LegacyVenInfo(ven_name, str(uuid.uuid4()), str(uuid.uuid4()), None, None, None,
+                                 deque(maxlen=10))
+        for check_in_time in check_in_times(start):
+            ven_info.check_in_times.append(check_in_time)
+            ven_info = ven_info._replace(last_report=1.5, last_report_units="RealPower",
+                                         last_report_time=check_in_time.isoformat(), online=True,
+                                         connection_quality=100.0)
+        vens[ven_name] = ven_info
+        ven_ids[ven_info.ven_id] = ven_name
+        registration_ids[ven_info.registration_id] = ven_name
+    return vens, ven_ids, registration_ids
+
+
+async def current_registry(count: int, start: datetime, directory: Path):
+    registry = VenRegistry(directory, flush_interval=3600, flush_threshold=sys.maxsize)
+    flusher = asyncio.create_task(registry.persistence.run())
+    await asyncio.sleep(0)
+    for i in range(count):
+        ven_name = f"ven_{i}"
+        registry.add_ven(ven_name)
+        for check_in_time in check_in_times(start):
+            registry.update_ven_report(ven_name, 1.5, "RealPower", check_in_time)
+    flusher.cancel()
+    return registry._vens, registry._ven_ids, registry._registration_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vens", type=int, default=100_000)
+    args = parser.parse_args()
+    start = datetime.now(timezone.utc)
+
+    legacy = deep_size(*legacy_registry(args.vens, start))
+    with tempfile.TemporaryDirectory() as tmp:
+        current = deep_size(*asyncio.run(current_registry(args.vens, start, Path(tmp))))
+
+    print(f"{'record':>10} {'total MiB':>10} {'bytes/VEN':>10}   ({args.vens} VENs)")
+    for name, size in (("namedtuple", legacy), ("VenInfo", current)):
+        print(f"{name:>10} {size / 2 ** 20:>10.1f} {size / args.vens:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
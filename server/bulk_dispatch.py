@@ -0,0 +1,143 @@
+# bulk_dispatch.py
+
+import asyncio
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from ven_registry import UnknownVenError
+
+logger = logging.getLogger('openleadr')
+
+
+class DispatchJob:
+    """Progress and per-VEN results of one bulk event dispatch."""
+
+    def __init__(self, ven_ids, signal_name, signal_type):
+        self.job_id = str(uuid.uuid4())
+        self.ven_ids = ven_ids
+        self.signal_name = signal_name
+        self.signal_type = signal_type
+        self.status = "pending"
+        self.created = datetime.now(timezone.utc)
+        self.finished = None
+        self.sent = 0
+        self.duplicates = 0
+        self.errors = 0
+        # ven_id -> {"status": ..., "event_id" or "message": ...}
+        self.results = dict()
+
+    def as_dict(self, include_results: bool = False) -> dict:
+        job = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "signal_name": self.signal_name,
+            "signal_type": self.signal_type,
+            "created": self.created.isoformat(),
+            "finished": self.finished.isoformat() if self.finished else None,
+            "targets": len(self.ven_ids),
+            "processed": len(self.results),
+            "sent": self.sent,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+        }
+        if include_results:
+            job["results"] = self.results
+        return job
+
+
+class BulkDispatcher:
+    """
+    Creates the same event for many VENs in the background.
+
+    Events are added in chunks of `chunk_size` VENs and the dispatcher
+    yields to the event loop between chunks, so polling VENs and other
+    requests are served while a fleet-wide event goes out. The last
+    `max_jobs` jobs are kept for the status endpoint.
+
+    Every callable in `job_listeners` is called with the job when it is
+    submitted, after each chunk and when it finishes. With several workers
+    `shared_jobs` is set to a coroutine function (job_id, include_results)
+    that looks up the jobs of the other workers.
+    """
+
+    def __init__(self, server, registry, callback=None, chunk_size: int = 500, max_jobs: int = 100):
+        self._server = server
+        self._registry = registry
+        self._callback = callback
+        self.chunk_size = chunk_size
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._tasks = set()
+        self.job_listeners = []
+        self.shared_jobs = None
+
+    def submit(self, ven_ids, signal_name: str, signal_type: str, intervals) -> DispatchJob:
+        job = DispatchJob(ven_ids, signal_name, signal_type)
+        self._jobs[job.job_id] = job
+        while len(self._jobs) > self.max_jobs:
+            oldest = next(iter(self._jobs.values()))
+            if oldest.status in ("pending", "running"):
+                break
+            self._jobs.popitem(last=False)
+        task = asyncio.get_running_loop().create_task(self._run(job, intervals))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self._notify(job)
+        return job
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    async def job_status(self, job_id: str, include_results: bool = False):
+        """The job as a dict, also when another worker runs it, or None."""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.as_dict(include_results=include_results)
+        if self.shared_jobs is not None:
+            return await self.shared_jobs(job_id, include_results)
+        return None
+
+    def _notify(self, job: DispatchJob):
+        for listener in self.job_listeners:
+            listener(job)
+
+    async def _run(self, job: DispatchJob, intervals):
+        job.status = "running"
+        try:
+            for start in range(0, len(job.ven_ids), self.chunk_size):
+                for ven_id in job.ven_ids[start:start + self.chunk_size]:
+                    self._dispatch_one(job, ven_id, intervals)
+                self._notify(job)
+                # let polls and other requests through between chunks
+                await asyncio.sleep(0)
+            job.status = "done"
+        except Exception as e:
+            logger.error("Bulk dispatch %s failed: %s", job.job_id, e)
+            job.status = "failed"
+        finally:
+            job.finished = datetime.now(timezone.utc)
+            self._notify(job)
+        logger.info("Bulk dispatch %s %s: %d sent, %d duplicates, %d errors",
+                    job.job_id, job.status, job.sent, job.duplicates, job.errors)
+
+    def _dispatch_one(self, job: DispatchJob, ven_id: str, intervals):
+        try:
+            self._registry.get_ven_info_from_id(ven_id)
+        except UnknownVenError:
+            job.errors += 1
+            job.results[ven_id] = {"status": "error", "message": f"VEN {ven_id} not found"}
+            return
+        if self._server.find_duplicate(ven_id, job.signal_name, job.signal_type, intervals):
+            job.duplicates += 1
+            job.results[ven_id] = {"status": "error", "message": f"Duplicate event detected for VEN {ven_id}"}
+            return
+        try:
+            event_id = self._server.add_event(ven_id, job.signal_name, job.signal_type, intervals,
+                                              callback=self._callback)
+        except ValueError as e:
+            job.errors += 1
+            job.results[ven_id] = {"status": "error", "message": str(e)}
+            return
+        job.sent += 1
+        job.results[ven_id] = {"status": "success", "event_id": event_id}
@@ -0,0 +1,168 @@
+# change_feed.py
+
+import asyncio
+import json
+import logging
+from aiohttp import web
+from ven_registry import VenRegistry, UnknownVenError
+
+logger = logging.getLogger('openleadr')
+
+# frames a client may fall behind before it is disconnected, it reconnects and reloads
+MAX_QUEUED_FRAMES = 100
+# seconds between keep-alive comments on an idle stream
+KEEPALIVE_INTERVAL = 15
+
+
+def event_row(ven_id: str, ven_name: str, event) -> dict:
+    """An event as listed by /api/all_events and sent by the change feed."""
+    return {
+        "ven_id": ven_id,
+        "ven_name": ven_name,
+        "event_id": event.event_descriptor.event_id,
+        "signal_name": event.event_signals[0].signal_name,
+        "signal_type": event.event_signals[0].signal_type,
+        "event_start": event.active_period['dtstart'].isoformat(),
+        "event_duration": event.active_period['duration'].total_seconds() / 60,
+    }
+
+
+class ChangeFeed:
+    """
+    Streams changes of the VENs and events to the GUI as server-sent events.
+
+    Changes are collected from the registry listeners, the server's event
+    listeners and `event_response`, keyed by VEN name, event id and event
+    response, so a burst of changes to the same VEN or event keeps only the
+    latest one. Once per `interval` the pending changes are encoded once as
+    a single frame and queued for every connected client. Nothing is
+    collected while no client is connected.
+
+    A frame is a JSON object with any of
+    {"vens": {"updated": [ven rows], "removed": [ven names]},
+     "events": {"added": [event rows], "cancelled": [event ids], "removed": [event ids]},
+     "responses": [{"ven_id", "event_id", "opt_type"}]}
+    """
+
+    def __init__(self, server, registry: VenRegistry, interval: float = 1.0):
+        self._server = server
+        self._registry = registry
+        self.interval = interval
+        self._clients = set()
+        # ven_name -> VenInfo, or None once removed; rows are built when the frame is sent
+        self._vens = dict()
+        # event_id -> (action, ven_id, event)
+        self._events = dict()
+        # (ven_id, event_id) -> opt_type
+        self._responses = dict()
+        self.frames = 0
+        self.disconnected = 0
+        registry.listeners.append(self._on_ven)
+        server.event_listeners.append(self._on_event)
+
+    @property
+    def clients(self) -> int:
+        return len(self._clients)
+
+    def _on_ven(self, action, ven_info):
+        if self._clients:
+            self._vens[ven_info.ven_name] = None if action == "removed" else ven_info
+
+    def _on_event(self, action, ven_id, event):
+        if self._clients:
+            event_id = event.event_descriptor.event_id
+            previous = self._events.get(event_id)
+            if action == "cancelled" and previous is not None and previous[0] == "added":
+                # the client never saw it, the frame lists it as added and cancelled
+                return
+            self._events[event_id] = (action, ven_id, event)
+
+    def event_response(self, ven_id: str, event_id: str, opt_type: str):
+        """Record a VEN opting in or out of an event."""
+        if self._clients:
+            self._responses[(ven_id, event_id)] = opt_type
+
+    def _ven_name(self, ven_id: str) -> str:
+        try:
+            return self._registry.get_ven_info_from_id(ven_id).ven_name
+        except UnknownVenError:
+            return "Unknown VEN"
+
+    def _frame(self) -> dict:
+        frame = dict()
+        if self._vens:
+            updated = [VenRegistry.ven_with_quality(ven_info) for ven_info in self._vens.values() if ven_info]
+            removed = [ven_name for ven_name, ven_info in self._vens.items() if ven_info is None]
+            frame["vens"] = {"updated": updated, "removed": removed}
+            self._vens = dict()
+        if self._events:
+            events = {"added": [], "cancelled": [], "removed": []}
+            for event_id, (action, ven_id, event) in self._events.items():
+                if action == "added":
+                    events["added"].append(event_row(ven_id, self._ven_name(ven_id), event))
+                    if event.event_descriptor.event_status == "cancelled":
+                        events["cancelled"].append(event_id)
+                else:
+                    events[action].append(event_id)
+            frame["events"] = events
+            self._events = dict()
+        if self._responses:
+            frame["responses"] = [{"ven_id": ven_id, "event_id": event_id, "opt_type": opt_type}
+                                  for (ven_id, event_id), opt_type in self._responses.items()]
+            self._responses = dict()
+        return frame
+
+    def publish(self):
+        """Send the pending changes to every client as one frame."""
+        frame = self._frame()
+        if not frame or not self._clients:
+            return
+        data = f"data: {json.dumps(frame)}\n\n".encode()
+        self.frames += 1
+        for queue in list(self._clients):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                # too slow, end its stream without the stale frames, the client reconnects and reloads the lists
+                self._clients.discard(queue)
+                self.disconnected += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def run(self):
+        """Publish the pending changes every `interval` seconds, start it on the server's event loop."""
+        while True:
+            await asyncio.sleep(self.interval)
+            self.publish()
+
+    async def handle(self, request):
+        """GET /api/changes, a text/event-stream of change frames."""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        queue = asyncio.Queue(maxsize=MAX_QUEUED_FRAMES)
+        self._clients.add(queue)
+        try:
+            # tells the client it is subscribed and can load the lists
+            await response.write(b"event: ready\ndata: {}\n\n")
+            while True:
+                try:
+                    data = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    data = b": keep-alive\n\n"
+                if data is None:
+                    break
+                await response.write(data)
+        except ConnectionResetError:
+            pass
+        finally:
+            self._clients.discard(queue)
+        return response
+
+    def close(self):
+        """End every stream, call this before stopping the server."""
+        for queue in self._clients:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+        self._clients = set()
@@ -0,0 +1,102 @@
+# event_expiry.py
+
+import asyncio
+import heapq
+import json
+import logging
+from dataclasses import asdict, is_dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from openleadr import utils
+
+logger = logging.getLogger('openleadr')
+
+
+def _event_end(event) -> float:
+    active_period = utils.getmember(event, 'active_period')
+    end = utils.getmember(active_period, 'dtstart') + utils.getmember(active_period, 'duration')
+    return end.timestamp()
+
+
+class EventExpiry:
+    """
+    Retires events from the server once dtstart + duration + `grace` seconds
+    have passed.
+
+    Events are kept in a min-heap keyed by end time, so the scheduler sleeps
+    until the next event ends instead of scanning every event. Events that
+    were already removed (cancelled and acknowledged, or completed) are
+    skipped when they come up. Retired events are optionally appended as
+    JSON lines to a daily file in `archive_directory`.
+    """
+
+    def __init__(self, server, grace: float = 300, archive_directory: Path = None):
+        self._server = server
+        self.grace = grace
+        self._archive_directory = archive_directory
+        if archive_directory is not None and not archive_directory.exists():
+            archive_directory.mkdir(parents=True)
+        # (end timestamp, event_id, ven_id)
+        self._heap = []
+        self._wakeup = None
+        self.retired = 0
+        self.archived = 0
+        server.event_listeners.append(self._on_event)
+
+    def _on_event(self, action, ven_id, event):
+        if action != "added":
+            return
+        end = _event_end(event)
+        heapq.heappush(self._heap, (end, utils.getmember(event, 'event_descriptor.event_id'), ven_id))
+        # wake the scheduler up if this event ends before the one it waits for
+        if self._wakeup is not None and self._heap[0][0] == end:
+            self._wakeup.set()
+
+    def retire_due(self, now: float = None):
+        """Retire every event whose grace period is over, returns the retired events."""
+        if now is None:
+            now = datetime.now(timezone.utc).timestamp()
+        retired = []
+        while self._heap and self._heap[0][0] + self.grace <= now:
+            end, event_id, ven_id = heapq.heappop(self._heap)
+            event = self._server.remove_event(ven_id, event_id)
+            if event is not None:
+                retired.append((ven_id, event))
+        self.retired += len(retired)
+        return retired
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._heap:
+                delay = self._heap[0][0] + self.grace - datetime.now(timezone.utc).timestamp()
+            else:
+                delay = None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            retired = self.retire_due()
+            if retired:
+                logger.info("Retired %d completed events", len(retired))
+            if retired and self._archive_directory is not None:
+                lines = [self._archive_line(ven_id, event) for ven_id, event in retired]
+                try:
+                    await loop.run_in_executor(None, self._write_archive, lines)
+                    self.archived += len(lines)
+                except OSError as e:
+                    logger.error("Error archiving retired events: %s", e)
+
+    @staticmethod
+    def _archive_line(ven_id, event) -> str:
+        event = asdict(event) if is_dataclass(event) else event
+        return json.dumps({"ven_id": ven_id, "event": event}, default=str)
+
+    def _write_archive(self, lines):
+        filename = self._archive_directory / f"events-{datetime.now(timezone.utc):%Y-%m-%d}.jsonl"
+        with open(filename, mode="a") as file:
+            file.write("\n".join(lines) + "\n")
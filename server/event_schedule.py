@@ -0,0 +1,301 @@
+# event_schedule.py
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import math
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from write_behind import atomic_write
+
+logger = logging.getLogger('openleadr')
+
+REPEAT_PERIODS = {
+    "once": None,
+    "daily": timedelta(days=1),
+    "weekly": timedelta(weeks=1),
+}
+# seconds between checks for schedules changed by other worker processes
+RELOAD_INTERVAL = 5
+
+
+def expand_intervals(start: datetime, template):
+    """Turn [(duration in minutes, signal payload), ...] into consecutive event intervals from `start`."""
+    intervals = []
+    for minutes, signal_payload in template:
+        duration = timedelta(minutes=minutes)
+        intervals.append({"dtstart": start, "duration": duration, "signal_payload": signal_payload})
+        start += duration
+    return intervals
+
+
+def _zone(time_zone: str):
+    try:
+        return ZoneInfo(time_zone)
+    except (ZoneInfoNotFoundError, TypeError, ValueError):
+        raise ValueError(f"Unknown time zone {time_zone}, use an IANA name like Europe/Amsterdam")
+
+
+class Schedule:
+    """
+    An event template and when to send it: the first start, how it repeats
+    and how many times (`count`) or until when (`until`) it does. Each
+    occurrence is released `lead_time` before it starts.
+
+    Repeats step in the wall time of `time_zone`, an IANA name, so a daily
+    event at 17:00 stays at 17:00 local time across DST changes. Start
+    times are aware datetimes and are returned in UTC.
+    """
+
+    def __init__(self, name: str, signal_name: str, signal_type: str, template, first_start: datetime,
+                 targets: dict, repeat: str = "once", count: int = None, until: datetime = None,
+                 lead_time: timedelta = timedelta(hours=1), schedule_id: str = None, released: int = 0,
+                 last_job_id: str = None, time_zone: str = "UTC"):
+        if repeat not in REPEAT_PERIODS:
+            raise ValueError(f"Unknown repeat {repeat}, use one of {', '.join(REPEAT_PERIODS)}")
+        if first_start.tzinfo is None or (until is not None and until.tzinfo is None):
+            raise ValueError("Schedule times must be timezone aware")
+        self.time_zone = time_zone
+        self._zone = _zone(time_zone)
+        self.schedule_id = schedule_id or str(uuid.uuid4())
+        self.name = name
+        self.signal_name = signal_name
+        self.signal_type = signal_type
+        # [(duration in minutes, signal payload), ...]
+        self.template = [tuple(interval) for interval in template]
+        self.first_start = first_start.astimezone(timezone.utc)
+        # {"all": bool, "groups": [...], "ven_ids": [...]}
+        self.targets = targets
+        self.repeat = repeat
+        self.count = count
+        self.until = until
+        self.lead_time = lead_time
+        # number of the next occurrence, occurrences before it were released or skipped
+        self.released = released
+        self.last_job_id = last_job_id
+        self.duration = timedelta(minutes=sum(minutes for minutes, _ in self.template))
+
+    def occurrence_start(self, number: int):
+        """Start of occurrence `number`, or None if the schedule has ended by then."""
+        period = REPEAT_PERIODS[self.repeat]
+        if period is None:
+            return self.first_start if number == 0 else None
+        if self.count is not None and number >= self.count:
+            return None
+        start = self._start(number)
+        if self.until is not None and start > self.until:
+            return None
+        return start
+
+    def _start(self, number: int) -> datetime:
+        # aware datetime arithmetic keeps the wall time, the UTC offset follows it
+        local = self.first_start.astimezone(self._zone) + number * REPEAT_PERIODS[self.repeat]
+        return local.astimezone(timezone.utc)
+
+    def skip_past(self, now: datetime):
+        """Skip the occurrences that are over already, one that ends exactly at `now` is over."""
+        period = REPEAT_PERIODS[self.repeat]
+        if period is None:
+            if self.released == 0 and self.first_start + self.duration <= now:
+                self.released = 1
+            return
+        # a DST change moves the occurrences by up to an hour from the estimate
+        over = max(0, math.ceil((now - self.duration - self.first_start) / period))
+        while self._start(over) + self.duration <= now:
+            over += 1
+        while over > 0 and self._start(over - 1) + self.duration > now:
+            over -= 1
+        self.released = max(self.released, over)
+
+    def as_dict(self) -> dict:
+        next_start = self.occurrence_start(self.released)
+        return {
+            "schedule_id": self.schedule_id,
+            "name": self.name,
+            "signal_name": self.signal_name,
+            "signal_type": self.signal_type,
+            "intervals": [list(interval) for interval in self.template],
+            "first_start": self.first_start.isoformat(),
+            "repeat": self.repeat,
+            "count": self.count,
+            "until": self.until.isoformat() if self.until else None,
+            "time_zone": self.time_zone,
+            "lead_time": self.lead_time.total_seconds() / 60,
+            "targets": self.targets,
+            "released": self.released,
+            "last_job_id": self.last_job_id,
+            "next_start": next_start.isoformat() if next_start else None,
+            "next_release": (next_start - self.lead_time).isoformat() if next_start else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(
+            name=data["name"],
+            signal_name=data["signal_name"],
+            signal_type=data["signal_type"],
+            template=data["intervals"],
+            first_start=datetime.fromisoformat(data["first_start"]),
+            targets=data["targets"],
+            repeat=data["repeat"],
+            count=data["count"],
+            until=datetime.fromisoformat(data["until"]) if data["until"] else None,
+            lead_time=timedelta(minutes=data["lead_time"]),
+            schedule_id=data["schedule_id"],
+            released=data["released"],
+            last_job_id=data["last_job_id"],
+            # schedules saved before time zones were supported repeat in UTC
+            time_zone=data.get("time_zone", "UTC"),
+        )
+
+
+class EventScheduler:
+    """
+    Releases scheduled events to their VENs through the BulkDispatcher.
+
+    The next occurrence of every schedule is expanded into its intervals
+    when it is queued and kept in a min-heap keyed by release time, so the
+    scheduler sleeps until the next release instead of scanning the
+    schedules. At release time the targets are resolved to VENs and the
+    event goes out as one bulk dispatch, sharing the precomputed intervals.
+
+    Schedules are kept in `filename`. With several worker processes only
+    the one with `release=True` sends events, it picks up schedules added
+    on the other workers from the file.
+    """
+
+    def __init__(self, filename: Path, dispatcher, registry, lead_time: timedelta = timedelta(hours=1),
+                 release: bool = True):
+        self._filename = filename
+        self._dispatcher = dispatcher
+        self._registry = registry
+        # used for schedules that do not set their own
+        self.lead_time = lead_time
+        self.release = release
+        self._schedules = dict()
+        # (release timestamp, sequence, schedule_id, occurrence number, intervals)
+        self._heap = []
+        self._sequence = itertools.count()
+        self._wakeup = None
+        self._loaded_mtime = None
+        self.released_events = 0
+        self._load()
+
+    def _load(self):
+        if not self._filename.exists():
+            return
+        self._loaded_mtime = self._filename.stat().st_mtime
+        with open(self._filename, mode="r") as file:
+            schedules = [Schedule.from_dict(data) for data in json.load(file)]
+        self._schedules = {schedule.schedule_id: schedule for schedule in schedules}
+        self._heap = []
+        now = datetime.now(timezone.utc)
+        for schedule in schedules:
+            self._queue(schedule, now)
+
+    def _save(self, changed=(), removed=()):
+        if self._filename.exists() and self._filename.stat().st_mtime != self._loaded_mtime:
+            # another worker changed the schedules, apply ours to its version
+            schedules = self._schedules
+            self._load()
+            for schedule_id in changed:
+                self._schedules[schedule_id] = schedules[schedule_id]
+                self._queue(schedules[schedule_id], datetime.now(timezone.utc))
+            for schedule_id in removed:
+                self._schedules.pop(schedule_id, None)
+        data = json.dumps([schedule.as_dict() for schedule in self._schedules.values()], indent=2)
+        atomic_write(self._filename, data.encode())
+        self._loaded_mtime = self._filename.stat().st_mtime
+
+    def _queue(self, schedule: Schedule, now: datetime):
+        schedule.skip_past(now)
+        start = schedule.occurrence_start(schedule.released)
+        if start is None:
+            return
+        intervals = expand_intervals(start, schedule.template)
+        release_at = (start - schedule.lead_time).timestamp()
+        heapq.heappush(self._heap, (release_at, next(self._sequence), schedule.schedule_id, schedule.released,
+                                    intervals))
+        if self._wakeup is not None and self._heap[0][0] == release_at:
+            self._wakeup.set()
+
+    def add(self, schedule: Schedule) -> Schedule:
+        self._schedules[schedule.schedule_id] = schedule
+        self._queue(schedule, datetime.now(timezone.utc))
+        self._save(changed=[schedule.schedule_id])
+        return schedule
+
+    def remove(self, schedule_id: str):
+        """Remove a schedule, returns it or None. Events it already released stay."""
+        schedule = self._schedules.pop(schedule_id, None)
+        if schedule is not None:
+            # its heap entry is skipped when it comes up
+            self._save(removed=[schedule_id])
+        return schedule
+
+    def get(self, schedule_id: str):
+        return self._schedules.get(schedule_id)
+
+    def list(self):
+        return sorted(self._schedules.values(), key=lambda schedule: schedule.first_start)
+
+    async def _resolve_targets(self, targets: dict):
+        await self._registry.wait_loaded()
+        if targets.get("all"):
+            return [ven.ven_id for ven in self._registry.get_all_vens()]
+        ven_ids = [ven.ven_id for ven in self._registry.get_vens_in_groups(targets.get("groups", []))]
+        ven_ids.extend(targets.get("ven_ids", []))
+        return list(dict.fromkeys(ven_ids))
+
+    async def release_due(self, now: float = None):
+        """Release every occurrence whose release time has come, returns the number released."""
+        if now is None:
+            now = datetime.now(timezone.utc).timestamp()
+        released = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, schedule_id, number, intervals = heapq.heappop(self._heap)
+            schedule = self._schedules.get(schedule_id)
+            if schedule is None or schedule.released != number:
+                # removed, or replaced by a reload
+                continue
+            ven_ids = await self._resolve_targets(schedule.targets)
+            if ven_ids:
+                job = self._dispatcher.submit(ven_ids, schedule.signal_name, schedule.signal_type, intervals)
+                schedule.last_job_id = job.job_id
+                logger.info("Schedule %s released %s to %d VENs as bulk dispatch %s",
+                            schedule.name, intervals[0]["dtstart"].isoformat(), len(ven_ids), job.job_id)
+            else:
+                logger.warning("Schedule %s has no VENs to release %s to",
+                               schedule.name, intervals[0]["dtstart"].isoformat())
+            schedule.released = number + 1
+            self._queue(schedule, datetime.now(timezone.utc))
+            released.append(schedule_id)
+        if released:
+            self.released_events += len(released)
+            self._save(changed=released)
+        return len(released)
+
+    async def run(self):
+        """Release scheduled events, start it on the server's event loop."""
+        self._wakeup = asyncio.Event()
+        while True:
+            if self._filename.exists() and self._filename.stat().st_mtime != self._loaded_mtime:
+                self._load()
+            delay = RELOAD_INTERVAL
+            if self.release and self._heap:
+                delay = min(delay, self._heap[0][0] - datetime.now(timezone.utc).timestamp())
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            if self.release:
+                try:
+                    await self.release_due()
+                except Exception as e:
+                    logger.error("Error releasing scheduled events: %s", e)
@@ -0,0 +1,213 @@
+# fleet_aggregator.py
+
+import math
+from datetime import datetime, timezone
+import numpy as np
+from ven_registry import UnknownVenError
+
+# columns added at a time when a new VEN reports
+COLUMN_GROWTH = 1024
+
+
+def _column_means(values):
+    """Mean of every column over its non-NaN values, NaN for columns without any."""
+    counts = (~np.isnan(values)).sum(axis=0)
+    totals = np.nan_to_num(values).sum(axis=0)
+    return np.where(counts > 0, totals / np.maximum(counts, 1), np.nan)
+
+
+class FleetAggregator:
+    """
+    Recent report values of every VEN in NumPy arrays, for fleet-wide
+    load-shed figures.
+
+    Samples of `measurement` are averaged into buckets of `resolution`
+    seconds. The buckets of the last `window` seconds are kept in a ring of
+    rows, with a column per reporting VEN resource, as a float32 sum and a
+    uint16 sample count per cell. The report ingest consumer adds each batch
+    with one scatter-add, and a query slices the rows of a time range and
+    the columns of the VENs it covers and reduces them as whole arrays.
+
+    The active period of every event added to the server is remembered for
+    as long as it lies in the window, so events can be evaluated after they
+    have been retired.
+    """
+
+    def __init__(self, registry, server, report_ingest, measurement: str = "RealPower", resolution: float = 60,
+                 window: float = 24 * 60 * 60):
+        self._registry = registry
+        self.measurement = measurement
+        self.resolution = resolution
+        self.rows = max(1, math.ceil(window / resolution))
+        self._sums = np.zeros((self.rows, 0), dtype=np.float32)
+        self._counts = np.zeros((self.rows, 0), dtype=np.uint16)
+        # absolute bucket number held by each row, -1 for none
+        self._row_buckets = np.full(self.rows, -1, dtype=np.int64)
+        self._newest_bucket = -1
+        # (ven_id, resource_id) -> column, and the ven_id of every column
+        self._columns = dict()
+        self._column_vens = []
+        # event_id -> (ven_id, start timestamp, end timestamp)
+        self._events = dict()
+        self._events_pruned = 0
+        self.samples = 0
+        self.too_old = 0
+        server.event_listeners.append(self._on_event)
+        report_ingest.batch_listeners.append(self.add_batch)
+
+    @property
+    def vens(self) -> int:
+        return len(set(self._column_vens))
+
+    def _on_event(self, action, ven_id, event):
+        if action != "added":
+            return
+        start = event.active_period["dtstart"]
+        end = start + event.active_period["duration"]
+        self._events[event.event_descriptor.event_id] = (ven_id, start.timestamp(), end.timestamp())
+        if len(self._events) >= 2 * self._events_pruned + 1000:
+            # forget the events that ended before the window
+            oldest = (self._newest_bucket - self.rows + 1) * self.resolution
+            self._events = {event_id: period for event_id, period in self._events.items() if period[2] >= oldest}
+            self._events_pruned = len(self._events)
+
+    def event_period(self, event_id: str):
+        """(ven_id, start, end) of an event seen by the aggregator, or None."""
+        return self._events.get(event_id)
+
+    def _column(self, ven_id: str, resource_id: str) -> int:
+        key = (ven_id, resource_id)
+        column = self._columns.get(key)
+        if column is None:
+            column = self._columns[key] = len(self._column_vens)
+            self._column_vens.append(ven_id)
+            if column >= self._sums.shape[1]:
+                extra = (self.rows, COLUMN_GROWTH)
+                self._sums = np.hstack((self._sums, np.zeros(extra, dtype=np.float32)))
+                self._counts = np.hstack((self._counts, np.zeros(extra, dtype=np.uint16)))
+        return column
+
+    def add_batch(self, batch):
+        """Add the (ven_id, resource_id, measurement, [(time, value), ...]) reports of an ingest batch."""
+        columns, times, values = [], [], []
+        for ven_id, resource_id, measurement, data in batch:
+            if measurement != self.measurement:
+                continue
+            column = self._column(ven_id, resource_id)
+            for time, value in data:
+                try:
+                    values.append(float(value))
+                except (TypeError, ValueError):
+                    continue
+                times.append(time.timestamp())
+                columns.append(column)
+        if not values:
+            return
+        columns = np.array(columns, dtype=np.intp)
+        values = np.array(values, dtype=np.float32)
+        buckets = (np.array(times) // self.resolution).astype(np.int64)
+
+        self._newest_bucket = max(self._newest_bucket, int(buckets.max()))
+        recent = buckets > self._newest_bucket - self.rows
+        rows = buckets % self.rows
+        # rows still holding an older bucket are reused for the new one
+        reuse = recent & (self._row_buckets[rows] < buckets)
+        reused_rows = rows[reuse]
+        self._sums[reused_rows] = 0
+        self._counts[reused_rows] = 0
+        self._row_buckets[reused_rows] = buckets[reuse]
+        keep = recent & (self._row_buckets[rows] == buckets)
+        np.add.at(self._sums, (rows[keep], columns[keep]), values[keep])
+        np.add.at(self._counts, (rows[keep], columns[keep]), 1)
+        self.samples += int(keep.sum())
+        self.too_old += int(len(keep) - keep.sum())
+
+    def _means(self, first_bucket: int, last_bucket: int, columns):
+        """Mean per bucket and column for buckets first..last, NaN where nothing was reported."""
+        buckets = np.arange(max(first_bucket, self._newest_bucket - self.rows + 1), last_bucket + 1)
+        rows = buckets % self.rows
+        held = self._row_buckets[rows] == buckets
+        index = np.ix_(rows, columns)
+        counts = self._counts[index].astype(np.float64)
+        counts[~held] = 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, self._sums[index] / counts, np.nan)
+        return buckets, means
+
+    def performance(self, ven_ids, start: float, end: float, baseline: float, include_vens: bool = False) -> dict:
+        """
+        Load of the VENs during start..end against their baseline, the mean
+        load of each VEN resource over the `baseline` seconds before start.
+        Shed is baseline minus load, summed over the VENs that reported both.
+        """
+        wanted = set(ven_ids)
+        columns = np.array([column for column, ven_id in enumerate(self._column_vens) if ven_id in wanted],
+                           dtype=np.intp)
+        first = int(start // self.resolution)
+        last = int(math.ceil(end / self.resolution)) - 1
+        _, baseline_means = self._means(first - int(math.ceil(baseline / self.resolution)), first - 1, columns)
+        buckets, means = self._means(first, min(last, self._newest_bucket), columns)
+
+        column_baselines = _column_means(baseline_means)
+        sheds = column_baselines - means
+        loads = np.nan_to_num(means).sum(axis=1)
+        shed_per_bucket = np.nan_to_num(sheds).sum(axis=1)
+        reporting_per_bucket = (~np.isnan(means)).sum(axis=1)
+
+        # per VEN, summed over its resources
+        column_vens = [self._column_vens[column] for column in columns]
+        ven_list = list(dict.fromkeys(column_vens))
+        ven_positions = {ven_id: i for i, ven_id in enumerate(ven_list)}
+        ven_index = np.array([ven_positions[ven_id] for ven_id in column_vens], dtype=np.intp)
+        column_shed = _column_means(sheds)
+        ven_shed = np.bincount(ven_index, weights=np.nan_to_num(column_shed), minlength=len(ven_list))
+        ven_load = np.bincount(ven_index, weights=np.nan_to_num(_column_means(means)), minlength=len(ven_list))
+        ven_baseline = np.bincount(ven_index, weights=np.nan_to_num(column_baselines), minlength=len(ven_list))
+        ven_evaluated = np.bincount(ven_index, weights=~np.isnan(column_shed), minlength=len(ven_list)) > 0
+
+        groups = dict()
+        for i, ven_id in enumerate(ven_list):
+            if not ven_evaluated[i]:
+                continue
+            try:
+                ven_groups = self._registry.get_ven_info_from_id(ven_id).groups
+            except UnknownVenError:
+                continue
+            for group in ven_groups:
+                totals = groups.setdefault(group, {"vens": 0, "baseline": 0.0, "load": 0.0, "shed": 0.0})
+                totals["vens"] += 1
+                totals["baseline"] += float(ven_baseline[i])
+                totals["load"] += float(ven_load[i])
+                totals["shed"] += float(ven_shed[i])
+
+        result = {
+            "measurement": self.measurement,
+            "start": datetime.fromtimestamp(start, timezone.utc).isoformat(),
+            "end": datetime.fromtimestamp(end, timezone.utc).isoformat(),
+            "baseline_start": datetime.fromtimestamp(start - baseline, timezone.utc).isoformat(),
+            "resolution": self.resolution,
+            "vens": len(wanted),
+            "reporting": len(ven_list),
+            "evaluated": int(ven_evaluated.sum()),
+            "baseline": float(ven_baseline[ven_evaluated].sum()),
+            "mean_load": float(ven_load[ven_evaluated].sum()),
+            "mean_shed": float(ven_shed[ven_evaluated].sum()),
+            # shed integrated over the buckets so far, in measurement units times hours
+            "shed_energy": float(shed_per_bucket.sum() * self.resolution / 3600),
+            "buckets": [
+                {
+                    "time": datetime.fromtimestamp(bucket * self.resolution, timezone.utc).isoformat(),
+                    "load": float(load),
+                    "shed": float(shed),
+                    "reporting": int(reporting),
+                }
+                for bucket, load, shed, reporting in zip(buckets, loads, shed_per_bucket, reporting_per_bucket)
+            ],
+            "groups": groups,
+        }
+        if include_vens:
+            result["ven_results"] = {
+                ven_id: {"baseline": float(ven_baseline[i]), "load": float(ven_load[i]), "shed": float(ven_shed[i])}
+                for i, ven_id in enumerate(ven_list) if ven_evaluated[i]
+            }
+        return result
@@ -0,0 +1,173 @@
+# log_config.py
+
+import atexit
+import json
+import logging
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+# rate limit entries kept before the expired ones are dropped
+MAX_RATE_KEYS = 100000
+
+
+def log_category(category: str, key=None) -> dict:
+    """
+    `extra` for a log call that falls under the rate limit of `category`,
+    counted separately per `key`, for example the VEN id:
+
+        logger.debug("VEN %s reported", ven_id, extra=log_category("report", ven_id))
+    """
+    return {"category": category, "rate_key": key}
+
+
+def parse_rate_limits(value: str) -> dict:
+    """Parse "report=60,vtn_service=10" into {category: seconds between records}."""
+    limits = dict()
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        category, _, seconds = item.partition("=")
+        try:
+            limits[category.strip()] = float(seconds)
+        except ValueError:
+            raise ValueError(f"Invalid log rate limit {item!r}, expected category=seconds")
+    return limits
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most one record per category and key every `period`
+    seconds. The category is taken from the record's `category` extra, or
+    is the name of the module that logged it, so messages of openleadr
+    itself can be limited too (vtn_service, event_service, ...). The
+    number of records dropped in between is attached to the next one that
+    passes as `suppressed`. Errors are never dropped.
+    """
+
+    def __init__(self, limits: dict):
+        super().__init__()
+        self.limits = limits
+        # (category, key) -> [time of the last record let through, records dropped since]
+        self._seen = dict()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def filter(self, record) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        category = getattr(record, "category", None) or record.module
+        period = self.limits.get(category)
+        if period is None:
+            return True
+        key = (category, getattr(record, "rate_key", None))
+        with self._lock:
+            seen = self._seen.get(key)
+            if seen is None:
+                if len(self._seen) >= MAX_RATE_KEYS:
+                    self._prune(record.created)
+                self._seen[key] = [record.created, 0]
+                return True
+            if record.created - seen[0] < period:
+                seen[1] += 1
+                self.dropped += 1
+                return False
+            if seen[1]:
+                record.suppressed = seen[1]
+            seen[0] = record.created
+            seen[1] = 0
+        return True
+
+    def _prune(self, now: float):
+        self._seen = {key: seen for key, seen in self._seen.items() if now - seen[0] < self.limits[key[0]]}
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" ({suppressed} similar messages suppressed)"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, `fields` are added to every record (e.g. the worker id)."""
+
+    def __init__(self, fields=None):
+        super().__init__()
+        self.fields = fields or dict()
+
+    def format(self, record) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+            **self.fields,
+        }
+        category = getattr(record, "category", None)
+        if category is not None:
+            entry["category"] = category
+            if record.rate_key is not None:
+                entry["key"] = record.rate_key
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Puts records on the queue as they are. QueueHandler formats the message
+    in the logging thread, here that is left to the listener thread, so
+    log arguments should not be changed after the call.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(level: str = "INFO", fmt: str = "text", rate_limits=None, log_file=None,
+                      fields=None, name: str = "openleadr") -> QueueListener:
+    """
+    Send the records of logger `name` through a queue to a listener thread
+    that formats and writes them to stdout and optionally `log_file`, so
+    the event loop only pays for creating the record. Replaces openleadr's
+    enable_default_logging. The listener is stopped, and the queue
+    drained, when the process exits.
+    """
+    if fmt == "json":
+        formatter = JsonFormatter(fields)
+    elif fmt == "text":
+        formatter = TextFormatter(TEXT_FORMAT)
+    else:
+        raise ValueError(f"Unknown log format {fmt}, use text or json")
+    handlers = [logging.StreamHandler(stream=sys.stdout)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(records)
+    if rate_limits:
+        queue_handler.addFilter(RateLimitFilter(rate_limits))
+
+    logger = logging.getLogger(name)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,10 +1,45 @@
+import time
+# taken before the other imports, so the startup times include them
+STARTED = time.perf_counter()
+
 import asyncio
+import math
+import os
+import signal
+import sys
+from datetime import timedelta
 from aiohttp import web
 import aiohttp_cors
 import logging
 from ven_registry import VenRegistry, UnknownVenError, DuplicateVenError
+from registry_storage import JsonRegistryStorage, create_storage, migrate
+from telemetry_store import TelemetryStore
+from bulk_dispatch import BulkDispatcher
+from event_expiry import EventExpiry
+from report_ingest import ReportIngest
+from shared_state import SharedState
+from metrics import VtnMetrics
+from change_feed import ChangeFeed
+from fleet_aggregator import FleetAggregator
+from startup import StartupTimer
+from registration import RegistrationGate
+from event_schedule import EventScheduler
+from message_auth import MessageAuthenticator
+from sticky_proxy import ProxiedRequests
 from adr_utils import (
     set_ven_registry,
+    set_vtn_server,
+    set_telemetry_store,
+    set_bulk_dispatcher,
+    set_event_expiry,
+    set_report_ingest,
+    set_metrics,
+    set_change_feed,
+    set_startup_timer,
+    set_event_scheduler,
+    set_fleet_aggregator,
+    set_registration_gate,
+    ven_lookup,
     on_create_party_registration,
     on_cancel_party_registration,
     on_register_report,
@@ -16,33 +51,220 @@ from adr_utils import (
     handle_cancel_event,
     handle_remove_ven,
     handle_list_vens,
+    handle_list_reports,
+    handle_ven_groups_post,
+    handle_ven_fingerprint_post,
+    handle_list_groups,
+    handle_bulk_event_post,
+    handle_bulk_event_status,
+    handle_schedule_post,
+    handle_list_schedules,
+    handle_remove_schedule,
+    handle_event_performance,
+    handle_stats,
+    handle_metrics,
+    handle_changes,
     event_response_callback
 )
-from openleadr import OpenADRServer, enable_default_logging
+from log_config import configure_logging, parse_rate_limits
+from vtn_server import VtnServer, create_ssl_context
 from pathlib import Path
 from dotenv import load_dotenv
 
-# Enable default logging
-enable_default_logging(level=logging.INFO)
+# Load environment variables
+load_dotenv()
+
+# Log through a queue so formatting and writing happen off the event loop
+configure_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    fmt=os.getenv("LOG_FORMAT", "text"),
+    rate_limits=parse_rate_limits(os.getenv("LOG_RATE_LIMITS", "report=60,registration=60")),
+    log_file=os.getenv("LOG_FILE"),
+    fields={"worker": os.getenv("VTN_WORKER_ID")} if os.getenv("VTN_WORKER_ID") else None,
+)
 logger = logging.getLogger('openleadr')
 
-# Enable logging and load environment variables
-load_dotenv()
+# Directory the registry, telemetry and archived events are kept in
+data_directory = Path(os.getenv("VTN_DATA_DIR", Path(__file__).parent))
 
 # Create VEN registry
-ven_registry_directory = Path(__file__).parent / "registered_vens"
-VEN_REGISTRY = VenRegistry(ven_registry_directory)
+ven_registry_directory = data_directory / "registered_vens"
+registry_backend = os.getenv("REGISTRY_BACKEND", "sqlite")
+registry_storage = create_storage(registry_backend, ven_registry_directory)
+
+# Import an existing vens.json the first time the SQLite or snapshot backend is used
+legacy_storage = JsonRegistryStorage(ven_registry_directory / "vens.json")
+if registry_backend != "json" and not registry_storage.exists() and legacy_storage.exists():
+    migrated = migrate(legacy_storage, registry_storage)
+    logger.info("Imported %d VENs from vens.json into the %s registry", migrated, registry_backend)
+
+# Address of the VTN, and the number of worker processes serving it
+vtn_host = os.getenv("VTN_HOST", "127.0.0.1")
+vtn_port = int(os.getenv("VTN_PORT", "8080"))
+vtn_workers = int(os.getenv("VTN_WORKERS", "1"))
+worker_id = os.getenv("VTN_WORKER_ID")
+
+# With several workers this process only supervises them, each worker runs this script again
+if vtn_workers > 1 and worker_id is None:
+    if registry_backend != "sqlite":
+        sys.exit("VTN_WORKERS > 1 needs the sqlite registry backend")
+    from supervisor import run_workers
+    # with sticky routing the proxy terminates TLS for the workers
+    run_workers(vtn_workers, routing=os.getenv("VTN_ROUTING", "reuseport"), host=vtn_host, port=vtn_port,
+                ssl_context=create_ssl_context(os.getenv("VTN_HTTP_CERT"), os.getenv("VTN_HTTP_KEY"),
+                                               os.getenv("VTN_HTTP_KEY_PASSPHRASE"), os.getenv("VTN_CA_FILE"),
+                                               tls_tickets=int(os.getenv("VTN_TLS_TICKETS", "2"))),
+                keepalive_timeout=float(os.getenv("VTN_KEEPALIVE_TIMEOUT", "75")))
+    sys.exit(0)
+
+# Set by the supervisor on workers behind the sticky proxy, which serves HTTPS in their place
+proxy_secret = os.getenv("VTN_PROXY_SECRET")
+
+VEN_REGISTRY = VenRegistry(
+    ven_registry_directory,
+    storage=registry_storage,
+    flush_interval=float(os.getenv("REGISTRY_FLUSH_INTERVAL", "5")),
+    flush_threshold=int(os.getenv("REGISTRY_FLUSH_THRESHOLD", "500")),
+    quality_window=int(os.getenv("VEN_QUALITY_WINDOW", "10")),
+    offline_after=float(os.getenv("VEN_OFFLINE_AFTER", "30")),
+)
 set_ven_registry(VEN_REGISTRY)
 
-# Create the OpenADRServer instance
-server = OpenADRServer(vtn_id="bens_vtn")
+# Create the telemetry store that keeps the report history
+telemetry_directory = data_directory / "telemetry"
+TELEMETRY_STORE = TelemetryStore(
+    telemetry_directory,
+    retention_days=int(os.getenv("TELEMETRY_RETENTION_DAYS", "30")),
+    flush_interval=float(os.getenv("TELEMETRY_FLUSH_INTERVAL", "10")),
+    worker_id=worker_id,
+)
+set_telemetry_store(TELEMETRY_STORE)
+
+# Reports are queued by on_update_report and processed in batches
+REPORT_INGEST = ReportIngest(
+    VEN_REGISTRY,
+    TELEMETRY_STORE,
+    max_queue=int(os.getenv("REPORT_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("REPORT_BATCH_SIZE", "1000")),
+    policy=os.getenv("REPORT_OVERLOAD_POLICY", "drop"),
+)
+set_report_ingest(REPORT_INGEST)
+
+# Create the OpenADRServer instance. Messages are signed when VTN_CERT and VTN_KEY are set, and
+# VENs connect over HTTPS with client certificates when VTN_HTTP_CERT, VTN_HTTP_KEY and VTN_CA_FILE are
+server = VtnServer(
+    vtn_id="bens_vtn",
+    http_host=os.getenv("VTN_WORKER_HOST", vtn_host),
+    http_port=int(os.getenv("VTN_WORKER_PORT", vtn_port)),
+    reuse_port=os.getenv("VTN_REUSE_PORT", "false").lower() == "true",
+    cert=os.getenv("VTN_CERT"),
+    key=os.getenv("VTN_KEY"),
+    passphrase=os.getenv("VTN_KEY_PASSPHRASE"),
+    show_fingerprint=False,
+    http_cert=None if proxy_secret else os.getenv("VTN_HTTP_CERT"),
+    http_key=None if proxy_secret else os.getenv("VTN_HTTP_KEY"),
+    http_key_passphrase=os.getenv("VTN_HTTP_KEY_PASSPHRASE"),
+    http_ca_file=None if proxy_secret else os.getenv("VTN_CA_FILE"),
+    ven_lookup=ven_lookup,
+    keepalive_timeout=float(os.getenv("VTN_KEEPALIVE_TIMEOUT", "75")),
+    tls_tickets=int(os.getenv("VTN_TLS_TICKETS", "2")),
+    # the client certificate is checked against the VEN's fingerprint once per connection and the
+    # certificate a VEN signs with once, VTN_TRUST_TLS skips the message signatures of checked connections
+    authenticator=MessageAuthenticator(VEN_REGISTRY, trust_tls=os.getenv("VTN_TRUST_TLS", "false").lower() == "true"),
+)
+set_vtn_server(server)
+if proxy_secret:
+    server.app.middlewares.append(ProxiedRequests(proxy_secret).middleware)
+
+# Bulk event dispatch to VEN groups runs in the background
+BULK_DISPATCHER = BulkDispatcher(
+    server,
+    VEN_REGISTRY,
+    callback=event_response_callback,
+    chunk_size=int(os.getenv("BULK_DISPATCH_CHUNK_SIZE", "500")),
+)
+set_bulk_dispatcher(BULK_DISPATCHER)
+
+# Retire events once they are over, optionally archiving them for audit
+archive_directory = data_directory / "archived_events"
+EVENT_EXPIRY = EventExpiry(
+    server,
+    grace=float(os.getenv("EVENT_EXPIRY_GRACE", "300")),
+    archive_directory=archive_directory if os.getenv("EVENT_ARCHIVE", "false").lower() == "true" else None,
+)
+set_event_expiry(EVENT_EXPIRY)
+
+# Recent reports of the whole fleet in NumPy arrays, for load-shed figures per event
+FLEET_AGGREGATOR = FleetAggregator(
+    VEN_REGISTRY,
+    server,
+    REPORT_INGEST,
+    measurement=os.getenv("AGGREGATE_MEASUREMENT", "RealPower"),
+    resolution=float(os.getenv("AGGREGATE_RESOLUTION", "60")),
+    window=float(os.getenv("AGGREGATE_WINDOW_HOURS", "24")) * 3600,
+)
+set_fleet_aggregator(FLEET_AGGREGATOR)
+
+# Scheduled and recurring events, released through the bulk dispatcher ahead of their start.
+# With several workers only the first one releases, the others add schedules to the shared file
+EVENT_SCHEDULER = EventScheduler(
+    ven_registry_directory / "schedules.json",
+    BULK_DISPATCHER,
+    VEN_REGISTRY,
+    lead_time=timedelta(minutes=float(os.getenv("SCHEDULE_LEAD_TIME", "60"))),
+    release=worker_id in (None, "0"),
+)
+set_event_scheduler(EVENT_SCHEDULER)
+
+# Worker processes share VEN and event changes through a journal next to the registry
+SHARED_STATE = None
+if worker_id is not None:
+    SHARED_STATE = SharedState(
+        ven_registry_directory / "shared_state.db",
+        worker_id,
+        server,
+        VEN_REGISTRY,
+        event_callback=event_response_callback,
+        interval=float(os.getenv("VTN_SYNC_INTERVAL", "0.5")),
+        dispatcher=BULK_DISPATCHER,
+    )
+
+# Time to the listener being bound, the first request and the registry being loaded
+STARTUP = StartupTimer(STARTED)
+set_startup_timer(STARTUP)
+server.app.middlewares.append(STARTUP.middleware)
+
+# VEN and event changes are pushed to the GUI, coalesced per interval
+CHANGE_FEED = ChangeFeed(server, VEN_REGISTRY, interval=float(os.getenv("CHANGE_FEED_INTERVAL", "1")))
+set_change_feed(CHANGE_FEED)
+
+# Registrations are answered from a cache and admitted at a limited rate, so a reconnecting fleet is spread out.
+# The rate is for the whole VTN, every worker admits its share
+REGISTRATION_GATE = RegistrationGate(
+    VEN_REGISTRY,
+    rate=float(os.getenv("REGISTRATION_RATE", "100")) / vtn_workers,
+    burst=math.ceil(int(os.getenv("REGISTRATION_BURST", "500")) / vtn_workers),
+    unknown_ttl=float(os.getenv("REGISTRATION_UNKNOWN_TTL", "300")),
+    authenticator=server.authenticator,
+)
+set_registration_gate(REGISTRATION_GATE)
+
+# Prometheus metrics, requests and openleadr handlers are counted and timed
+METRICS = VtnMetrics(server, VEN_REGISTRY, TELEMETRY_STORE, REPORT_INGEST, EVENT_EXPIRY, REGISTRATION_GATE)
+set_metrics(METRICS)
+server.app.middlewares.append(METRICS.middleware)
+# behind the metrics middleware, so the refused registrations are counted too
+server.app.middlewares.append(REGISTRATION_GATE.middleware)
 
 # Add the handlers for VEN registrations and reports
-server.add_handler("on_create_party_registration", on_create_party_registration)
-server.add_handler("on_cancel_party_registration", on_cancel_party_registration)
-server.add_handler("on_register_report", on_register_report)
-server.add_handler("on_request_event", on_request_event)
-server.add_handler("on_created_event", on_created_event)
+for name, handler in [
+    ("on_create_party_registration", on_create_party_registration),
+    ("on_cancel_party_registration", on_cancel_party_registration),
+    ("on_register_report", on_register_report),
+    ("on_request_event", on_request_event),
+    ("on_created_event", on_created_event),
+]:
+    server.add_handler(name, METRICS.instrumented(name, handler))
 
 # Set up CORS and routes for handling VEN and event operations
 cors = aiohttp_cors.setup(
@@ -75,7 +297,83 @@ cors.add(resource.add_route("POST", handle_remove_ven))
 resource = cors.add(server.app.router.add_resource("/api/list_vens"))
 cors.add(resource.add_route("GET", handle_list_vens))
 
-# Run the server
+resource = cors.add(server.app.router.add_resource("/api/ven_groups"))
+cors.add(resource.add_route("POST", handle_ven_groups_post))
+cors.add(resource.add_route("GET", handle_list_groups))
+
+resource = cors.add(server.app.router.add_resource("/api/ven_fingerprint"))
+cors.add(resource.add_route("POST", handle_ven_fingerprint_post))
+
+resource = cors.add(server.app.router.add_resource("/api/bulk_event"))
+cors.add(resource.add_route("POST", handle_bulk_event_post))
+
+resource = cors.add(server.app.router.add_resource("/api/bulk_event/{job_id}"))
+cors.add(resource.add_route("GET", handle_bulk_event_status))
+
+resource = cors.add(server.app.router.add_resource("/api/schedules"))
+cors.add(resource.add_route("POST", handle_schedule_post))
+cors.add(resource.add_route("GET", handle_list_schedules))
+
+resource = cors.add(server.app.router.add_resource("/api/schedules/{schedule_id}"))
+cors.add(resource.add_route("DELETE", handle_remove_schedule))
+
+resource = cors.add(server.app.router.add_resource("/api/event_performance"))
+cors.add(resource.add_route("GET", handle_event_performance))
+
+resource = cors.add(server.app.router.add_resource("/api/reports"))
+cors.add(resource.add_route("GET", handle_list_reports))
+
+resource = cors.add(server.app.router.add_resource("/api/changes"))
+cors.add(resource.add_route("GET", handle_changes))
+
+resource = cors.add(server.app.router.add_resource("/api/stats"))
+cors.add(resource.add_route("GET", handle_stats))
+
+server.app.router.add_get("/metrics", handle_metrics)
+
+async def start_server():
+    await server.run()
+    STARTUP.mark("listening")
+    # VENs are looked up on demand until the whole registry is in memory
+    if os.getenv("REGISTRY_PRELOAD", "true").lower() == "true":
+        await VEN_REGISTRY.preload()
+        STARTUP.mark("registry_loaded")
+
+# Run the server, the listener is bound before anything else runs
 loop = asyncio.new_event_loop()
-loop.create_task(server.run())
-loop.run_forever()
+loop.create_task(start_server())
+loop.create_task(VEN_REGISTRY.persistence.run())
+loop.create_task(VEN_REGISTRY.liveness.run())
+loop.create_task(TELEMETRY_STORE.persistence.run())
+loop.create_task(EVENT_EXPIRY.run())
+loop.create_task(EVENT_SCHEDULER.run())
+loop.create_task(REPORT_INGEST.run())
+loop.create_task(METRICS.run())
+loop.create_task(CHANGE_FEED.run())
+if SHARED_STATE is not None:
+    loop.create_task(SHARED_STATE.run())
+try:
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+except NotImplementedError:
+    # signal handlers are not available on Windows event loops
+    pass
+
+try:
+    loop.run_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    # Flush the registry so load_from_file picks up every change on restart
+    CHANGE_FEED.close()
+    loop.run_until_complete(server.stop())
+    loop.run_until_complete(REPORT_INGEST.close())
+    if SHARED_STATE is not None:
+        loop.run_until_complete(SHARED_STATE.close())
+    loop.run_until_complete(VEN_REGISTRY.close())
+    loop.run_until_complete(TELEMETRY_STORE.persistence.close())
+    # Stop the remaining background tasks
+    pending = asyncio.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    loop.close()
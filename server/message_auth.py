@@ -0,0 +1,201 @@
+# message_auth.py
+
+import weakref
+from collections import deque
+from datetime import datetime, timezone
+from cryptography import x509
+from lxml import etree
+from signxml import XMLSigner, methods
+from signxml.exceptions import SignXMLException
+from signxml.algorithms import SignatureMethod
+from openleadr import errors, utils
+from openleadr.messaging import (TEMPLATES, VERIFIER, REPLAY_PROTECT_MAX_TIME_DELTA, load_private_key,
+                                 get_signature_algorithm_from_private_key, _create_replay_protect)
+from openleadr.preflight import preflight_message
+from ven_registry import UnknownVenError
+from sticky_proxy import CLIENT_FINGERPRINT
+
+C14N_ALGORITHM = "http://www.w3.org/TR/2001/REC-xml-c14n-20010315"
+X509_CERTIFICATE = "{http://www.w3.org/2000/09/xmldsig#}X509Certificate"
+REPLAY_PROTECT = "{http://openadr.org/oadr-2.0b/2012/07/xmldsig-properties}"
+
+
+class MessageSigner:
+    """
+    Signs outgoing messages like openleadr's create_message, with the key
+    and certificate loaded once. openleadr parses the PEM key twice for
+    every message it signs, which costs far more than the signature.
+    """
+
+    def __init__(self, cert: bytes, key: bytes, passphrase: str = None):
+        self._key = load_private_key(key, passphrase)
+        self._certs = [x509.load_pem_x509_certificate(cert)]
+        self._sign_alg = SignatureMethod.from_fragment(get_signature_algorithm_from_private_key(key, passphrase))
+        self.signed = 0
+
+    def create_message(self, message_type, disable_signature=False, **message_payload):
+        message_payload = preflight_message(message_type, message_payload)
+        template = TEMPLATES.get_template(f'{message_type}.xml')
+        signed_object = utils.flatten_xml(template.render(**message_payload))
+        signature = None
+        if not disable_signature:
+            signer = XMLSigner(method=methods.detached, c14n_algorithm=C14N_ALGORITHM)
+            signer.namespaces['oadr'] = "http://openadr.org/oadr-2.0b/2012/07"
+            signer.sign_alg = self._sign_alg
+            signature_tree = signer.sign(etree.fromstring(signed_object),
+                                         key=self._key,
+                                         cert=self._certs,
+                                         reference_uri="#oadrSignedObject",
+                                         signature_properties=_create_replay_protect())
+            signature = etree.tostring(signature_tree).decode('utf-8')
+            self.signed += 1
+        return TEMPLATES.get_template('oadrPayload.xml').render(template=message_type,
+                                                                 signature=signature,
+                                                                 signed_object=signed_object)
+
+
+class MessageAuthenticator:
+    """
+    Checks the client certificate and the signature of VEN messages like
+    openleadr's authenticate_message, with less work per message.
+
+    The fingerprint of a connection's client certificate is worked out once
+    per TLS connection. The certificate a VEN signs with is parsed and its
+    fingerprint checked once, then kept per ven_id for as long as the VEN
+    signs with the same certificate and its registered fingerprint does not
+    change, so a repeat message only has its signature verified. With
+    `trust_tls` the signature is not verified at all once the client
+    certificate of the connection matched the VEN's fingerprint.
+
+    Used nonces are kept in the order they arrived and expire from the
+    front, where openleadr scans all of them on every message.
+    """
+
+    def __init__(self, registry, trust_tls: bool = False):
+        self._registry = registry
+        self.trust_tls = trust_tls
+        # ssl object of a connection -> fingerprint of its client certificate
+        self._connections = weakref.WeakKeyDictionary()
+        # ven_id -> (X509Certificate text of the message, parsed certificate, fingerprint)
+        self._certs = dict()
+        # (timestamp, nonce) of the recently verified messages, oldest first
+        self._nonces = set()
+        self._nonce_order = deque()
+        self.verified = 0
+        self.trusted = 0
+        self.rejected = 0
+        self.cert_hits = 0
+        self.cert_misses = 0
+        registry.listeners.append(self._on_ven)
+
+    def _on_ven(self, action, ven_info):
+        if action == "removed":
+            self._certs.pop(ven_info.ven_id, None)
+
+    def connection_fingerprint(self, request):
+        """Fingerprint of the client certificate of a request, None without one."""
+        # behind the sticky proxy, which terminates TLS and passes the fingerprint on
+        if CLIENT_FINGERPRINT in request:
+            return request[CLIENT_FINGERPRINT]
+        ssl_object = request.transport.get_extra_info('ssl_object') if request.transport else None
+        if ssl_object is None:
+            return None
+        fingerprint = self._connections.get(ssl_object)
+        if fingerprint is None:
+            der_bytes = ssl_object.getpeercert(binary_form=True)
+            if not der_bytes:
+                return None
+            fingerprint = self._connections[ssl_object] = utils.certificate_fingerprint_from_der(der_bytes)
+        return fingerprint
+
+    def _message_cert(self, ven_id, message_tree, expected_fingerprint):
+        cert_text = message_tree.findtext(f".//{X509_CERTIFICATE}")
+        if cert_text is None:
+            raise errors.NotRegisteredOrAuthorizedError("The message is not signed.")
+        cached = self._certs.get(ven_id)
+        if cached is not None and cached[0] == cert_text:
+            self.cert_hits += 1
+        else:
+            self.cert_misses += 1
+            pem = utils.extract_pem_cert(message_tree)
+            cached = (cert_text, x509.load_pem_x509_certificate(pem.encode()), utils.certificate_fingerprint(pem))
+        if cached[2] != expected_fingerprint:
+            raise errors.NotRegisteredOrAuthorizedError(
+                f"The fingerprint of the certificate used to sign the message {cached[2]} did not match "
+                f"the fingerprint that this VTN has for you {expected_fingerprint}. Make sure you use the "
+                "correct certificate to sign your messages.")
+        self._certs[ven_id] = cached
+        return cached[1]
+
+    async def authenticate(self, request, message_tree, message_payload, fingerprint_lookup=None,
+                           ven_lookup=None, verify_message_signature=True):
+        """Drop-in for openleadr.messaging.authenticate_message, raises NotRegisteredOrAuthorizedError."""
+        if not (request.secure and 'ven_id' in message_payload):
+            return
+        try:
+            self._authenticate(request, message_tree, message_payload['ven_id'], verify_message_signature)
+        except errors.NotRegisteredOrAuthorizedError:
+            self.rejected += 1
+            raise
+
+    def _authenticate(self, request, message_tree, ven_id, verify_message_signature):
+        connection_fingerprint = self.connection_fingerprint(request)
+        if connection_fingerprint is None:
+            raise errors.NotRegisteredOrAuthorizedError(
+                "Your request must use a client side SSL certificate, of which the fingerprint must "
+                "match the fingerprint that you have given to this VTN.")
+        try:
+            expected_fingerprint = self._registry.get_ven_info_from_id(ven_id).fingerprint
+        except UnknownVenError:
+            raise errors.NotRegisteredOrAuthorizedError(
+                f"Your venID {ven_id} is not known to this VTN. Make sure you use the venID that you "
+                "receive from this VTN during the registration step")
+        if expected_fingerprint is None:
+            raise errors.NotRegisteredOrAuthorizedError(
+                "This VTN server does not know what your certificate fingerprint is. Please deliver "
+                f"your fingerprint to the VTN (outside of OpenADR). You used {connection_fingerprint}.")
+        if connection_fingerprint != expected_fingerprint:
+            raise errors.NotRegisteredOrAuthorizedError(
+                f"The fingerprint of your HTTPS certificate '{connection_fingerprint}' does not match "
+                f"the expected fingerprint '{expected_fingerprint}'")
+
+        if not verify_message_signature or self.trust_tls:
+            self.trusted += 1
+            return
+        cert = self._message_cert(ven_id, message_tree, expected_fingerprint)
+        try:
+            VERIFIER.verify(message_tree, x509_cert=cert, expect_references=2)
+            self._check_replay(message_tree)
+        except (ValueError, SignXMLException):
+            raise errors.NotRegisteredOrAuthorizedError(
+                "The message signature did not match the message contents. Please make sure you are "
+                "using the correct XMLDSig algorithm and C14n canonicalization.")
+        self.verified += 1
+
+    def _check_replay(self, message_tree):
+        try:
+            timestamp = utils.parse_datetime(message_tree.findtext(f".//{REPLAY_PROTECT}timestamp"))
+            nonce = message_tree.findtext(f".//{REPLAY_PROTECT}nonce")
+        except Exception:
+            raise ValueError("Missing or malformed ReplayProtect element in the message signature.")
+        if nonce is None:
+            raise ValueError("Missing 'nonce' element in ReplayProtect in incoming message.")
+        oldest = datetime.now(timezone.utc) - REPLAY_PROTECT_MAX_TIME_DELTA
+        while self._nonce_order and self._nonce_order[0][0] < oldest:
+            self._nonces.discard(self._nonce_order.popleft())
+        if timestamp < oldest:
+            raise ValueError("The message was signed too long ago.")
+        if (timestamp, nonce) in self._nonces:
+            raise ValueError("This combination of timestamp and nonce was already used.")
+        self._nonces.add((timestamp, nonce))
+        self._nonce_order.append((timestamp, nonce))
+
+    def stats(self) -> dict:
+        return {
+            "verified": self.verified,
+            "trusted": self.trusted,
+            "rejected": self.rejected,
+            "cert_hits": self.cert_hits,
+            "cert_misses": self.cert_misses,
+            "connections": len(self._connections),
+        }
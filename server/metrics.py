@@ -0,0 +1,214 @@
+# metrics.py
+
+import asyncio
+import functools
+import time
+from bisect import bisect_left
+from aiohttp import web
+
+# request and handler latency buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# event loop lag buckets in seconds
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+LOOP_LAG_INTERVAL = 0.5
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        # label values -> count
+        self._values = dict()
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets. Each label set gets its bucket
+    counts allocated once, observing a value is a bisect and two additions.
+    """
+
+    def __init__(self, name: str, help: str, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.labelnames = labelnames
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._values = dict()
+
+    def observe(self, value: float, *labels):
+        counts = self._values.get(labels)
+        if counts is None:
+            counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, counts in self._values.items():
+            names = self.labelnames + ("le",)
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                yield f"{self.name}_bucket{_format_labels(names, labels + (bound,))} {total}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {counts[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {total}"
+
+
+class Collected:
+    """Metric read from the server's components when /metrics is scraped."""
+
+    def __init__(self, name: str, help: str, kind: str, collect, labelnames=()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = labelnames
+        # returns a value, or a list of (label values, value) when there are labels
+        self._collect = collect
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        if not self.labelnames:
+            yield f"{self.name} {self._collect()}"
+            return
+        for labels, value in self._collect():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class VtnMetrics:
+    """
+    Prometheus metrics of the VTN, served as text at /metrics.
+
+    Requests are counted and timed per aiohttp route by `middleware` and
+    per openleadr handler by wrapping the handlers with `instrumented`.
+    Registry, event, persistence and ingestion figures are read from the
+    components when the endpoint is scraped, so they cost nothing on the
+    hot path. `run` samples the event loop lag.
+    """
+
+    def __init__(self, server, registry, telemetry, report_ingest, event_expiry, registration):
+        self.requests = Counter("vtn_http_requests_total", "HTTP requests per route, method and status",
+                                ("route", "method", "status"))
+        self.request_latency = Histogram("vtn_http_request_duration_seconds", "HTTP request latency per route",
+                                         labelnames=("route", "method"))
+        self.handler_calls = Counter("vtn_handler_calls_total", "Calls of the openleadr handlers",
+                                     ("handler", "result"))
+        self.handler_latency = Histogram("vtn_handler_duration_seconds", "Latency of the openleadr handlers",
+                                         labelnames=("handler",))
+        self.loop_lag = Histogram("vtn_event_loop_lag_seconds", "Event loop lag", buckets=LOOP_LAG_BUCKETS)
+        self.last_loop_lag = 0.0
+        persistence = {"registry": registry.persistence, "telemetry": telemetry.persistence}
+        self._metrics = [
+            self.requests,
+            self.request_latency,
+            self.handler_calls,
+            self.handler_latency,
+            self.loop_lag,
+            Collected("vtn_event_loop_lag_last_seconds", "Last measured event loop lag", "gauge",
+                      lambda: self.last_loop_lag),
+            Collected("vtn_vens_loaded", "VENs held in memory by the registry", "gauge", lambda: len(registry)),
+            Collected("vtn_vens_online", "VENs that checked in recently", "gauge", lambda: len(registry.liveness)),
+            Collected("vtn_events_live", "Events held by the server", "gauge", lambda: server.event_count),
+            Collected("vtn_events_changes_total", "Events added, cancelled or removed", "counter",
+                      lambda: server.events_version),
+            Collected("vtn_events_retired_total", "Events retired after they ended", "counter",
+                      lambda: event_expiry.retired),
+            Collected("vtn_persistence_flushes_total", "Write-behind flushes", "counter",
+                      lambda: [((name, ), wb.flush_count) for name, wb in persistence.items()], ("store",)),
+            Collected("vtn_persistence_flush_seconds_total", "Time spent writing flushes", "counter",
+                      lambda: [((name, ), wb.flush_duration_total) for name, wb in persistence.items()],
+                      ("store",)),
+            Collected("vtn_persistence_last_flush_seconds", "Duration of the last flush", "gauge",
+                      lambda: [((name, ), wb.last_flush_duration) for name, wb in persistence.items()],
+                      ("store",)),
+            Collected("vtn_persistence_pending_changes", "Changes waiting for the next flush", "gauge",
+                      lambda: [((name, ), wb.dirty) for name, wb in persistence.items()], ("store",)),
+            Collected("vtn_report_samples_total", "Report samples per ingestion outcome", "counter",
+                      lambda: [((outcome, ), getattr(report_ingest, outcome))
+                               for outcome in ("accepted", "processed", "dropped", "thinned")], ("outcome",)),
+            Collected("vtn_report_queue_depth", "Reports waiting in the ingestion queue", "gauge",
+                      lambda: report_ingest.stats()["queue_depth"]),
+            registration.latency,
+            Collected("vtn_registrations_total", "oadrCreatePartyRegistration requests per admission outcome",
+                      "counter", lambda: [((outcome, ), getattr(registration, outcome))
+                                          for outcome in ("admitted", "rate_limited", "unknown_rejected",
+                                                          "fingerprint_rejected")],
+                      ("outcome",)),
+            Collected("vtn_registration_lookups_total", "VEN lookups of registrations per cache result", "counter",
+                      lambda: [(("hit", ), registration.cache_hits), (("miss", ), registration.cache_misses)],
+                      ("result",)),
+        ]
+        self._instrumented = dict()
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else "unmatched"
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            self.request_latency.observe(time.perf_counter() - started, route, request.method)
+            self.requests.inc(route, request.method, status)
+
+    def instrumented(self, name: str, handler):
+        """Wrap an openleadr handler so its calls are counted and timed, the wrapper is made once per name."""
+        wrapper = self._instrumented.get(name)
+        if wrapper is not None:
+            return wrapper
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result = "error"
+            try:
+                value = handler(*args, **kwargs)
+                if asyncio.iscoroutine(value):
+                    value = await value
+                result = "ok"
+                return value
+            finally:
+                self.handler_latency.observe(time.perf_counter() - started, name)
+                self.handler_calls.inc(name, result)
+
+        self._instrumented[name] = wrapper
+        return wrapper
+
+    async def run(self):
+        """Sample the event loop lag, start it on the server's event loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.last_loop_lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL)
+            self.loop_lag.observe(self.last_loop_lag)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
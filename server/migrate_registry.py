@@ -0,0 +1,42 @@
+"""
+Import an existing vens.json into the SQLite or snapshot registry backend.
+
+    python migrate_registry.py
+    python migrate_registry.py --source registered_vens/vens.json --destination registered_vens/vens.db
+    python migrate_registry.py --backend snapshot
+
+Stop the VTN server first, VENs already in the destination are overwritten
+by the ones in the JSON file.
+"""
+
+import argparse
+from pathlib import Path
+from registry_storage import JsonRegistryStorage, SnapshotRegistryStorage, SqliteRegistryStorage, migrate
+
+REGISTRY_DIRECTORY = Path(__file__).parent / "registered_vens"
+BACKENDS = {
+    "sqlite": (SqliteRegistryStorage, "vens.db"),
+    "snapshot": (SnapshotRegistryStorage, "vens.snap"),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a vens.json registry into SQLite or a snapshot")
+    parser.add_argument("--source", type=Path, default=REGISTRY_DIRECTORY / "vens.json")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="sqlite")
+    parser.add_argument("--destination", type=Path)
+    args = parser.parse_args()
+
+    source = JsonRegistryStorage(args.source)
+    if not source.exists():
+        parser.error(f"{args.source} does not exist")
+    storage_class, filename = BACKENDS[args.backend]
+    destination_path = args.destination or REGISTRY_DIRECTORY / filename
+    destination = storage_class(destination_path)
+    count = migrate(source, destination)
+    destination.close()
+    print(f"Imported {count} VENs from {args.source} into {destination_path}")
+
+
+if __name__ == "__main__":
+    main()
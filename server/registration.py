@@ -0,0 +1,206 @@
+# registration.py
+
+import logging
+import math
+import re
+import time
+from xml.sax.saxutils import unescape
+from aiohttp import web
+from ven_registry import VenRegistry, UnknownVenError
+from metrics import Histogram
+from log_config import log_category
+
+logger = logging.getLogger('openleadr')
+
+# openleadr serves registrations, re-registrations and cancellations on this path
+REGISTER_PATH = "/EiRegisterParty"
+VEN_NAME_PATTERN = re.compile(rb"<(?:\w+:)?oadrVenName>([^<]*)<")
+# unknown VEN names remembered at most, the oldest are forgotten first
+MAX_UNKNOWN_NAMES = 100_000
+# seconds a token reserved for a rate limited caller is kept after it comes free
+RESERVATION_GRACE = 30
+
+
+class TokenBucket:
+    """
+    Admits `rate` calls per second on average and bursts of up to `burst`.
+    A caller that is turned away gets a token reserved for it and the time
+    at which that token comes free, later callers get the tokens after it,
+    so a herd that is turned away comes back spread out at the admitted
+    rate. A caller that comes back with the same `key` from that time on is
+    admitted on its reservation, reservations not claimed within
+    RESERVATION_GRACE seconds are dropped.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        # goes below zero by the tokens reserved for callers that were turned away
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        # key -> time.monotonic() from which its reserved token is free, in order of that time
+        self._reservations = dict()
+
+    def take(self, key=None) -> float:
+        """0 when admitted, otherwise the seconds to wait before trying again."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        while self._reservations:
+            oldest = next(iter(self._reservations))
+            if self._reservations[oldest] + RESERVATION_GRACE > now:
+                break
+            del self._reservations[oldest]
+
+        slot = self._reservations.get(key)
+        if slot is not None:
+            if slot > now:
+                return slot - now
+            del self._reservations[key]
+            return 0.0
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        slot = now - self._tokens / self.rate
+        if key is not None:
+            self._reservations[key] = slot
+        return slot - now
+
+
+class RegistrationGate:
+    """
+    Fast path for oadrCreatePartyRegistration, which every VEN sends when
+    it starts, so a VTN restart or a network outage brings the whole fleet
+    at once.
+
+    `middleware` looks at the raw request before openleadr parses and
+    verifies it: VEN names known to be unregistered are refused with a 403
+    right away, and registrations beyond `rate` per second (bursts of
+    `burst`) get a 503 with a Retry-After. `lookup` answers
+    on_create_party_registration from a cache of ven_name -> (ven_id,
+    registration_id) and remembers unknown names for `unknown_ttl`
+    seconds. Both caches follow the registry's changes, including those of
+    other workers.
+
+    On secure requests the client certificate, as `authenticator` sees it,
+    must match the fingerprint registered for the VEN, otherwise the
+    registration gets a 403. Behind the sticky proxy the certificate is
+    only known from the forwarded request, which openleadr doesn't read.
+    """
+
+    def __init__(self, registry: VenRegistry, rate: float = 100, burst: int = 500, unknown_ttl: float = 300,
+                 authenticator=None):
+        self._registry = registry
+        self._authenticator = authenticator
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.unknown_ttl = unknown_ttl
+        # ven_name -> (ven_id, registration_id)
+        self._known = dict()
+        # ven_name -> time.monotonic() until which it is refused without a lookup
+        self._unknown = dict()
+        self.latency = Histogram("vtn_registration_duration_seconds",
+                                 "Latency of the admitted oadrCreatePartyRegistration requests")
+        self.admitted = 0
+        self.rate_limited = 0
+        self.unknown_rejected = 0
+        self.fingerprint_rejected = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        registry.listeners.append(self._on_ven)
+
+    def _on_ven(self, action, ven_info):
+        if action == "added":
+            self._unknown.pop(ven_info.ven_name, None)
+        elif action == "removed":
+            self._known.pop(ven_info.ven_name, None)
+
+    def _is_unknown(self, ven_name: str) -> bool:
+        expires = self._unknown.get(ven_name)
+        if expires is None:
+            return False
+        if expires > time.monotonic():
+            return True
+        del self._unknown[ven_name]
+        return False
+
+    def _remember_unknown(self, ven_name: str):
+        if len(self._unknown) >= MAX_UNKNOWN_NAMES:
+            del self._unknown[next(iter(self._unknown))]
+        self._unknown[ven_name] = time.monotonic() + self.unknown_ttl
+
+    def lookup(self, ven_name: str):
+        """(ven_id, registration_id) of a registered VEN, or None."""
+        ids = self._known.get(ven_name)
+        if ids is not None:
+            self.cache_hits += 1
+            return ids
+        self.cache_misses += 1
+        if self._is_unknown(ven_name):
+            return None
+        try:
+            ven_info = self._registry.get_ven_info_from_name(ven_name)
+        except UnknownVenError:
+            self._remember_unknown(ven_name)
+            return None
+        ids = self._known[ven_name] = (ven_info.ven_id, ven_info.registration_id)
+        return ids
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        if request.method != "POST" or not request.path.endswith(REGISTER_PATH):
+            return await handler(request)
+        # read once here, aiohttp keeps the body for openleadr
+        body = await request.read()
+        if b"oadrCreatePartyRegistration" not in body:
+            return await handler(request)
+
+        match = VEN_NAME_PATTERN.search(body)
+        ven_name = None
+        if match is not None:
+            ven_name = unescape(match.group(1).decode(errors="replace"))
+            if self._is_unknown(ven_name):
+                self.unknown_rejected += 1
+                logger.warning("Refused registration of unknown VEN %s", ven_name,
+                               extra=log_category("registration", ven_name))
+                raise web.HTTPForbidden(text="Unknown VEN")
+        if self.bucket is not None:
+            wait = self.bucket.take(ven_name)
+            if wait:
+                self.rate_limited += 1
+                raise web.HTTPServiceUnavailable(headers={"Retry-After": str(math.ceil(wait))},
+                                                 text="Too many registrations, retry later")
+        if ven_name is not None and request.secure and self._authenticator is not None:
+            self._check_fingerprint(request, ven_name)
+
+        self.admitted += 1
+        started = time.perf_counter()
+        try:
+            return await handler(request)
+        finally:
+            self.latency.observe(time.perf_counter() - started)
+
+    def _check_fingerprint(self, request, ven_name: str):
+        ids = self.lookup(ven_name)
+        if ids is None:
+            return
+        fingerprint = self._authenticator.connection_fingerprint(request)
+        if fingerprint is None:
+            return
+        expected = self._registry.get_ven_info_from_id(ids[0]).fingerprint
+        if fingerprint != expected:
+            self.fingerprint_rejected += 1
+            logger.warning("VEN %s connected with certificate %s, its registered fingerprint is %s",
+                           ven_name, fingerprint, expected, extra=log_category("registration", ven_name))
+            raise web.HTTPForbidden(text="Client certificate does not match the VEN")
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "unknown_rejected": self.unknown_rejected,
+            "fingerprint_rejected": self.fingerprint_rejected,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "known_names": len(self._known),
+            "unknown_names": len(self._unknown),
+        }
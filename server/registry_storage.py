@@ -0,0 +1,616 @@
+# registry_storage.py
+
+import json
+import logging
+import math
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+from datetime import datetime, timezone
+from functools import lru_cache
+from hashlib import blake2b
+from pathlib import Path
+from write_behind import atomic_write
+
+logger = logging.getLogger('openleadr')
+
+# columns that are indexed, every other VEN field lives in the JSON data column
+KEY_FIELDS = ("ven_name", "ven_id", "registration_id")
+
+
+class RegistryStorage:
+    """
+    Where VenRegistry persists its VENs.
+
+    Records are plain dicts with the VenInfo fields. `write` receives a batch
+    of {"upserts": {ven_name: record}, "deletes": {ven_name}} from the
+    registry's write-behind flusher and always runs in a worker thread.
+    Backends that are `incremental` only receive the changed VENs, the
+    others receive every VEN on each write. Backends that are `lazy` can
+    look up a single VEN without loading the whole registry.
+    """
+
+    incremental = False
+    lazy = False
+
+    def exists(self) -> bool:
+        raise NotImplementedError
+
+    def load_all(self) -> dict:
+        raise NotImplementedError
+
+    def get(self, field: str, value: str):
+        """Return the record whose `field` equals `value`, or None."""
+        return None
+
+    def write(self, batch: dict):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonRegistryStorage(RegistryStorage):
+    """The whole registry in one JSON file, rewritten on every flush."""
+
+    def __init__(self, filename: Path):
+        self._filename = filename
+
+    def exists(self) -> bool:
+        return self._filename.exists()
+
+    def load_all(self) -> dict:
+        with open(self._filename, mode="r") as file:
+            return json.load(file)
+
+    def write(self, batch: dict):
+        atomic_write(self._filename, json.dumps(batch["upserts"]).encode())
+
+
+class SqliteRegistryStorage(RegistryStorage):
+    """One row per VEN in an SQLite database in WAL mode, written with row-level upserts."""
+
+    incremental = True
+    lazy = True
+
+    def __init__(self, filename: Path):
+        self._filename = filename
+        # lookups run on the event loop thread, writes in executor threads,
+        # each side gets its own connection
+        self._reader = None
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def _connect(self, check_same_thread=True):
+        connection = sqlite3.connect(self._filename, check_same_thread=check_same_thread)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        # worker processes share the database, wait for each other's writes
+        connection.execute("PRAGMA busy_timeout=5000")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS vens ("
+            "ven_name TEXT PRIMARY KEY, "
+            "ven_id TEXT NOT NULL UNIQUE, "
+            "registration_id TEXT NOT NULL UNIQUE, "
+            "data TEXT NOT NULL)"
+        )
+        return connection
+
+    @property
+    def _read_connection(self):
+        if self._reader is None:
+            self._reader = self._connect()
+        return self._reader
+
+    def exists(self) -> bool:
+        return self._filename.exists()
+
+    @staticmethod
+    def _to_record(row):
+        ven_name, ven_id, registration_id, data = row
+        return {**json.loads(data), "ven_name": ven_name, "ven_id": ven_id, "registration_id": registration_id}
+
+    def load_all(self) -> dict:
+        # own connection, so the registry can load in a worker thread while lookups go on
+        connection = self._connect()
+        try:
+            rows = connection.execute("SELECT ven_name, ven_id, registration_id, data FROM vens")
+            return {row[0]: self._to_record(row) for row in rows}
+        finally:
+            connection.close()
+
+    def get(self, field: str, value: str):
+        if field not in KEY_FIELDS:
+            raise ValueError(f"Cannot look up VENs by {field}")
+        row = self._read_connection.execute(
+            f"SELECT ven_name, ven_id, registration_id, data FROM vens WHERE {field} = ?", (value,)
+        ).fetchone()
+        return self._to_record(row) if row else None
+
+    def write(self, batch: dict):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect(check_same_thread=False)
+            rows = [
+                (
+                    record["ven_name"],
+                    record["ven_id"],
+                    record["registration_id"],
+                    json.dumps({k: v for k, v in record.items() if k not in KEY_FIELDS}),
+                )
+                for record in batch["upserts"].values()
+            ]
+            with self._writer:
+                self._writer.executemany("DELETE FROM vens WHERE ven_name = ?",
+                                         [(ven_name,) for ven_name in batch["deletes"]])
+                self._writer.executemany(
+                    "INSERT INTO vens (ven_name, ven_id, registration_id, data) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(ven_name) DO UPDATE SET ven_id = excluded.ven_id, "
+                    "registration_id = excluded.registration_id, data = excluded.data",
+                    rows,
+                )
+
+    def close(self):
+        for connection in (self._reader, self._writer):
+            if connection is not None:
+                connection.close()
+        self._reader = self._writer = None
+
+
+# number of check-in times kept per VEN, records hold that many
+CHECK_IN_WINDOW = 10
+# the largest check-in window a snapshot is read with, anything above is taken as a damaged header
+MAX_CHECK_IN_WINDOW = 1000
+# the check-in window of snapshots and logs that do not store theirs
+LEGACY_CHECK_IN_WINDOW = 10
+
+SNAPSHOT_MAGIC = b"VENSNAP3"
+# snapshots written before the check-in window was stored
+SNAPSHOT_V2_MAGIC = b"VENSNAP2"
+# snapshots written before VENs had a certificate fingerprint
+SNAPSHOT_V1_MAGIC = b"VENSNAP1"
+# magic, record count, offsets of the ven_name, ven_id and registration_id indexes, check-in window
+SNAPSHOT_HEADER = struct.Struct("<8sIQQQI")
+# the same without the check-in window
+SNAPSHOT_V2_HEADER = struct.Struct("<8sIQQQ")
+# hashes of ven_name, ven_id and registration_id, payload length
+RECORD_HEADER = struct.Struct("<16s16s16sI")
+
+
+@lru_cache()
+def _payload_format(check_in_window: int, fingerprint: bool = True) -> str:
+    # connection_quality, last_report_time (NaN for None), last report type and number,
+    # check-in count, check-in times, then the lengths of ven_name, ven_id,
+    # registration_id, last report text, last_report_units, groups and fingerprint
+    return f"ddBdB{check_in_window}dHHHHHH" + ("H" if fingerprint else "")
+
+
+@lru_cache()
+def _record_struct(check_in_window: int, fingerprint: bool = True) -> struct.Struct:
+    """Header and payload of a record, to decode it with a single unpack."""
+    return struct.Struct(RECORD_HEADER.format + _payload_format(check_in_window, fingerprint))
+
+
+RECORD_PAYLOAD = struct.Struct("<" + _payload_format(CHECK_IN_WINDOW))
+RECORD = _record_struct(CHECK_IN_WINDOW)
+# key hash, record offset
+INDEX_ENTRY = struct.Struct("<16sQ")
+# types of last_report
+REPORT_NONE, REPORT_NUMBER, REPORT_TEXT, REPORT_JSON = range(4)
+# delta log entry: kind, payload length, then an encoded record, the ven_name of a deleted VEN,
+# or the check-in window of the records after it
+LOG_ENTRY = struct.Struct("<BI")
+LOG_UPSERT, LOG_DELETE, LOG_FORMAT = 1, 2, 3
+LOG_FORMAT_PAYLOAD = struct.Struct("<I")
+
+
+def to_timestamp(value) -> float:
+    """POSIX time of an ISO string, a datetime or a number, naive times are taken as UTC."""
+    if type(value) is float:
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _key_hash(value: str) -> bytes:
+    return blake2b(value.encode(), digest_size=16).digest()
+
+
+def _encode_record(record: dict) -> bytes:
+    last_report = record.get("last_report")
+    report_number, report_text = 0.0, b""
+    if last_report is None:
+        report_type = REPORT_NONE
+    elif isinstance(last_report, float):
+        report_type, report_number = REPORT_NUMBER, float(last_report)
+    elif isinstance(last_report, str):
+        report_type, report_text = REPORT_TEXT, last_report.encode()
+    else:
+        report_type, report_text = REPORT_JSON, json.dumps(last_report).encode()
+    last_report_time = record.get("last_report_time")
+    if last_report_time is not None:
+        last_report_time = to_timestamp(last_report_time)
+    check_ins = [to_timestamp(check_in_time) for check_in_time in record.get("check_in_times", ())][-CHECK_IN_WINDOW:]
+    strings = [
+        record["ven_name"].encode(),
+        record["ven_id"].encode(),
+        record["registration_id"].encode(),
+        report_text,
+        (record.get("last_report_units") or "").encode(),
+        "\0".join(record.get("groups", ())).encode(),
+        (record.get("fingerprint") or "").encode(),
+    ]
+    payload = RECORD_PAYLOAD.pack(
+        record.get("connection_quality", 0.0),
+        math.nan if last_report_time is None else last_report_time,
+        report_type, report_number,
+        len(check_ins), *check_ins, *([0.0] * (CHECK_IN_WINDOW - len(check_ins))),
+        *map(len, strings),
+    ) + b"".join(strings)
+    return RECORD_HEADER.pack(_key_hash(record["ven_name"]), _key_hash(record["ven_id"]),
+                              _key_hash(record["registration_id"]), len(payload)) + payload
+
+
+def _snapshot_layout(data):
+    """The header, the record layout and the check-in window of a snapshot, from its header."""
+    magic = bytes(data[:len(SNAPSHOT_MAGIC)])
+    if magic == SNAPSHOT_MAGIC:
+        check_in_window = SNAPSHOT_HEADER.unpack_from(data)[5]
+        if not 0 < check_in_window <= MAX_CHECK_IN_WINDOW:
+            raise ValueError(f"Snapshot has an invalid check-in window of {check_in_window}")
+        return SNAPSHOT_HEADER, _record_struct(check_in_window), check_in_window
+    if magic == SNAPSHOT_V2_MAGIC:
+        return SNAPSHOT_V2_HEADER, _record_struct(LEGACY_CHECK_IN_WINDOW), LEGACY_CHECK_IN_WINDOW
+    if magic == SNAPSHOT_V1_MAGIC:
+        return (SNAPSHOT_V2_HEADER, _record_struct(LEGACY_CHECK_IN_WINDOW, fingerprint=False),
+                LEGACY_CHECK_IN_WINDOW)
+    raise ValueError("Not a VEN registry snapshot")
+
+
+def _decode_record(data, offset: int, record_format: struct.Struct = RECORD,
+                   check_in_window: int = CHECK_IN_WINDOW) -> dict:
+    """The record at `offset` of a snapshot, with its check-in and report times as POSIX seconds."""
+    values = record_format.unpack_from(data, offset)[4:]
+    quality, last_report_time, report_type, report_number, check_in_count = values[:5]
+    lengths = values[5 + check_in_window:]
+    position = offset + record_format.size
+    raw = bytes(data[position:position + sum(lengths)])
+    text = raw.decode()
+    # byte lengths are character lengths when the strings are ASCII
+    if len(text) != len(raw):
+        text = raw
+    strings = []
+    position = 0
+    for length in lengths:
+        strings.append(text[position:position + length])
+        position += length
+    if text is raw:
+        strings = [string.decode() for string in strings]
+    ven_name, ven_id, registration_id, report_text, units, groups = strings[:6]
+    fingerprint = strings[6] if len(strings) > 6 else ""
+    if report_type == REPORT_NUMBER:
+        last_report = report_number
+    elif report_type == REPORT_TEXT:
+        last_report = report_text
+    elif report_type == REPORT_JSON:
+        last_report = json.loads(report_text)
+    else:
+        last_report = None
+    return {
+        "ven_name": ven_name,
+        "ven_id": ven_id,
+        "registration_id": registration_id,
+        "last_report": last_report,
+        "last_report_units": units or None,
+        "last_report_time": None if math.isnan(last_report_time) else last_report_time,
+        # the last CHECK_IN_WINDOW of them, when the snapshot kept more
+        "check_in_times": list(values[5:5 + check_in_count])[-CHECK_IN_WINDOW:],
+        "connection_quality": quality,
+        "groups": groups.split("\0") if groups else [],
+        "fingerprint": fingerprint or None,
+    }
+
+
+def _records(data):
+    """(name hash, id hash, registration id hash, raw record) for every record of a snapshot."""
+    header = _snapshot_layout(data)[0]
+    count = header.unpack_from(data)[1]
+    offset = header.size
+    for _ in range(count):
+        name_hash, id_hash, registration_hash, length = RECORD_HEADER.unpack_from(data, offset)
+        end = offset + RECORD_HEADER.size + length
+        yield name_hash, id_hash, registration_hash, data[offset:end]
+        offset = end
+
+
+def _log_entries(data):
+    """(kind, payload) of every complete entry of a delta log, a torn last entry is left out."""
+    offset = 0
+    while offset + LOG_ENTRY.size <= len(data):
+        kind, length = LOG_ENTRY.unpack_from(data, offset)
+        end = offset + LOG_ENTRY.size + length
+        if end > len(data):
+            break
+        yield kind, data[offset + LOG_ENTRY.size:end]
+        offset = end
+
+
+class SnapshotRegistryStorage(RegistryStorage):
+    """
+    The registry in one binary file that is memory-mapped, not parsed.
+
+    Records have a fixed-width numeric part followed by their strings and
+    are followed by three sorted index sections of (key hash, offset), one
+    each for ven_name, ven_id and registration_id. A lookup is a binary
+    search of an index and decodes a single record, so the server can start
+    without loading any VEN.
+
+    The header stores the check-in window the records were written with.
+    Snapshots with another window, or of an older layout, are read as they
+    are and rewritten in the current one by the next compaction.
+
+    A flush appends the changed records and the deleted names to a delta
+    log next to the snapshot, which is also kept in memory and looked at
+    before the snapshot. Once the log grows past `compact_ratio` times the
+    snapshot and at least `compact_min_bytes`, the snapshot is compacted:
+    the unchanged records are copied as raw bytes, the logged ones added,
+    the file is replaced atomically and the log emptied.
+    """
+
+    incremental = True
+    lazy = True
+
+    def __init__(self, filename: Path, compact_ratio: float = 0.5, compact_min_bytes: int = 1024 * 1024):
+        self._filename = filename
+        self._log_filename = filename.with_name(filename.name + ".log")
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        self._map = None
+        # bumped by every compaction, the map is reopened on the next lookup
+        self._generation = 0
+        self._map_generation = -1
+        self._snapshot_header = SNAPSHOT_HEADER
+        self._record_format = RECORD
+        self._check_in_window = CHECK_IN_WINDOW
+        self._writer_lock = threading.Lock()
+        # the delta log in memory, loaded on first use: ven_name -> record or None when deleted,
+        # and ven_id and registration_id -> ven_name
+        self._log = None
+        self._log_lock = threading.Lock()
+        self._log_size = 0
+        # check-in window of the last records in the log file, None while it is empty
+        self._log_window = None
+        self.compactions = 0
+
+    def exists(self) -> bool:
+        return self._filename.exists() or self._log_filename.exists()
+
+    def _read_log(self):
+        """The delta log as kept in memory, the size of its complete entries and its last check-in window."""
+        log = {field: dict() for field in KEY_FIELDS}
+        size = 0
+        check_in_window = None
+        if self._log_filename.exists():
+            with open(self._log_filename, "rb") as file:
+                data = memoryview(file.read())
+            for kind, payload in _log_entries(data):
+                if kind == LOG_FORMAT:
+                    check_in_window = LOG_FORMAT_PAYLOAD.unpack(payload)[0]
+                else:
+                    self._log_apply(log, kind, payload, check_in_window or LEGACY_CHECK_IN_WINDOW)
+                size += LOG_ENTRY.size + len(payload)
+            if size and check_in_window is None:
+                check_in_window = LEGACY_CHECK_IN_WINDOW
+        return log, size, check_in_window
+
+    @staticmethod
+    def _log_apply(log, kind, payload, check_in_window: int = CHECK_IN_WINDOW):
+        if kind == LOG_DELETE:
+            log["ven_name"][bytes(payload).decode()] = None
+            return
+        record = _decode_record(payload, 0, _record_struct(check_in_window), check_in_window)
+        # keys first, so a concurrent lookup finds either the old or the new record
+        log["ven_id"][record["ven_id"]] = record["ven_name"]
+        log["registration_id"][record["registration_id"]] = record["ven_name"]
+        log["ven_name"][record["ven_name"]] = record
+
+    def _current_log(self) -> dict:
+        if self._log is None:
+            with self._log_lock:
+                if self._log is None:
+                    log, self._log_size, self._log_window = self._read_log()
+                    if self._log_filename.exists() and self._log_filename.stat().st_size > self._log_size:
+                        # cut off an entry torn by a crash, so the next entries are appended after a whole one
+                        os.truncate(self._log_filename, self._log_size)
+                    self._log = log
+        return self._log
+
+    def _snapshot(self):
+        if self._map_generation != self._generation:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._map_generation = self._generation
+            if self._filename.exists() and self._filename.stat().st_size > 0:
+                with open(self._filename, "rb") as file:
+                    self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    self._snapshot_header, self._record_format, self._check_in_window = _snapshot_layout(self._map)
+                except ValueError as e:
+                    raise ValueError(f"{self._filename}: {e}")
+        return self._map
+
+    def load_all(self) -> dict:
+        # reads its own copy of the files so it can run in a worker thread, a compaction
+        # must not run in between
+        with self._writer_lock:
+            records = dict()
+            if self._filename.exists():
+                with open(self._filename, "rb") as file:
+                    data = memoryview(file.read())
+                _, record_format, check_in_window = _snapshot_layout(data)
+                for _, _, _, raw in _records(data):
+                    record = _decode_record(raw, 0, record_format, check_in_window)
+                    records[record["ven_name"]] = record
+            for ven_name, record in self._read_log()[0]["ven_name"].items():
+                if record is None:
+                    records.pop(ven_name, None)
+                else:
+                    records[ven_name] = record
+            return records
+
+    def get(self, field: str, value: str):
+        if field not in KEY_FIELDS:
+            raise ValueError(f"Cannot look up VENs by {field}")
+        # the log before the snapshot, a compaction replaces the snapshot before it empties the log
+        log = self._current_log()
+        logged = log["ven_name"]
+        ven_name = value if field == "ven_name" else log[field].get(value)
+        record = logged.get(ven_name)
+        if record is not None and record[field] == value:
+            return record
+        record = self._snapshot_get(field, value)
+        if record is not None and record["ven_name"] in logged:
+            # changed or deleted since the snapshot
+            return None
+        return record
+
+    def _snapshot_get(self, field: str, value: str):
+        data = self._snapshot()
+        if data is None:
+            return None
+        header = self._snapshot_header.unpack_from(data)
+        count, index = header[1], header[2 + KEY_FIELDS.index(field)]
+        key = _key_hash(value)
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if INDEX_ENTRY.unpack_from(data, index + middle * INDEX_ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        # hashes could collide, check every record with the same hash
+        while low < count:
+            entry_key, offset = INDEX_ENTRY.unpack_from(data, index + low * INDEX_ENTRY.size)
+            if entry_key != key:
+                break
+            record = _decode_record(data, offset, self._record_format, self._check_in_window)
+            if record[field] == value:
+                return record
+            low += 1
+        return None
+
+    def write(self, batch: dict):
+        with self._writer_lock:
+            log = self._current_log()
+            chunks = []
+            if self._log_window != CHECK_IN_WINDOW:
+                # the records after it are decoded with this window
+                payload = LOG_FORMAT_PAYLOAD.pack(CHECK_IN_WINDOW)
+                chunks.append(LOG_ENTRY.pack(LOG_FORMAT, len(payload)) + payload)
+            for ven_name in batch["deletes"]:
+                payload = ven_name.encode()
+                chunks.append(LOG_ENTRY.pack(LOG_DELETE, len(payload)) + payload)
+            for record in batch["upserts"].values():
+                payload = _encode_record(record)
+                chunks.append(LOG_ENTRY.pack(LOG_UPSERT, len(payload)) + payload)
+            data = b"".join(chunks)
+            with open(self._log_filename, "ab") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            self._log_size += len(data)
+            self._log_window = CHECK_IN_WINDOW
+            for kind, payload in _log_entries(memoryview(data)):
+                if kind != LOG_FORMAT:
+                    self._log_apply(log, kind, payload, CHECK_IN_WINDOW)
+
+            snapshot_size = self._filename.stat().st_size if self._filename.exists() else 0
+            if (self._log_size >= max(self.compact_min_bytes, self.compact_ratio * snapshot_size)
+                    or self._snapshot_format() not in (None, RECORD)):
+                self._compact(log)
+
+    def _snapshot_format(self):
+        if not self._filename.exists():
+            return None
+        with open(self._filename, "rb") as file:
+            return _snapshot_layout(file.read(SNAPSHOT_HEADER.size))[1]
+
+    def _compact(self, log):
+        logged = log["ven_name"]
+        upserts = {ven_name: record for ven_name, record in logged.items() if record is not None}
+        deletes = {ven_name for ven_name, record in logged.items() if record is None}
+        self._rewrite(upserts, deletes)
+        self._generation += 1
+        # lookups go to the new snapshot from here on
+        self._log = {field: dict() for field in KEY_FIELDS}
+        with open(self._log_filename, "wb"):
+            pass
+        self._log_size = 0
+        self._log_window = None
+        self.compactions += 1
+
+    def _rewrite(self, upserts: dict, deletes):
+        """Replace the snapshot with its records changed by `upserts` and `deletes`."""
+        replaced = {_key_hash(ven_name) for ven_name in upserts}
+        replaced.update(_key_hash(ven_name) for ven_name in deletes)
+        records = []
+        if self._filename.exists() and self._filename.stat().st_size > 0:
+            with open(self._filename, "rb") as file:
+                data = memoryview(file.read())
+            records = [record for record in _records(data) if record[0] not in replaced]
+            _, record_format, check_in_window = _snapshot_layout(data)
+            if record_format is not RECORD:
+                # rewritten in the current layout, once
+                records = [(*keys, _encode_record(_decode_record(raw, 0, record_format, check_in_window)))
+                           for *keys, raw in records]
+        for record in upserts.values():
+            raw = _encode_record(record)
+            records.append(RECORD_HEADER.unpack_from(raw)[:3] + (raw,))
+
+        chunks = []
+        offsets = []
+        offset = SNAPSHOT_HEADER.size
+        for record in records:
+            chunks.append(record[3])
+            offsets.append(offset)
+            offset += len(record[3])
+        index_offsets = []
+        for key in range(3):
+            index_offsets.append(offset)
+            entries = sorted((record[key], record_offset) for record, record_offset in zip(records, offsets))
+            chunks.append(b"".join(INDEX_ENTRY.pack(*entry) for entry in entries))
+            offset += len(entries) * INDEX_ENTRY.size
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(records), *index_offsets, CHECK_IN_WINDOW)
+        atomic_write(self._filename, header + b"".join(chunks))
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._map_generation = -1
+
+
+def create_storage(backend: str, directory: Path) -> RegistryStorage:
+    """Create the storage backend named by REGISTRY_BACKEND."""
+    if backend == "json":
+        return JsonRegistryStorage(directory / "vens.json")
+    if backend == "sqlite":
+        return SqliteRegistryStorage(directory / "vens.db")
+    if backend == "snapshot":
+        return SnapshotRegistryStorage(directory / "vens.snap")
+    raise ValueError(f"Unknown registry backend {backend}")
+
+
+def migrate(source: RegistryStorage, destination: RegistryStorage) -> int:
+    """Copy every VEN from one backend to another, returns the number of VENs copied."""
+    vens = source.load_all()
+    destination.write({"upserts": vens, "deletes": set()})
+    return len(vens)
@@ -0,0 +1,136 @@
+# report_ingest.py
+
+import asyncio
+import logging
+from ven_registry import UnknownVenError
+from log_config import log_category
+
+logger = logging.getLogger('openleadr')
+
+# what to do with reports once the queue is full
+OVERLOAD_POLICIES = ("drop", "sample")
+
+
+class ReportIngest:
+    """
+    Bounded queue between openleadr's on_update_report and the registry and
+    telemetry store.
+
+    `submit` only enqueues a report, so a VEN's oadrUpdateReport is
+    acknowledged without waiting on any processing. A single consumer drains
+    the queue in batches of up to `batch_size` reports, updates the registry
+    once per VEN with its latest sample and appends the samples to the
+    telemetry store per series.
+
+    When the queue is full new reports are dropped. With the "sample" policy
+    reports are thinned down to their latest sample as soon as the queue is
+    half full, so the last value of every VEN keeps coming through before
+    anything has to be dropped.
+    """
+
+    def __init__(self, registry, telemetry, max_queue: int = 10_000, batch_size: int = 1_000,
+                 policy: str = "drop"):
+        if policy not in OVERLOAD_POLICIES:
+            raise ValueError(f"Unknown report overload policy {policy}")
+        self._registry = registry
+        self._telemetry = telemetry
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.policy = policy
+        self._task = None
+        # called with every processed batch of (ven_id, resource_id, measurement, data) reports
+        self.batch_listeners = []
+        # backpressure counters, in samples unless named otherwise
+        self.accepted = 0
+        self.dropped = 0
+        self.thinned = 0
+        self.processed = 0
+        self.unknown_vens = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.max_depth = 0
+
+    def submit(self, ven_id: str, resource_id: str, measurement: str, data):
+        """Queue the (time, value) samples of one report, never blocks."""
+        data = list(data)
+        if not data:
+            return
+        queue = self._queue
+        if self.policy == "sample" and queue.qsize() * 2 >= queue.maxsize and len(data) > 1:
+            self.thinned += len(data) - 1
+            data = [max(data, key=lambda sample: sample[0])]
+        try:
+            queue.put_nowait((ven_id, resource_id, measurement, data))
+        except asyncio.QueueFull:
+            self.dropped += len(data)
+            return
+        self.accepted += len(data)
+        if queue.qsize() > self.max_depth:
+            self.max_depth = queue.qsize()
+
+    def _process(self, batch):
+        # latest sample per VEN, the registry only keeps the last report
+        latest = dict()
+        samples = 0
+        for ven_id, resource_id, measurement, data in batch:
+            self._telemetry.extend(ven_id, resource_id, measurement, data)
+            time, value = max(data, key=lambda sample: sample[0])
+            if ven_id not in latest or time >= latest[ven_id][0]:
+                latest[ven_id] = (time, value, measurement)
+            samples += len(data)
+        for ven_id, (time, value, measurement) in latest.items():
+            try:
+                ven_info = self._registry.get_ven_info_from_id(ven_id)
+            except UnknownVenError:
+                self.unknown_vens += 1
+                logger.warning("Dropped reports from unknown VEN %s", ven_id, extra=log_category("report", ven_id))
+                continue
+            self._registry.update_ven_report(ven_info.ven_name, value, measurement, time)
+        for listener in self.batch_listeners:
+            try:
+                listener(batch)
+            except Exception as e:
+                logger.error("Report batch listener failed: %s", e)
+        self.processed += samples
+        self.batches += 1
+        self.last_batch_size = len(batch)
+
+    def _drain(self, first=None):
+        batch = [] if first is None else [first]
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            self._process(batch)
+
+    async def run(self):
+        self._task = asyncio.current_task()
+        while True:
+            self._drain(await self._queue.get())
+            # let requests through between batches
+            await asyncio.sleep(0)
+
+    async def close(self):
+        """Stop the consumer and process whatever is still queued, call this on shutdown."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        while not self._queue.empty():
+            self._drain()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "max_depth": self.max_depth,
+            "policy": self.policy,
+            "accepted": self.accepted,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "thinned": self.thinned,
+            "unknown_vens": self.unknown_vens,
+            "batches": self.batches,
+            "last_batch_size": self.last_batch_size,
+        }
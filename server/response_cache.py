@@ -0,0 +1,41 @@
+# response_cache.py
+
+import hashlib
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized JSON responses.
+
+    Entries are keyed by the request path and query string and tagged with
+    the version of the state they were built from, so a version bump is all
+    it takes to invalidate them. The ETag is derived from the same key and
+    version, an unchanged state can answer If-None-Match without building
+    or looking up the body.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def etag(key: str, version) -> str:
+        return '"' + hashlib.sha1(f"{key}|{version}".encode()).hexdigest()[:20] + '"'
+
+    def get(self, key: str, version):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, version, response):
+        self._entries[key] = (version, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
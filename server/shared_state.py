@@ -0,0 +1,293 @@
+# shared_state.py
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, is_dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from openleadr import objects, utils
+from ven_registry import UnknownVenError, ven_info_to_record
+
+logger = logging.getLogger('openleadr')
+
+# seconds the bulk dispatch jobs of all workers are kept for their status
+JOB_RETENTION = 24 * 3600
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, timedelta):
+        return {"$timedelta": value.total_seconds()}
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def _decode(value: dict):
+    if "$datetime" in value:
+        return datetime.fromisoformat(value["$datetime"])
+    if "$timedelta" in value:
+        return timedelta(seconds=value["$timedelta"])
+    return value
+
+
+def dump_event(event) -> str:
+    return json.dumps(asdict(event) if is_dataclass(event) else event, default=_encode)
+
+
+def load_event(data: str) -> objects.Event:
+    """Rebuild an event written by dump_event the way OpenADRServer.add_event builds it."""
+    event = json.loads(data, object_hook=_decode)
+    return objects.Event(
+        event_descriptor=objects.EventDescriptor(**event["event_descriptor"]),
+        event_signals=[objects.EventSignal(**signal) for signal in event["event_signals"]],
+        targets=event["targets"],
+        targets_by_type=event["targets_by_type"],
+        active_period=event["active_period"],
+        response_required=event["response_required"],
+    )
+
+
+class SharedState:
+    """
+    Keeps the VEN registry and the events of several VTN worker processes in
+    sync through an SQLite database in WAL mode.
+
+    Every worker appends its own changes to a journal table and tails the
+    journal for the changes of the others, both once per `interval` in a
+    worker thread. Events are also kept in an events table, so a worker
+    that starts late loads the live events. Reports are journaled as
+    (ven_name, value, units, time), all of an interval in one entry, and
+    applied to the VEN in place. The journal is pruned after `retention`
+    seconds.
+
+    The bulk dispatch jobs of `dispatcher` are written to a jobs table at
+    the same interval, so their status can be asked from any worker. A
+    job's per-VEN results are written once it has finished.
+    """
+
+    def __init__(self, filename: Path, worker_id: str, server, registry, event_callback=None,
+                 interval: float = 0.5, retention: float = 600, dispatcher=None):
+        self._filename = filename
+        self.worker_id = worker_id
+        self._server = server
+        self._registry = registry
+        self._event_callback = event_callback
+        self.interval = interval
+        self.retention = retention
+        self._connection = None
+        self._lock = threading.Lock()
+        self._last_seq = 0
+        self._last_prune = 0.0
+        # changes made by this worker, waiting for the next sync
+        self._outbox = []
+        # [ven_name, report value, units, POSIX time] of the reports since the last sync
+        self._reports = []
+        # job_id -> DispatchJob of this worker that changed since the last sync
+        self._changed_jobs = dict()
+        # set while changes of other workers are applied, so they are not sent back
+        self._applying = False
+        self.published = 0
+        self.applied = 0
+        server.event_listeners.append(self._on_event)
+        registry.listeners.append(self._on_ven)
+        if dispatcher is not None:
+            dispatcher.job_listeners.append(self._on_job)
+            dispatcher.shared_jobs = self.get_job
+
+    def _connect(self):
+        connection = sqlite3.connect(self._filename, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout=5000")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "worker TEXT NOT NULL, "
+            "kind TEXT NOT NULL, "
+            "data TEXT NOT NULL, "
+            "created REAL NOT NULL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "event_id TEXT PRIMARY KEY, "
+            "ven_id TEXT NOT NULL, "
+            "data TEXT NOT NULL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, "
+            "data TEXT NOT NULL, "
+            "results TEXT, "
+            "updated REAL NOT NULL)"
+        )
+        return connection
+
+    def _on_event(self, action, ven_id, event):
+        if self._applying:
+            return
+        event_id = utils.getmember(event, 'event_descriptor.event_id')
+        data = {"ven_id": ven_id, "event_id": event_id}
+        if action == "added":
+            data["event"] = dump_event(event)
+        self._outbox.append(("event_" + action, data))
+
+    def _on_ven(self, action, ven_info):
+        # every worker tracks which VENs are online itself
+        if self._applying or action == "offline":
+            return
+        if action == "reported":
+            self._reports.append([ven_info.ven_name, ven_info.last_report, ven_info.last_report_units,
+                                  ven_info._last_report_time])
+        else:
+            if self._reports:
+                # reports come before the change, in the order they were made
+                self._outbox.append(("ven_reported", self._reports))
+                self._reports = []
+            self._outbox.append(("ven_" + action, ven_info_to_record(ven_info)))
+
+    def _on_job(self, job):
+        self._changed_jobs[job.job_id] = job
+
+    def _job_rows(self, jobs):
+        rows = []
+        for job in jobs.values():
+            finished = job.status in ("done", "failed")
+            rows.append((job.job_id, json.dumps(job.as_dict()), json.dumps(job.results) if finished else None))
+        return rows
+
+    def _load(self):
+        # runs in a worker thread
+        with self._lock:
+            if self._connection is None:
+                self._connection = self._connect()
+            last_seq = self._connection.execute("SELECT COALESCE(MAX(seq), 0) FROM journal").fetchone()[0]
+            events = self._connection.execute("SELECT event_id, ven_id, data FROM events").fetchall()
+        return last_seq, events
+
+    def _sync(self, outbox, jobs, last_seq):
+        # runs in a worker thread, writes our changes and reads everyone else's
+        with self._lock:
+            now = time.time()
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO jobs (job_id, data, results, updated) VALUES (?, ?, ?, ?)",
+                    [(job_id, data, results, now) for job_id, data, results in jobs])
+                for kind, data in outbox:
+                    self._connection.execute(
+                        "INSERT INTO journal (worker, kind, data, created) VALUES (?, ?, ?, ?)",
+                        (self.worker_id, kind, json.dumps(data), now))
+                    if kind == "event_added":
+                        self._connection.execute(
+                            "INSERT OR REPLACE INTO events (event_id, ven_id, data) VALUES (?, ?, ?)",
+                            (data["event_id"], data["ven_id"], data["event"]))
+                    elif kind == "event_cancelled":
+                        self._connection.execute(
+                            "UPDATE events SET data = json_set(data, '$.event_descriptor.event_status', 'cancelled', "
+                            "'$.event_descriptor.modification_number', "
+                            "json_extract(data, '$.event_descriptor.modification_number') + 1) "
+                            "WHERE event_id = ?", (data["event_id"],))
+                    elif kind == "event_removed":
+                        self._connection.execute("DELETE FROM events WHERE event_id = ?", (data["event_id"],))
+                if now - self._last_prune > 60:
+                    self._connection.execute("DELETE FROM journal WHERE created < ?", (now - self.retention,))
+                    self._connection.execute("DELETE FROM jobs WHERE updated < ?", (now - JOB_RETENTION,))
+                    self._last_prune = now
+            return self._connection.execute(
+                "SELECT seq, kind, data FROM journal WHERE seq > ? AND worker != ? ORDER BY seq",
+                (last_seq, self.worker_id)).fetchall()
+
+    def _read_job(self, job_id):
+        # runs in a worker thread
+        with self._lock:
+            if self._connection is None:
+                return None
+            return self._connection.execute("SELECT data, results FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+
+    async def get_job(self, job_id: str, include_results: bool = False):
+        """A bulk dispatch job of any worker as DispatchJob.as_dict returns it, or None."""
+        try:
+            row = await asyncio.get_running_loop().run_in_executor(None, self._read_job, job_id)
+        except sqlite3.Error as e:
+            logger.error("Error reading dispatch job %s: %s", job_id, e)
+            return None
+        if row is None:
+            return None
+        job = json.loads(row[0])
+        if include_results:
+            # the results are written once the job has finished
+            job["results"] = json.loads(row[1]) if row[1] is not None else {}
+        return job
+
+    def _apply(self, kind, data):
+        server = self._server
+        if kind == "event_added":
+            if server.find_event(data["event_id"]) is None:
+                server.add_raw_event(data["ven_id"], load_event(data["event"]), callback=self._event_callback)
+        elif kind == "event_cancelled":
+            server.cancel_event(data["ven_id"], data["event_id"])
+        elif kind == "event_removed":
+            server.remove_event(data["ven_id"], data["event_id"])
+        elif kind == "ven_reported":
+            for ven_name, report_value, units, timestamp in data:
+                try:
+                    self._registry.apply_remote_report(ven_name, report_value, units, timestamp)
+                except UnknownVenError:
+                    # removed here in the meantime
+                    pass
+        else:
+            self._registry.apply_remote(kind[len("ven_"):], data)
+
+    def _apply_all(self, changes):
+        self._applying = True
+        try:
+            for kind, data in changes:
+                try:
+                    self._apply(kind, data)
+                except Exception as e:
+                    logger.error("Could not apply %s from another worker: %s", kind, e)
+                self.applied += 1
+        finally:
+            self._applying = False
+
+    async def run(self):
+        """Sync with the other workers every `interval` seconds, start it on the server's event loop."""
+        loop = asyncio.get_running_loop()
+        self._last_seq, events = await loop.run_in_executor(None, self._load)
+        self._apply_all(("event_added", {"ven_id": ven_id, "event_id": event_id, "event": data})
+                        for event_id, ven_id, data in events)
+        logger.info("Worker %s loaded %d shared events", self.worker_id, len(events))
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sync()
+
+    async def sync(self):
+        outbox, self._outbox = self._outbox, []
+        if self._reports:
+            outbox.append(("ven_reported", self._reports))
+            self._reports = []
+        jobs, self._changed_jobs = self._changed_jobs, dict()
+        try:
+            rows = await asyncio.get_running_loop().run_in_executor(None, self._sync, outbox, self._job_rows(jobs),
+                                                                    self._last_seq)
+        except sqlite3.Error as e:
+            # keep our changes for the next attempt
+            self._outbox = outbox + self._outbox
+            self._changed_jobs = {**jobs, **self._changed_jobs}
+            logger.error("Error syncing worker %s: %s", self.worker_id, e)
+            return
+        self.published += len(outbox)
+        if rows:
+            self._last_seq = rows[-1][0]
+            self._apply_all((kind, json.loads(data)) for _, kind, data in rows)
+
+    async def close(self):
+        """Publish the last changes, call this on shutdown."""
+        if self._connection is not None:
+            await self.sync()
+            with self._lock:
+                self._connection.close()
+                self._connection = None
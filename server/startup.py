@@ -0,0 +1,35 @@
+# startup.py
+
+import logging
+import time
+from aiohttp import web
+
+logger = logging.getLogger('openleadr')
+
+
+class StartupTimer:
+    """
+    Seconds from `started` (a time.perf_counter() value taken when the
+    process started) to startup milestones: the listener being bound, the
+    first request served and the registry fully loaded.
+    """
+
+    def __init__(self, started: float):
+        self.started = started
+        self.marks = dict()
+
+    def mark(self, name: str):
+        """Record the first time `name` happens."""
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() - self.started
+            logger.info("Startup: %s after %.3f s", name.replace("_", " "), self.marks[name])
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        response = await handler(request)
+        if "first_request" not in self.marks:
+            self.mark("first_request")
+        return response
+
+    def as_dict(self) -> dict:
+        return {f"{name}_after": round(seconds, 3) for name, seconds in self.marks.items()}
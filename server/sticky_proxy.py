@@ -0,0 +1,152 @@
+# sticky_proxy.py
+
+import hmac
+import itertools
+import logging
+import re
+import weakref
+import zlib
+import aiohttp
+from aiohttp import web
+from openleadr import utils
+
+logger = logging.getLogger('openleadr')
+
+VEN_ID_PATTERN = re.compile(rb"venID>([^<]+)</")
+VEN_NAME_PATTERN = re.compile(rb"venName>([^<]+)</")
+# headers that belong to one connection and are not forwarded
+HOP_BY_HOP = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers",
+              "transfer-encoding", "upgrade", "host", "content-length"}
+# headers the proxy sets on the requests it forwards, a client cannot send them
+SECRET_HEADER = "X-VTN-Proxy-Secret"
+FINGERPRINT_HEADER = "X-VTN-Client-Fingerprint"
+PROTO_HEADER = "X-Forwarded-Proto"
+FORWARDED_FOR_HEADER = "X-Forwarded-For"
+PROXY_HEADERS = {header.lower() for header in (SECRET_HEADER, FINGERPRINT_HEADER, PROTO_HEADER,
+                                               FORWARDED_FOR_HEADER)}
+# where ProxiedRequests keeps the client certificate fingerprint of a request, RequestKey needs aiohttp 3.13
+CLIENT_FINGERPRINT = web.RequestKey("client_fingerprint", str) if hasattr(web, "RequestKey") else "client_fingerprint"
+# routes that stay open and stream, they get no read timeout
+STREAMING_PATHS = ("/api/changes",)
+CHUNK_SIZE = 64 * 1024
+
+
+class StickyProxy:
+    """
+    Reverse proxy in front of the VTN workers that sends every OpenADR
+    message of a VEN to the same worker, so its pending events and report
+    state stay warm in that worker's caches.
+
+    The worker is picked from a CRC32 of the venID in the message body, or
+    of the venName for registrations that don't carry a venID yet. Other
+    requests, like the /api routes, go round robin.
+
+    With an `ssl_context` the proxy terminates TLS and forwards plain HTTP
+    to the workers, with the fingerprint of the client certificate and the
+    shared `secret` in headers that ProxiedRequests on the worker checks.
+    Responses are streamed back as they arrive, so the change feed works
+    through the proxy.
+    """
+
+    def __init__(self, worker_urls, secret: str, ssl_context=None):
+        self.worker_urls = worker_urls
+        self.secret = secret
+        self.ssl_context = ssl_context
+        self._round_robin = itertools.cycle(range(len(worker_urls)))
+        self._session = None
+        # ssl object of a connection -> fingerprint of its client certificate
+        self._fingerprints = weakref.WeakKeyDictionary()
+        self.app = web.Application(client_max_size=16 * 1024 * 1024)
+        self.app.router.add_route("*", "/{path:.*}", self.handle)
+        self.app.on_startup.append(self._start)
+        self.app.on_cleanup.append(self._stop)
+
+    async def _start(self, app):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0), auto_decompress=False,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60))
+
+    async def _stop(self, app):
+        await self._session.close()
+
+    def pick_worker(self, body: bytes) -> int:
+        match = VEN_ID_PATTERN.search(body) or VEN_NAME_PATTERN.search(body)
+        if match is None:
+            return next(self._round_robin)
+        return zlib.crc32(match.group(1)) % len(self.worker_urls)
+
+    def _client_fingerprint(self, request):
+        ssl_object = request.transport.get_extra_info('ssl_object') if request.transport else None
+        if ssl_object is None:
+            return None
+        fingerprint = self._fingerprints.get(ssl_object)
+        if fingerprint is None:
+            der_bytes = ssl_object.getpeercert(binary_form=True)
+            if not der_bytes:
+                return None
+            fingerprint = self._fingerprints[ssl_object] = utils.certificate_fingerprint_from_der(der_bytes)
+        return fingerprint
+
+    def _forward_headers(self, request):
+        headers = {k: v for k, v in request.headers.items()
+                   if k.lower() not in HOP_BY_HOP and k.lower() not in PROXY_HEADERS}
+        headers[SECRET_HEADER] = self.secret
+        headers[PROTO_HEADER] = request.scheme
+        if request.remote:
+            headers[FORWARDED_FOR_HEADER] = request.remote
+        fingerprint = self._client_fingerprint(request)
+        if fingerprint is not None:
+            headers[FINGERPRINT_HEADER] = fingerprint
+        return headers
+
+    async def handle(self, request):
+        body = await request.read()
+        worker = self.pick_worker(body) if body else next(self._round_robin)
+        url = self.worker_urls[worker] + request.rel_url.raw_path_qs
+        timeout = None
+        if request.path in STREAMING_PATHS or "text/event-stream" in request.headers.get("Accept", ""):
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=None)
+        stream = None
+        try:
+            async with self._session.request(request.method, url, headers=self._forward_headers(request),
+                                             data=body, timeout=timeout) as response:
+                stream = web.StreamResponse(status=response.status, reason=response.reason,
+                                            headers={k: v for k, v in response.headers.items()
+                                                     if k.lower() not in HOP_BY_HOP})
+                if response.content_length is not None:
+                    stream.content_length = response.content_length
+                await stream.prepare(request)
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    await stream.write(chunk)
+                await stream.write_eof()
+                return stream
+        except aiohttp.ClientError as e:
+            logger.error("Worker %d did not answer: %s", worker, e)
+            if stream is not None and stream.prepared:
+                # the status line went out already, all that is left is to close the connection
+                request.transport.close()
+                return stream
+            return web.Response(status=502, text="VTN worker unavailable")
+
+
+class ProxiedRequests:
+    """
+    Middleware for a worker behind a StickyProxy. Requests must carry the
+    proxy's secret, then the scheme and address of the client are taken
+    from the forwarded headers, so openleadr sees a request that came in
+    over TLS as secure, and the client certificate fingerprint is kept as
+    request[CLIENT_FINGERPRINT].
+    """
+
+    def __init__(self, secret: str):
+        self._secret = secret.encode()
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        secret = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(secret.encode(), self._secret):
+            raise web.HTTPForbidden(text="Requests must come through the VTN proxy")
+        request = request.clone(scheme=request.headers.get(PROTO_HEADER, "http"),
+                                remote=request.headers.get(FORWARDED_FOR_HEADER, request.remote))
+        request[CLIENT_FINGERPRINT] = request.headers.get(FINGERPRINT_HEADER)
+        return await handler(request)
@@ -0,0 +1,103 @@
+# supervisor.py
+
+import asyncio
+import logging
+import os
+import secrets
+import signal
+import sys
+from pathlib import Path
+from aiohttp import web
+from sticky_proxy import StickyProxy
+
+logger = logging.getLogger('openleadr')
+
+ROUTING_MODES = ("reuseport", "sticky")
+# seconds before a worker that exited is started again
+RESTART_DELAY = 1.0
+
+
+class Supervisor:
+    """
+    Runs `count` VTN worker processes (main.py with VTN_WORKER_ID set) and
+    restarts the ones that exit.
+
+    With "reuseport" routing every worker listens on host:port with
+    SO_REUSEPORT and the kernel spreads connections over them. With
+    "sticky" routing the workers listen on 127.0.0.1 on the ports after
+    `port` and a StickyProxy on host:port sends each VEN to the same worker.
+    The proxy serves TLS with `ssl_context` and the workers plain HTTP,
+    they only accept requests with the secret the proxy forwards
+    (VTN_PROXY_SECRET).
+    """
+
+    def __init__(self, count: int, routing: str = "reuseport", host: str = "127.0.0.1", port: int = 8080,
+                 ssl_context=None, keepalive_timeout: float = 75.0):
+        if routing not in ROUTING_MODES:
+            raise ValueError(f"Unknown routing mode {routing}")
+        self.count = count
+        self.routing = routing
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.keepalive_timeout = keepalive_timeout
+        self._proxy_secret = secrets.token_hex(32)
+        self._processes = dict()
+        self._stopping = asyncio.Event()
+
+    def _worker_address(self, worker_id: int):
+        if self.routing == "reuseport":
+            return self.host, self.port
+        return "127.0.0.1", self.port + 1 + worker_id
+
+    async def _run_worker(self, worker_id: int):
+        host, port = self._worker_address(worker_id)
+        env = {**os.environ, "VTN_WORKER_ID": str(worker_id), "VTN_WORKER_HOST": host,
+               "VTN_WORKER_PORT": str(port), "VTN_REUSE_PORT": str(self.routing == "reuseport").lower()}
+        if self.routing == "sticky":
+            env["VTN_PROXY_SECRET"] = self._proxy_secret
+        main = Path(__file__).parent / "main.py"
+        while not self._stopping.is_set():
+            process = await asyncio.create_subprocess_exec(sys.executable, str(main), env=env)
+            self._processes[worker_id] = process
+            logger.info("Started VTN worker %d (pid %d) on %s:%d", worker_id, process.pid, host, port)
+            returncode = await process.wait()
+            if self._stopping.is_set():
+                break
+            logger.error("VTN worker %d exited with %s, restarting it", worker_id, returncode)
+            await asyncio.sleep(RESTART_DELAY)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._stopping.set)
+        runner = None
+        if self.routing == "sticky":
+            proxy = StickyProxy([f"http://{host}:{port}" for host, port in
+                                 (self._worker_address(worker_id) for worker_id in range(self.count))],
+                                secret=self._proxy_secret, ssl_context=self.ssl_context)
+            runner = web.AppRunner(proxy.app, keepalive_timeout=self.keepalive_timeout)
+            await runner.setup()
+            await web.TCPSite(runner, host=self.host, port=self.port, ssl_context=self.ssl_context).start()
+            protocol = 'https' if self.ssl_context else 'http'
+            logger.info("Sticky proxy listening on %s://%s:%d", protocol, self.host, self.port)
+        workers = [loop.create_task(self._run_worker(worker_id)) for worker_id in range(self.count)]
+        await self._stopping.wait()
+        logger.info("Stopping VTN workers")
+        for process in self._processes.values():
+            if process.returncode is None:
+                process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(asyncio.gather(*workers), timeout=30)
+        except asyncio.TimeoutError:
+            for process in self._processes.values():
+                if process.returncode is None:
+                    process.kill()
+        if runner is not None:
+            await runner.cleanup()
+
+
+def run_workers(count: int, routing: str = "reuseport", host: str = "127.0.0.1", port: int = 8080,
+                ssl_context=None, keepalive_timeout: float = 75.0):
+    asyncio.run(Supervisor(count, routing=routing, host=host, port=port, ssl_context=ssl_context,
+                           keepalive_timeout=keepalive_timeout).run())
@@ -0,0 +1,262 @@
+# telemetry_store.py
+
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import quote, unquote
+import numpy as np
+
+from write_behind import WriteBehind
+
+logger = logging.getLogger('openleadr')
+
+# length of one segment directory in seconds, segments older than the
+# retention period are deleted as a whole
+SEGMENT_SECONDS = 24 * 60 * 60
+# the most buckets a single query may ask for
+MAX_BUCKETS = 10_000
+SERIES_SUFFIX = ".bin"
+
+
+def _series_filename(resource_id: str, measurement: str, worker_id: str = None) -> str:
+    # worker processes each append to their own file, queries read all of them
+    worker = f"@{quote(worker_id, safe='')}" if worker_id is not None else ""
+    return f"{quote(resource_id, safe='')}@{quote(measurement, safe='')}{worker}{SERIES_SUFFIX}"
+
+
+def _parse_series_filename(filename: str):
+    resource_id, measurement = filename[:-len(SERIES_SUFFIX)].split("@")[:2]
+    return unquote(resource_id), unquote(measurement)
+
+
+class TelemetryStore:
+    """
+    Append-only time-series store for VEN report samples.
+
+    Samples are kept per (ven_id, resource_id, measurement) series as packed
+    (timestamp, value) doubles and appended to segment files laid out as
+    <directory>/<segment start>/<ven_id>/<resource_id>@<measurement>.bin.
+    New samples are buffered in memory and appended in batches by a
+    WriteBehind flusher. Samples are assumed to arrive roughly in time order
+    within a series, which is what VENs do when reporting. With `worker_id`
+    set the files are named <resource_id>@<measurement>@<worker_id>.bin so
+    worker processes never append to the same file.
+    """
+
+    def __init__(self, directory: Path, retention_days: int = 30, flush_interval: float = 10.0,
+                 flush_threshold: int = 50_000, worker_id: str = None):
+        self._directory = directory
+        self._worker_id = worker_id
+        self.retention = retention_days * 24 * 60 * 60
+        if not self._directory.exists():
+            self._directory.mkdir(parents=True)
+        # {(segment_start, ven_id, resource_id, measurement): array('d', [t0, v0, t1, v1, ...])}
+        self._pending = dict()
+        # batch handed to the writer thread and the generation it belongs to
+        self._in_flight = dict()
+        self._in_flight_generation = 0
+        self._written_generation = 0
+        self._generation_lock = threading.Lock()
+        self.persistence = WriteBehind(self._snapshot, self._write_segments, interval=flush_interval,
+                                       threshold=flush_threshold, name="telemetry", restore=self._restore)
+
+    def append(self, ven_id: str, resource_id: str, measurement: str, timestamp: datetime, value):
+        self.extend(ven_id, resource_id, measurement, ((timestamp, value),))
+
+    def extend(self, ven_id: str, resource_id: str, measurement: str, data):
+        """Append the (timestamp, value) samples of one report to a series."""
+        count = 0
+        for timestamp, value in data:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                continue
+            ts = timestamp.timestamp()
+            segment = int(ts - ts % SEGMENT_SECONDS)
+            key = (segment, ven_id, resource_id, measurement)
+            samples = self._pending.get(key)
+            if samples is None:
+                samples = self._pending[key] = array("d")
+            samples.append(ts)
+            samples.append(value)
+            count += 1
+        if count:
+            self.persistence.mark_dirty(count)
+
+    def _snapshot(self):
+        self._in_flight = self._pending
+        self._in_flight_generation += 1
+        self._pending = dict()
+        # key -> number of doubles of the series that are on disk, filled in by the write
+        return self._in_flight_generation, self._in_flight, dict()
+
+    def _write_segments(self, snapshot):
+        generation, batch, written = snapshot
+        # queries hold the same lock, so they never see a half written batch
+        with self._generation_lock:
+            for key, samples in batch.items():
+                done = written.get(key, 0)
+                if done == len(samples):
+                    continue
+                segment, ven_id, resource_id, measurement = key
+                ven_directory = self._directory / str(segment) / quote(ven_id, safe='')
+                ven_directory.mkdir(parents=True, exist_ok=True)
+                path = ven_directory / _series_filename(resource_id, measurement, self._worker_id)
+                with open(path, mode="ab", buffering=0) as file:
+                    start = file.tell()
+                    try:
+                        samples[done:].tofile(file)
+                    except OSError:
+                        # keep the whole samples that made it, the rest is written by the next flush
+                        kept = (os.fstat(file.fileno()).st_size - start) // 16 * 16
+                        os.ftruncate(file.fileno(), start + kept)
+                        written[key] = done + kept // 8
+                        raise
+                written[key] = len(samples)
+            self._written_generation = generation
+        self._expire_segments()
+
+    def _restore(self, snapshot):
+        # a failed write puts the samples that are not on disk back in front of the newer ones
+        _, batch, written = snapshot
+        for key, samples in batch.items():
+            remaining = samples[written.get(key, 0):]
+            if not remaining:
+                continue
+            newer = self._pending.get(key)
+            if newer is not None:
+                remaining.extend(newer)
+            self._pending[key] = remaining
+        self._in_flight = dict()
+
+    def _expire_segments(self):
+        cutoff = time.time() - self.retention - SEGMENT_SECONDS
+        for segment in self._segments():
+            if segment < cutoff:
+                shutil.rmtree(self._directory / str(segment), ignore_errors=True)
+
+    def _segments(self):
+        segments = []
+        for path in self._directory.iterdir():
+            if path.is_dir() and path.name.isdigit():
+                segments.append(int(path.name))
+        return sorted(segments)
+
+    async def query(self, ven_id: str, start: datetime, end: datetime, resolution: float,
+                    resource_id: str = None, measurement: str = None):
+        """
+        Return min/max/mean per `resolution` second bucket between start and end
+        for every matching series of a VEN. The segment files are scanned in a
+        worker thread, only the requested range is read from each file.
+        """
+        start_ts, end_ts = start.timestamp(), end.timestamp()
+        if resolution <= 0 or end_ts <= start_ts:
+            raise ValueError("'to' must be after 'from' and resolution must be positive")
+        if (end_ts - start_ts) / resolution > MAX_BUCKETS:
+            raise ValueError(f"Query spans more than {MAX_BUCKETS} buckets, use a coarser resolution")
+
+        def matches(key):
+            return (key[1] == ven_id
+                    and (resource_id is None or key[2] == resource_id)
+                    and (measurement is None or key[3] == measurement))
+
+        # copy the buffers that are not on disk yet together with the
+        # generation they will be written as, so nothing is counted twice
+        pending = [(k, array("d", v)) for k, v in self._pending.items() if matches(k)]
+        in_flight = [(k, array("d", v)) for k, v in self._in_flight.items() if matches(k)]
+        buffers = ((self._in_flight_generation + 1, pending), (self._in_flight_generation, in_flight))
+
+        series = await asyncio.get_running_loop().run_in_executor(
+            None, self._aggregate, ven_id, start_ts, end_ts, resolution, resource_id, measurement, buffers)
+        return [
+            {
+                "resource_id": key[0],
+                "measurement": key[1],
+                "buckets": [
+                    {
+                        "time": datetime.fromtimestamp(start_ts + index * resolution, tz=timezone.utc).isoformat(),
+                        "min": minimum,
+                        "max": maximum,
+                        "mean": total / count,
+                        "count": count,
+                    }
+                    for index, minimum, maximum, total, count in zip(*(column.tolist() for column in buckets))
+                ],
+            }
+            for key, buckets in sorted(series.items())
+        ]
+
+    def _series_files(self, ven_id, start_ts, end_ts, resource_id, measurement):
+        """[(key, path, size)] of the matching series files, with the generation written to them."""
+        files = []
+        # the lock is only held to list the files, the sizes mark what was written by that generation
+        with self._generation_lock:
+            for segment in self._segments():
+                if segment + SEGMENT_SECONDS <= start_ts or segment > end_ts:
+                    continue
+                ven_directory = self._directory / str(segment) / quote(ven_id, safe='')
+                if not ven_directory.is_dir():
+                    continue
+                for path in ven_directory.iterdir():
+                    if not path.name.endswith(SERIES_SUFFIX):
+                        continue
+                    key = _parse_series_filename(path.name)
+                    if resource_id is not None and key[0] != resource_id:
+                        continue
+                    if measurement is not None and key[1] != measurement:
+                        continue
+                    files.append((key, path, path.stat().st_size))
+            return files, self._written_generation
+
+    def _aggregate(self, ven_id, start_ts, end_ts, resolution, resource_id, measurement, buffers):
+        # {(resource_id, measurement): [(n, 2) arrays of timestamp, value in the range]}
+        chunks = dict()
+        files, written = self._series_files(ven_id, start_ts, end_ts, resource_id, measurement)
+        for key, path, size in files:
+            rows = size // 16
+            if not rows:
+                continue
+            try:
+                samples = np.memmap(path, dtype=np.float64, mode="r", shape=(rows, 2))
+            except FileNotFoundError:
+                # expired while the query ran
+                continue
+            # samples arrive in time order, so the range is found with a binary search
+            first, last = np.searchsorted(samples[:, 0], (start_ts, end_ts))
+            chunks.setdefault(key, []).append(np.array(samples[first:last]))
+            del samples
+        for generation, batch in buffers:
+            if generation <= written:
+                continue
+            for key, samples in batch:
+                samples = np.frombuffer(samples, dtype=np.float64).reshape(-1, 2)
+                in_range = (samples[:, 0] >= start_ts) & (samples[:, 0] < end_ts)
+                chunks.setdefault(key[2:], []).append(samples[in_range])
+        series = dict()
+        for key, arrays in chunks.items():
+            buckets = _aggregate_samples(np.concatenate(arrays), start_ts, resolution)
+            if len(buckets[0]):
+                series[key] = buckets
+        return series
+
+
+def _aggregate_samples(samples, start_ts, resolution):
+    """
+    Fold (n, 2) rows of timestamp, value into `resolution` second buckets from
+    start_ts, returns arrays of bucket index, min, max, sum and count.
+    """
+    indices = ((samples[:, 0] - start_ts) // resolution).astype(np.int64)
+    order = np.argsort(indices, kind="stable")
+    indices, values = indices[order], samples[order, 1]
+    if not len(indices):
+        return indices, values, values, values, indices
+    starts = np.flatnonzero(np.concatenate(([True], indices[1:] != indices[:-1])))
+    counts = np.diff(np.append(starts, len(indices)))
+    return (indices[starts], np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts),
+            np.add.reduceat(values, starts), counts)
@@ -0,0 +1,22 @@
+import asyncio
+from types import SimpleNamespace
+
+from change_feed import MAX_QUEUED_FRAMES, ChangeFeed
+
+
+def test_slow_client_gets_no_stale_frames():
+    async def run():
+        registry = SimpleNamespace(listeners=[])
+        feed = ChangeFeed(SimpleNamespace(event_listeners=[]), registry)
+        queue = asyncio.Queue(maxsize=MAX_QUEUED_FRAMES)
+        feed._clients.add(queue)
+        for number in range(MAX_QUEUED_FRAMES + 1):
+            feed.event_response("ven_1", f"event_{number}", "optIn")
+            feed.publish()
+        assert feed.clients == 0
+        assert feed.disconnected == 1
+        # the stream ends right away instead of after the queued frames
+        assert queue.qsize() == 1
+        assert queue.get_nowait() is None
+
+    asyncio.run(run())
@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from zoneinfo import ZoneInfo
+
+import pytest
+from aiohttp import web
+
+from adr_utils import _parse_event_template
+from event_schedule import EventScheduler, Schedule
+
+START = datetime(2026, 1, 5, 17, 0, tzinfo=timezone.utc)
+
+
+def schedule(first_start=START, **kwargs):
+    return Schedule("peak", "SIMPLE", "level", [(60, 1), (30, 2)], first_start, {"all": True}, **kwargs)
+
+
+def test_once_has_a_single_occurrence():
+    once = schedule()
+    assert once.occurrence_start(0) == START
+    assert once.occurrence_start(1) is None
+
+
+def test_daily_ends_after_count():
+    daily = schedule(repeat="daily", count=3)
+    assert [daily.occurrence_start(number) for number in range(4)] == [
+        START, START + timedelta(days=1), START + timedelta(days=2), None]
+
+
+def test_weekly_ends_at_until():
+    weekly = schedule(repeat="weekly", until=START + timedelta(weeks=2))
+    assert weekly.occurrence_start(2) == START + timedelta(weeks=2)
+    assert weekly.occurrence_start(3) is None
+
+
+def test_skip_past_keeps_the_running_occurrence():
+    daily = schedule(repeat="daily")
+    # the second occurrence started 30 minutes ago and lasts 90 minutes
+    daily.skip_past(START + timedelta(days=1, minutes=30))
+    assert daily.released == 1
+    daily.skip_past(START + timedelta(days=1, minutes=91))
+    assert daily.released == 2
+
+
+def test_occurrence_at_now_is_neither_skipped_nor_duplicated():
+    daily = schedule(repeat="daily")
+    now = START + timedelta(days=2)
+    daily.skip_past(now)
+    assert daily.released == 2
+    assert daily.occurrence_start(daily.released) == now
+    daily.skip_past(now)
+    assert daily.released == 2
+    # the occurrence before it ended 22.5 hours ago, one that ends exactly now is over
+    daily.skip_past(now + daily.duration)
+    assert daily.released == 3
+
+
+def test_daily_keeps_its_local_time_across_dst():
+    amsterdam = ZoneInfo("Europe/Amsterdam")
+    # summer time starts on the night of 29 March 2026
+    daily = schedule(datetime(2026, 3, 27, 17, 0, tzinfo=amsterdam), repeat="daily", time_zone="Europe/Amsterdam")
+    starts = [daily.occurrence_start(number) for number in range(4)]
+    assert [start.astimezone(amsterdam).hour for start in starts] == [17, 17, 17, 17]
+    assert [start.hour for start in starts] == [16, 16, 15, 15]
+    assert starts[0].tzinfo == timezone.utc
+    daily.skip_past(starts[3])
+    assert daily.released == 3
+    # the estimate in UTC days is an hour off after the change
+    daily = schedule(datetime(2026, 3, 27, 17, 0, tzinfo=amsterdam), repeat="daily", time_zone="Europe/Amsterdam")
+    daily.skip_past(starts[2] + daily.duration + timedelta(minutes=1))
+    assert daily.released == 3
+
+
+def test_unknown_time_zone():
+    with pytest.raises(ValueError):
+        schedule(time_zone="Mars/Olympus_Mons")
+
+
+def test_release_at_the_exact_time_sends_once(tmp_path):
+    submitted = []
+
+    class Dispatcher:
+        def submit(self, ven_ids, signal_name, signal_type, intervals):
+            submitted.append(intervals[0]["dtstart"])
+            return SimpleNamespace(job_id=f"job-{len(submitted)}")
+
+    class Registry:
+        async def wait_loaded(self):
+            pass
+
+        def get_all_vens(self):
+            return [SimpleNamespace(ven_id="ven_1")]
+
+    async def run():
+        scheduler = EventScheduler(tmp_path / "schedules.json", Dispatcher(), Registry())
+        first_start = datetime.now(timezone.utc).replace(second=0, microsecond=0) + timedelta(hours=2)
+        scheduler.add(schedule(first_start, repeat="daily"))
+        release_at = (first_start - timedelta(hours=1)).timestamp()
+        assert await scheduler.release_due(release_at - 0.001) == 0
+        assert await scheduler.release_due(release_at) == 1
+        assert await scheduler.release_due(release_at) == 0
+        return first_start
+
+    assert submitted == [asyncio.run(run())]
+
+
+def test_round_trips_through_a_dict():
+    weekly = schedule(repeat="weekly", count=4, released=2, time_zone="America/New_York")
+    copy = Schedule.from_dict(weekly.as_dict())
+    assert copy.as_dict() == weekly.as_dict()
+
+
+@pytest.mark.parametrize("intervals", [{"duration": 60}, ["60"], [{"duration": 60}, None]])
+def test_intervals_must_be_a_list_of_objects(intervals):
+    payload = {"signalName": "SIMPLE", "signalType": "level", "startTime": "2026-01-05T17:00",
+               "intervals": intervals}
+    with pytest.raises(web.HTTPBadRequest):
+        _parse_event_template(payload)
@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp.test_utils import make_mocked_request
+
+import adr_utils
+from registry_storage import JsonRegistryStorage
+from response_cache import ResponseCache
+from ven_registry import VenRegistry
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    registry = VenRegistry(tmp_path, storage=JsonRegistryStorage(tmp_path / "vens.json"))
+    for name in ("ven_c", "ven_a", "ven_e", "ven_b", "other_d"):
+        registry.add_ven(name)
+    monkeypatch.setattr(adr_utils, "VEN_REGISTRY", registry)
+    monkeypatch.setattr(adr_utils, "RESPONSE_CACHE", ResponseCache())
+    monkeypatch.setattr(adr_utils, "_LISTED_REPORTS", (0, float("-inf")))
+    return registry
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(adr_utils, "_clock", lambda: now[0])
+    return now
+
+
+def list_vens(query="", etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    request = make_mocked_request("GET", f"/api/list_vens{query}", headers=headers)
+    return asyncio.run(adr_utils.handle_list_vens(request))
+
+
+def names(response):
+    return [ven["ven_name"] for ven in json.loads(response.body)]
+
+
+def test_pages_follow_the_cursor(registry):
+    pages = []
+    cursor = None
+    while True:
+        response = list_vens("?limit=2" + (f"&cursor={cursor}" if cursor else ""))
+        pages.append(names(response))
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert pages == [["other_d", "ven_a"], ["ven_b", "ven_c"], ["ven_e"]]
+
+
+def test_name_prefix_and_cursor(registry):
+    response = list_vens("?name_prefix=ven_&limit=3")
+    assert names(response) == ["ven_a", "ven_b", "ven_c"]
+    response = list_vens(f"?name_prefix=ven_&limit=3&cursor={response.headers['X-Next-Cursor']}")
+    assert names(response) == ["ven_e"]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_invalid_cursor_and_limit(registry):
+    from aiohttp import web
+    with pytest.raises(web.HTTPBadRequest):
+        list_vens("?cursor=abc")
+    with pytest.raises(web.HTTPBadRequest):
+        list_vens("?limit=0")
+
+
+def test_etag_changes_with_the_listing_only(registry, clock):
+    async def report(name):
+        registry.update_ven_report(name, 1.0, "W", "2024-06-01T12:00:00+00:00")
+
+    etag = list_vens().headers["ETag"]
+    assert list_vens(etag=etag).status == 304
+
+    # a VEN coming online changes the listing
+    asyncio.run(report("ven_a"))
+    assert list_vens(etag=etag).status == 200
+    etag = list_vens().headers["ETag"]
+
+    # further reports of an online VEN do not
+    asyncio.run(report("ven_a"))
+    assert list_vens(etag=etag).status == 304
+
+    registry.set_ven_groups("ven_b", ["north"])
+    assert list_vens(etag=etag).status == 200
+    etag = list_vens().headers["ETag"]
+    registry.add_ven("ven_f")
+    response = list_vens(etag=etag)
+    assert response.status == 200
+    assert "ven_f" in names(response)
+
+
+def test_reports_refresh_the_etag_at_most_every_interval(registry, clock):
+    async def reports():
+        registry.update_ven_report("ven_a", 1.0, "W", "2024-06-01T12:00:00+00:00")
+        registry.update_ven_report("ven_a", 2.0, "W", "2024-06-01T12:01:00+00:00")
+
+    etag = list_vens().headers["ETag"]
+    # an unchanged fleet keeps its ETag however long it is polled
+    clock[0] += 10 * adr_utils.VEN_LIST_REPORT_REFRESH
+    assert list_vens(etag=etag).status == 304
+
+    asyncio.run(reports())
+    etag = list_vens().headers["ETag"]
+    asyncio.run(reports())
+    clock[0] += adr_utils.VEN_LIST_REPORT_REFRESH - 1
+    assert list_vens(etag=etag).status == 304
+    clock[0] += 1
+    response = list_vens(etag=etag)
+    assert response.status == 200
+    assert list_vens(etag=response.headers["ETag"]).status == 304
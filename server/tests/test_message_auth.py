@@ -0,0 +1,124 @@
+import asyncio
+import gc
+from types import SimpleNamespace
+
+import pytest
+from openleadr import errors, utils
+from openleadr.messaging import create_message, validate_xml_schema
+from openleadr.service import vtn_service
+
+import vtn_server
+from message_auth import MessageAuthenticator
+from vtn_server import VtnServer
+
+# openleadr keeps the server in its app under a string key
+pytestmark = pytest.mark.filterwarnings("ignore::aiohttp.web.NotAppKeyWarning")
+
+
+class Connection:
+    """The ssl object of a TLS connection with a client certificate."""
+
+    def __init__(self, cert_pem: str):
+        self._der = utils.ssl.PEM_cert_to_DER_cert(cert_pem)
+
+    def getpeercert(self, binary_form=False):
+        return self._der
+
+
+class Request(dict):
+    def __init__(self, connection, app=None):
+        super().__init__()
+        self.secure = True
+        self.transport = SimpleNamespace(get_extra_info=lambda name: connection if name == "ssl_object" else None)
+        self.app = app
+
+
+@pytest.fixture
+def ven(make_certificate):
+    cert, key = make_certificate("ven_1")
+    cert_pem, key_pem = cert.read_text(), key.read_text()
+    return SimpleNamespace(cert=cert_pem, key=key_pem, fingerprint=utils.certificate_fingerprint(cert_pem))
+
+
+@pytest.fixture
+def other(make_certificate):
+    cert, key = make_certificate("other")
+    return SimpleNamespace(cert=cert.read_text(), key=key.read_text())
+
+
+def authenticator(fingerprint):
+    registry = SimpleNamespace(listeners=[],
+                               get_ven_info_from_id=lambda ven_id: SimpleNamespace(ven_id=ven_id,
+                                                                                   fingerprint=fingerprint))
+    return MessageAuthenticator(registry)
+
+
+def signed_message(cert, key, request_id="request-1"):
+    message = create_message("oadrRequestEvent", cert=cert.encode(), key=key.encode(), ven_id="ven_1",
+                             request_id=request_id)
+    return validate_xml_schema(message.encode())
+
+
+def authenticate(auth, request, message_tree):
+    asyncio.run(auth.authenticate(request, message_tree, {"ven_id": "ven_1"}))
+
+
+def test_signed_message_is_accepted_once(ven):
+    auth = authenticator(ven.fingerprint)
+    request = Request(Connection(ven.cert))
+    message_tree = signed_message(ven.cert, ven.key)
+    authenticate(auth, request, message_tree)
+    assert auth.verified == 1
+    # the same message again, with its timestamp and nonce
+    with pytest.raises(errors.NotRegisteredOrAuthorizedError):
+        authenticate(auth, request, message_tree)
+    assert auth.rejected == 1
+    authenticate(auth, request, signed_message(ven.cert, ven.key, "request-2"))
+    # the certificate was parsed once
+    assert (auth.verified, auth.cert_misses) == (2, 1)
+
+
+def test_mismatched_certificates_are_rejected(ven, other):
+    auth = authenticator(ven.fingerprint)
+    # a connection with another client certificate
+    with pytest.raises(errors.NotRegisteredOrAuthorizedError) as rejected:
+        authenticate(auth, Request(Connection(other.cert)), signed_message(ven.cert, ven.key))
+    assert "HTTPS certificate" in rejected.value.response_description
+    # the right connection, but signed with another certificate
+    with pytest.raises(errors.NotRegisteredOrAuthorizedError) as rejected:
+        authenticate(auth, Request(Connection(ven.cert)), signed_message(other.cert, other.key))
+    assert "used to sign" in rejected.value.response_description
+    assert (auth.verified, auth.rejected) == (0, 2)
+
+
+def test_connection_fingerprint_is_kept_per_connection(ven, other):
+    auth = authenticator(ven.fingerprint)
+    first = Connection(ven.cert)
+    assert auth.connection_fingerprint(Request(first)) == ven.fingerprint
+    assert auth.connection_fingerprint(Request(Connection(other.cert))) == utils.certificate_fingerprint(other.cert)
+    assert auth.connection_fingerprint(Request(first)) == ven.fingerprint
+    del first
+    gc.collect()
+    assert auth.stats()["connections"] == 0
+
+
+def test_server_without_authenticator_uses_openleadr(ven, monkeypatch):
+    calls = []
+
+    async def openleadr_authenticate(request, message_tree, message_payload, **kwargs):
+        calls.append("openleadr")
+
+    monkeypatch.setattr(vtn_server.messaging, "authenticate_message", openleadr_authenticate)
+    plain = VtnServer(vtn_id="plain")
+    checked = VtnServer(vtn_id="checked", authenticator=authenticator(ven.fingerprint))
+    message_tree = signed_message(ven.cert, ven.key)
+
+    async def run():
+        await vtn_service.authenticate_message(Request(Connection(ven.cert), plain.app), message_tree,
+                                               {"ven_id": "ven_1"}, ven_lookup=None)
+        await vtn_service.authenticate_message(Request(Connection(ven.cert), checked.app), message_tree,
+                                               {"ven_id": "ven_1"}, ven_lookup=None)
+
+    asyncio.run(run())
+    assert calls == ["openleadr"]
+    assert checked.authenticator.verified == 1
@@ -0,0 +1,55 @@
+import pytest
+
+import registration
+from registration import TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(registration.time, "monotonic", clock)
+    return clock
+
+
+def test_admits_the_burst_then_spreads_the_rest(clock):
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.take("ven_1") == 0
+    assert bucket.take("ven_2") == 0
+    waits = [bucket.take(f"ven_{number}") for number in range(3, 6)]
+    assert waits == pytest.approx([0.1, 0.2, 0.3])
+
+
+def test_reserved_token_is_not_given_to_a_newcomer(clock):
+    bucket = TokenBucket(rate=10, burst=1)
+    assert bucket.take("ven_1") == 0
+    assert bucket.take("ven_2") == pytest.approx(0.1)
+    clock.now += 0.1
+    # the token that came free belongs to ven_2
+    assert bucket.take("ven_3") == pytest.approx(0.1)
+    assert bucket.take("ven_2") == 0
+
+
+def test_early_retry_keeps_its_slot(clock):
+    bucket = TokenBucket(rate=10, burst=1)
+    bucket.take("ven_1")
+    assert bucket.take("ven_2") == pytest.approx(0.1)
+    clock.now += 0.05
+    assert bucket.take("ven_2") == pytest.approx(0.05)
+    assert bucket.take("ven_3") == pytest.approx(0.15)
+
+
+def test_unclaimed_reservations_expire(clock):
+    bucket = TokenBucket(rate=10, burst=1)
+    bucket.take("ven_1")
+    bucket.take("ven_2")
+    clock.now += registration.RESERVATION_GRACE + 1
+    assert bucket.take("ven_3") == 0
+    assert bucket._reservations == {}
@@ -0,0 +1,186 @@
+import struct
+from itertools import permutations
+
+import pytest
+
+import registry_storage
+from registry_storage import SnapshotRegistryStorage, create_storage, migrate
+
+BACKENDS = ("json", "sqlite", "snapshot")
+
+
+def _record(i, **fields):
+    return {
+        "ven_name": f"ven_{i}",
+        "ven_id": f"00000000-0000-0000-0000-{i:012d}",
+        "registration_id": f"reg-{i}",
+        "last_report": None,
+        "last_report_units": None,
+        "last_report_time": None,
+        "check_in_times": [],
+        "connection_quality": 0.0,
+        "groups": [],
+        "fingerprint": None,
+        **fields,
+    }
+
+
+RECORDS = {
+    record["ven_name"]: record
+    for record in (
+        _record(1),
+        _record(2, last_report=12.5, last_report_units="W", last_report_time=1717200000.0,
+                check_in_times=[1717199990.0, 1717200000.0], connection_quality=0.75, groups=["north", "pv"],
+                fingerprint="AA:BB:CC:DD:EE:FF:00:11:22:33"),
+        _record(3, ven_name="vén-ünïcode", last_report="on", groups=["süd"]),
+        _record(4, last_report={"value": 1, "unit": "kW"}),
+    )
+}
+
+
+def _write_all(storage, records, deletes=()):
+    # backends that are not incremental always get every VEN
+    storage.write({"upserts": dict(records), "deletes": set(deletes)})
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_round_trip(tmp_path, backend):
+    storage = create_storage(backend, tmp_path)
+    assert not storage.exists()
+    _write_all(storage, RECORDS)
+    assert storage.exists()
+    assert storage.load_all() == RECORDS
+    storage.close()
+
+
+@pytest.mark.parametrize("backend", ("sqlite", "snapshot"))
+def test_lookups(tmp_path, backend):
+    storage = create_storage(backend, tmp_path)
+    assert storage.lazy
+    assert storage.get("ven_name", "ven_1") is None
+    _write_all(storage, RECORDS)
+    for record in RECORDS.values():
+        for field in ("ven_name", "ven_id", "registration_id"):
+            assert storage.get(field, record[field]) == record
+    assert storage.get("ven_id", "unknown") is None
+    with pytest.raises(ValueError):
+        storage.get("groups", "north")
+    storage.close()
+
+
+@pytest.mark.parametrize("backend", ("sqlite", "snapshot"))
+def test_incremental_updates_and_deletes(tmp_path, backend):
+    storage = create_storage(backend, tmp_path)
+    assert storage.incremental
+    _write_all(storage, RECORDS)
+    changed = {**RECORDS["ven_1"], "connection_quality": 0.5, "groups": ["east"]}
+    storage.write({"upserts": {"ven_1": changed}, "deletes": {"ven_2"}})
+    expected = {**RECORDS, "ven_1": changed}
+    del expected["ven_2"]
+    assert storage.load_all() == expected
+    assert storage.get("ven_id", changed["ven_id"]) == changed
+    assert storage.get("ven_name", "ven_2") is None
+    storage.close()
+
+    # and after reopening
+    storage = create_storage(backend, tmp_path)
+    assert storage.load_all() == expected
+    assert storage.get("registration_id", "reg-1") == changed
+    storage.close()
+
+
+@pytest.mark.parametrize("source,destination", list(permutations(BACKENDS, 2)))
+def test_migrate(tmp_path, source, destination):
+    (tmp_path / "source").mkdir()
+    (tmp_path / "destination").mkdir()
+    source_storage = create_storage(source, tmp_path / "source")
+    _write_all(source_storage, RECORDS)
+    destination_storage = create_storage(destination, tmp_path / "destination")
+    assert migrate(source_storage, destination_storage) == len(RECORDS)
+    assert destination_storage.load_all() == RECORDS
+    source_storage.close()
+    destination_storage.close()
+
+
+def test_snapshot_flushes_append_to_a_log_until_compaction(tmp_path):
+    storage = SnapshotRegistryStorage(tmp_path / "vens.snap", compact_min_bytes=0)
+    log = tmp_path / "vens.snap.log"
+    _write_all(storage, RECORDS)
+    # an empty snapshot is compacted right away
+    assert storage.compactions == 1
+    assert log.stat().st_size == 0
+    snapshot = (tmp_path / "vens.snap").stat()
+
+    changed = {**RECORDS["ven_1"], "connection_quality": 0.5}
+    storage.write({"upserts": {"ven_1": changed}, "deletes": {"ven_2"}})
+    assert storage.compactions == 1
+    assert log.stat().st_size > 0
+    after = (tmp_path / "vens.snap").stat()
+    assert (after.st_ino, after.st_mtime_ns) == (snapshot.st_ino, snapshot.st_mtime_ns)
+    expected = {**RECORDS, "ven_1": changed}
+    del expected["ven_2"]
+    assert storage.load_all() == expected
+    assert storage.get("ven_id", changed["ven_id"]) == changed
+    assert storage.get("registration_id", "reg-2") is None
+    storage.close()
+
+    storage = SnapshotRegistryStorage(tmp_path / "vens.snap", compact_min_bytes=0)
+    assert storage.get("ven_name", "ven_1") == changed
+    assert storage.get("ven_name", "ven_2") is None
+    # the log outgrows half the snapshot
+    for name in ("ven_1", "vén-ünïcode", "ven_4"):
+        expected[name] = {**expected[name], "groups": ["west"]}
+        storage.write({"upserts": {name: expected[name]}, "deletes": set()})
+    assert storage.compactions == 1
+    assert log.stat().st_size < (tmp_path / "vens.snap").stat().st_size / 2
+    assert storage.load_all() == expected
+    assert storage.get("ven_name", "ven_4") == expected["ven_4"]
+    storage.close()
+
+
+def test_snapshot_log_with_a_torn_entry(tmp_path):
+    storage = SnapshotRegistryStorage(tmp_path / "vens.snap")
+    _write_all(storage, RECORDS)
+    storage.close()
+    with open(tmp_path / "vens.snap.log", "ab") as file:
+        file.write(b"\x01\xff\xff")
+
+    storage = SnapshotRegistryStorage(tmp_path / "vens.snap")
+    assert storage.load_all() == RECORDS
+    changed = {**RECORDS["ven_1"], "connection_quality": 0.5}
+    storage.write({"upserts": {"ven_1": changed}, "deletes": set()})
+    storage.close()
+
+    storage = SnapshotRegistryStorage(tmp_path / "vens.snap")
+    assert storage.load_all() == {**RECORDS, "ven_1": changed}
+    storage.close()
+
+
+def test_snapshot_written_with_another_check_in_window(tmp_path, monkeypatch):
+    check_ins = [1717200000.0 + 10 * i for i in range(registry_storage.CHECK_IN_WINDOW)]
+    records = {f"ven_{i}": _record(i, check_in_times=check_ins) for i in range(1, 4)}
+
+    # written by a version that kept 4 check-ins, ven_2 is left in the log
+    monkeypatch.setattr(registry_storage, "CHECK_IN_WINDOW", 4)
+    monkeypatch.setattr(registry_storage, "RECORD_PAYLOAD", struct.Struct("<" + registry_storage._payload_format(4)))
+    monkeypatch.setattr(registry_storage, "RECORD", registry_storage._record_struct(4))
+    storage = SnapshotRegistryStorage(tmp_path / "vens.snap", compact_min_bytes=0)
+    storage.write({"upserts": {"ven_1": records["ven_1"]}, "deletes": set()})
+    storage.close()
+    storage = SnapshotRegistryStorage(tmp_path / "vens.snap")
+    storage.write({"upserts": {"ven_2": records["ven_2"]}, "deletes": set()})
+    storage.close()
+    assert registry_storage.SNAPSHOT_HEADER.unpack_from((tmp_path / "vens.snap").read_bytes())[5] == 4
+    monkeypatch.undo()
+
+    storage = SnapshotRegistryStorage(tmp_path / "vens.snap")
+    assert storage.get("ven_name", "ven_1")["check_in_times"] == check_ins[-4:]
+    assert storage.get("ven_name", "ven_2")["check_in_times"] == check_ins[-4:]
+    # the next write appends in the current window and compacts the snapshot into it
+    storage.write({"upserts": {"ven_3": records["ven_3"]}, "deletes": set()})
+    assert storage.compactions == 1
+    assert registry_storage.SNAPSHOT_HEADER.unpack_from((tmp_path / "vens.snap").read_bytes())[5] == \
+        registry_storage.CHECK_IN_WINDOW
+    assert {name: record["check_in_times"] for name, record in storage.load_all().items()} == {
+        "ven_1": check_ins[-4:], "ven_2": check_ins[-4:], "ven_3": check_ins}
+    storage.close()
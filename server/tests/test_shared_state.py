@@ -0,0 +1,110 @@
+import asyncio
+from types import SimpleNamespace
+
+from bulk_dispatch import BulkDispatcher
+from registry_storage import JsonRegistryStorage
+from shared_state import SharedState
+from ven_registry import UnknownVenError, VenRegistry
+
+
+class FakeServer:
+    def __init__(self):
+        self.event_listeners = []
+        self.added = []
+
+    def find_duplicate(self, ven_id, signal_name, signal_type, intervals):
+        return None
+
+    def add_event(self, ven_id, signal_name, signal_type, intervals, callback=None):
+        self.added.append(ven_id)
+        return f"event-{ven_id}"
+
+
+class FakeRegistry:
+    def __init__(self, ven_ids):
+        self.listeners = []
+        self._ven_ids = ven_ids
+
+    def get_ven_info_from_id(self, ven_id):
+        if ven_id not in self._ven_ids:
+            raise UnknownVenError(ven_id)
+        return SimpleNamespace(ven_id=ven_id)
+
+
+def worker(tmp_path, worker_id):
+    server = FakeServer()
+    dispatcher = BulkDispatcher(server, FakeRegistry({"ven_1", "ven_2"}), chunk_size=1)
+    shared = SharedState(tmp_path / "shared_state.db", worker_id, server, dispatcher._registry,
+                         dispatcher=dispatcher)
+    return dispatcher, shared
+
+
+async def start(shared):
+    shared._last_seq, _ = await asyncio.get_running_loop().run_in_executor(None, shared._load)
+
+
+async def wait_finished(dispatcher, job_id):
+    while dispatcher.get(job_id).finished is None:
+        await asyncio.sleep(0)
+
+
+def test_job_status_is_answered_by_every_worker(tmp_path):
+    async def run():
+        dispatcher_0, shared_0 = worker(tmp_path, "0")
+        dispatcher_1, shared_1 = worker(tmp_path, "1")
+        await start(shared_0)
+        await start(shared_1)
+
+        job = dispatcher_0.submit(["ven_1", "ven_2", "ven_3"], "SIMPLE", "level", [])
+        await shared_0.sync()
+        assert (await dispatcher_1.job_status(job.job_id))["targets"] == 3
+
+        await wait_finished(dispatcher_0, job.job_id)
+        await shared_0.sync()
+        done = await dispatcher_1.job_status(job.job_id, include_results=True)
+        assert done == job.as_dict(include_results=True)
+        assert done["sent"] == 2
+        assert done["results"]["ven_3"]["status"] == "error"
+
+        await shared_0.close()
+        await shared_1.close()
+
+    asyncio.run(run())
+
+
+def test_unknown_job_is_none(tmp_path):
+    async def run():
+        dispatcher, shared = worker(tmp_path, "0")
+        await start(shared)
+        assert await dispatcher.job_status("no-such-job") is None
+        await shared.close()
+
+    asyncio.run(run())
+
+
+def test_remote_report_updates_the_ven_in_place(tmp_path):
+    async def run():
+        registries = [VenRegistry(tmp_path / str(number), storage=JsonRegistryStorage(tmp_path / f"vens_{number}.json"))
+                      for number in range(2)]
+        shared = [SharedState(tmp_path / "shared_state.db", str(number), FakeServer(), registry)
+                  for number, registry in enumerate(registries)]
+        for state in shared:
+            await start(state)
+        registries[0].add_ven("ven_1")
+        ven_id = registries[0].get_ven_info_from_name("ven_1").ven_id
+        await shared[0].sync()
+        await shared[1].sync()
+        remote = registries[1].get_ven_info_from_name("ven_1")
+
+        registries[0].update_ven_report("ven_1", "12.5", "W", "2026-01-05T17:00:00+00:00")
+        await shared[0].sync()
+        await shared[1].sync()
+        assert registries[1].get_ven_info_from_name("ven_1") is remote
+        assert registries[1].get_ven_info_from_id(ven_id) is remote
+        assert (remote.last_report, remote.last_report_units, remote.online) == ("12.5", "W", True)
+        assert remote.last_check_in == registries[0].get_ven_info_from_name("ven_1").last_check_in
+
+        for state in shared:
+            await state.close()
+
+    asyncio.run(run())
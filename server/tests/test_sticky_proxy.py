@@ -0,0 +1,72 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from sticky_proxy import CLIENT_FINGERPRINT, FINGERPRINT_HEADER, SECRET_HEADER, ProxiedRequests, StickyProxy
+
+SECRET = "proxy-secret"
+
+
+def worker_app(seen):
+    async def echo(request):
+        seen.append({"secure": request.secure, "fingerprint": request.get(CLIENT_FINGERPRINT),
+                     "headers": dict(request.headers)})
+        return web.Response(text=await request.text())
+
+    async def changes(request):
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(b"event: ready\ndata: {}\n\n")
+        # the proxy must pass the first frame on before the stream ends
+        await asyncio.sleep(0.5)
+        await response.write(b"data: done\n\n")
+        return response
+
+    app = web.Application(middlewares=[ProxiedRequests(SECRET).middleware])
+    app.router.add_post("/OpenADR2/Simple/2.0b/EiRegisterParty", echo)
+    app.router.add_get("/api/changes", changes)
+    return app
+
+
+async def run_through_proxy(test):
+    seen = []
+    async with TestServer(worker_app(seen)) as worker:
+        proxy = StickyProxy([str(worker.make_url("")).rstrip("/")], secret=SECRET)
+        async with TestServer(proxy.app) as front, aiohttp.ClientSession() as session:
+            await test(session, front, worker, seen)
+
+
+def test_forwards_with_the_secret_and_drops_client_proxy_headers():
+    async def test(session, front, worker, seen):
+        body = "<oadrVenName>ven_1</oadrVenName>"
+        async with session.post(front.make_url("/OpenADR2/Simple/2.0b/EiRegisterParty"), data=body,
+                                headers={FINGERPRINT_HEADER: "AA:BB", SECRET_HEADER: "guess"}) as response:
+            assert response.status == 200
+            assert await response.text() == body
+        assert seen[0]["fingerprint"] is None
+        assert seen[0]["secure"] is False
+        assert seen[0]["headers"][SECRET_HEADER] == SECRET
+
+    asyncio.run(run_through_proxy(test))
+
+
+def test_worker_refuses_requests_without_the_secret():
+    async def test(session, front, worker, seen):
+        async with session.post(worker.make_url("/OpenADR2/Simple/2.0b/EiRegisterParty"), data="x") as response:
+            assert response.status == 403
+        assert seen == []
+
+    asyncio.run(run_through_proxy(test))
+
+
+def test_event_stream_is_not_buffered():
+    async def test(session, front, worker, seen):
+        async with session.get(front.make_url("/api/changes")) as response:
+            assert response.headers["Content-Type"] == "text/event-stream"
+            first = await asyncio.wait_for(response.content.readuntil(b"\n\n"), timeout=0.4)
+            assert first == b"event: ready\ndata: {}\n\n"
+            assert await response.content.read() == b"data: done\n\n"
+
+    asyncio.run(run_through_proxy(test))
@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import telemetry_store
+from telemetry_store import TelemetryStore
+
+# recent enough not to be expired by the retention period
+START = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(days=1)
+
+
+def _samples(minutes, value=lambda minute: float(minute)):
+    return [(START + timedelta(minutes=minute), value(minute)) for minute in minutes]
+
+
+def test_query_buckets_written_and_pending_samples(tmp_path):
+    async def scenario():
+        store = TelemetryStore(tmp_path)
+        asyncio.ensure_future(store.persistence.run())
+        await asyncio.sleep(0)
+        store.extend("ven1", "meter", "RealPower", _samples(range(0, 60)))
+        await store.persistence.flush()
+        # not on disk yet
+        store.extend("ven1", "meter", "RealPower", _samples(range(60, 120)))
+        store.extend("ven1", "meter", "Voltage", _samples(range(0, 120), lambda minute: 230.0))
+        store.extend("ven2", "meter", "RealPower", _samples(range(0, 120), lambda minute: 1000.0))
+        return await store.query("ven1", START + timedelta(minutes=30), START + timedelta(minutes=90),
+                                 resolution=1800, measurement="RealPower")
+
+    series = asyncio.run(scenario())
+    assert len(series) == 1
+    assert series[0]["resource_id"] == "meter"
+    assert series[0]["measurement"] == "RealPower"
+    assert [(bucket["min"], bucket["max"], bucket["mean"], bucket["count"]) for bucket in series[0]["buckets"]] == [
+        (30.0, 59.0, 44.5, 30),
+        (60.0, 89.0, 74.5, 30),
+    ]
+    assert series[0]["buckets"][0]["time"] == (START + timedelta(minutes=30)).isoformat()
+
+
+def test_query_counts_every_sample_once(tmp_path):
+    async def scenario():
+        store = TelemetryStore(tmp_path)
+        asyncio.ensure_future(store.persistence.run())
+        await asyncio.sleep(0)
+        for hour in range(3):
+            store.extend("ven1", "meter", "RealPower", _samples(range(hour * 60, hour * 60 + 60)))
+            await store.persistence.flush()
+        return await store.query("ven1", START, START + timedelta(hours=3), resolution=3600)
+
+    buckets = asyncio.run(scenario())[0]["buckets"]
+    assert [bucket["count"] for bucket in buckets] == [60, 60, 60]
+
+
+def test_query_without_samples(tmp_path):
+    store = TelemetryStore(tmp_path)
+    assert asyncio.run(store.query("ven1", START, START + timedelta(hours=1), resolution=60)) == []
+
+
+class TornFile:
+    """A series file whose write stops half way through a sample and fails."""
+
+    def __init__(self, file):
+        self._file = file
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+    def write(self, data):
+        self._file.write(bytes(data)[:24])
+        raise OSError("disk full")
+
+
+def test_failed_flush_is_written_by_the_next_one(tmp_path, monkeypatch):
+    opened = []
+
+    def failing_open(path, *args, **kwargs):
+        # the first series is written, the second breaks off after one and a half samples
+        opened.append(path)
+        file = open(path, *args, **kwargs)
+        return TornFile(file) if len(opened) == 2 else file
+
+    async def scenario():
+        store = TelemetryStore(tmp_path)
+        asyncio.ensure_future(store.persistence.run())
+        await asyncio.sleep(0)
+        store.extend("ven1", "meter", "RealPower", _samples(range(0, 60)))
+        store.extend("ven1", "meter", "Voltage", _samples(range(0, 60), lambda minute: 230.0))
+        monkeypatch.setattr(telemetry_store, "open", failing_open, raising=False)
+        await store.persistence.flush()
+        assert store.persistence.dirty
+        failed = await store.query("ven1", START, START + timedelta(hours=1), resolution=3600)
+        monkeypatch.delattr(telemetry_store, "open")
+        store.extend("ven1", "meter", "Voltage", _samples(range(60, 120), lambda minute: 231.0))
+        await store.persistence.flush()
+        return failed, await store.query("ven1", START, START + timedelta(hours=2), resolution=3600)
+
+    failed, written = asyncio.run(scenario())
+    assert [[bucket["count"] for bucket in series["buckets"]] for series in failed] == [[60], [60]]
+    assert {series["measurement"]: [(bucket["count"], bucket["mean"]) for bucket in series["buckets"]]
+            for series in written} == {"RealPower": [(60, 29.5)], "Voltage": [(60, 230.0), (60, 231.0)]}
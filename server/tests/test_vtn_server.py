@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+import pytest
+from aiohttp.test_utils import TestServer
+from openleadr.messaging import create_message, parse_message
+
+from vtn_server import VtnServer
+
+EVENT_PATH = "/OpenADR2/Simple/2.0b/EiEvent"
+# openleadr keeps the server in its app under a string key
+pytestmark = pytest.mark.filterwarnings("ignore::aiohttp.web.NotAppKeyWarning")
+
+
+def add_event(server, start, ven_id="ven_1"):
+    return server.add_event(ven_id, "simple", "level",
+                            [{"dtstart": start, "duration": timedelta(minutes=10), "signal_payload": 1}],
+                            callback=lambda ven_id, event_id, opt_type: None)
+
+
+async def poll(session, vtn, request_id, ven_id="ven_1"):
+    """(message type, payload, raw message) of the answer to an oadrRequestEvent."""
+    body = create_message("oadrRequestEvent", ven_id=ven_id, request_id=request_id)
+    async with session.post(vtn.make_url(EVENT_PATH), data=body, headers={"Content-Type": "application/xml"}) as response:
+        assert response.status == 200
+        text = await response.text()
+    return (*parse_message(text), text)
+
+
+def run(server, test):
+    async def scenario():
+        async with TestServer(server.app) as vtn, aiohttp.ClientSession() as session:
+            await test(session, vtn)
+
+    asyncio.run(scenario())
+
+
+def statuses(payload):
+    return {event["event_descriptor"]["event_id"]: event["event_descriptor"]["event_status"]
+            for event in payload["events"]}
+
+
+def test_polls_share_the_rendered_message_with_their_own_request_ids():
+    server = VtnServer(vtn_id="vtn")
+    add_event(server, datetime.now(timezone.utc) + timedelta(hours=1))
+
+    async def test(session, vtn):
+        _, first, _ = await poll(session, vtn, "poll-1")
+        message = server._pending["ven_1"].message
+        _, second, _ = await poll(session, vtn, "poll-2")
+        assert server._pending["ven_1"].message is message
+        assert first["response"]["request_id"] == "poll-1"
+        assert second["response"]["request_id"] == "poll-2"
+        assert first["request_id"] != second["request_id"]
+        assert first["events"] == second["events"]
+
+    run(server, test)
+
+
+def test_status_change_at_dtstart_renders_again():
+    server = VtnServer(vtn_id="vtn")
+    start = datetime.now(timezone.utc) + timedelta(seconds=1)
+    event_id = add_event(server, start)
+
+    async def test(session, vtn):
+        _, before, _ = await poll(session, vtn, "poll-1")
+        message = server._pending["ven_1"].message
+        assert server._pending["ven_1"].valid_until == start.timestamp()
+        await asyncio.sleep((start - datetime.now(timezone.utc)).total_seconds() + 0.05)
+        _, after, _ = await poll(session, vtn, "poll-2")
+        assert statuses(before) == {event_id: "far"}
+        assert statuses(after) == {event_id: "active"}
+        assert server._pending["ven_1"].message is not message
+
+    run(server, test)
+
+
+def test_cancel_and_remove_invalidate_the_message():
+    server = VtnServer(vtn_id="vtn")
+    start = datetime.now(timezone.utc) + timedelta(hours=1)
+    cancelled, removed, kept = add_event(server, start), add_event(server, start), add_event(server, start)
+
+    async def test(session, vtn):
+        _, payload, _ = await poll(session, vtn, "poll-1")
+        assert statuses(payload) == {cancelled: "far", removed: "far", kept: "far"}
+        server.cancel_event("ven_1", cancelled)
+        _, payload, _ = await poll(session, vtn, "poll-2")
+        assert statuses(payload) == {cancelled: "cancelled", removed: "far", kept: "far"}
+        server.remove_event("ven_1", removed)
+        _, payload, _ = await poll(session, vtn, "poll-3")
+        assert statuses(payload) == {cancelled: "cancelled", kept: "far"}
+
+    run(server, test)
+
+
+def test_signed_messages_are_not_cached(make_certificate):
+    cert, key = make_certificate("vtn")
+    server = VtnServer(vtn_id="vtn", cert=str(cert), key=str(key))
+    add_event(server, datetime.now(timezone.utc) + timedelta(hours=1))
+
+    async def test(session, vtn):
+        _, first, first_text = await poll(session, vtn, "poll-1")
+        _, second, second_text = await poll(session, vtn, "poll-2")
+        assert server._pending["ven_1"].message is None
+        assert "SignatureValue" in first_text and "SignatureValue" in second_text
+        assert (first["response"]["request_id"], second["response"]["request_id"]) == ("poll-1", "poll-2")
+
+    run(server, test)
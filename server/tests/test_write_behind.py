@@ -0,0 +1,131 @@
+import asyncio
+import threading
+
+from write_behind import WriteBehind
+
+
+class Store:
+    """Dict of pending changes written to `written`, failing the next `fail` writes or blocking them."""
+
+    def __init__(self):
+        self.pending = dict()
+        self.written = dict()
+        self.fail = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def snapshot(self):
+        data, self.pending = self.pending, dict()
+        return data
+
+    def write(self, data):
+        self.started.set()
+        self.release.wait(5)
+        if self.fail:
+            self.fail = self.fail - 1
+            raise OSError("disk full")
+        self.written.update(data)
+
+    def restore(self, data):
+        self.pending = {**data, **self.pending}
+
+
+def make(store, **kwargs):
+    return WriteBehind(store.snapshot, store.write, restore=store.restore, **kwargs)
+
+
+def test_writes_through_before_run():
+    store = Store()
+    persistence = make(store)
+    store.pending["a"] = 1
+    persistence.mark_dirty()
+    assert store.written == {"a": 1}
+    assert persistence.dirty == 0
+
+
+def test_flushes_in_batches():
+    async def scenario():
+        store = Store()
+        persistence = make(store, interval=60, threshold=3)
+        task = asyncio.ensure_future(persistence.run())
+        await asyncio.sleep(0)
+        for key in "ab":
+            store.pending[key] = 1
+            persistence.mark_dirty()
+        await asyncio.sleep(0.05)
+        assert store.written == {}
+        store.pending["c"] = 1
+        persistence.mark_dirty()
+        for _ in range(100):
+            if store.written:
+                break
+            await asyncio.sleep(0.01)
+        assert store.written == {"a": 1, "b": 1, "c": 1}
+        assert persistence.flush_count == 1
+        task.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_failed_write_is_retried():
+    async def scenario():
+        store = Store()
+        persistence = make(store, interval=60)
+        task = asyncio.ensure_future(persistence.run())
+        await asyncio.sleep(0)
+        store.pending["a"] = 1
+        persistence.mark_dirty()
+        store.fail = 1
+        await persistence.flush()
+        assert store.written == {}
+        assert persistence.dirty == 1
+        await persistence.flush()
+        assert store.written == {"a": 1}
+        task.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_close_waits_for_a_running_write():
+    async def scenario():
+        store = Store()
+        persistence = make(store, interval=0.01)
+        asyncio.ensure_future(persistence.run())
+        await asyncio.sleep(0)
+        store.release.clear()
+        store.pending["a"] = 1
+        persistence.mark_dirty()
+        # the flusher is now blocked in the write thread
+        await asyncio.get_running_loop().run_in_executor(None, store.started.wait, 5)
+        store.pending["b"] = 2
+        persistence.mark_dirty()
+        closing = asyncio.ensure_future(persistence.close())
+        await asyncio.sleep(0.05)
+        assert not closing.done()
+        store.release.set()
+        await closing
+        assert store.written == {"a": 1, "b": 2}
+
+    asyncio.run(scenario())
+
+
+def test_close_retries_a_write_that_fails_during_shutdown():
+    async def scenario():
+        store = Store()
+        persistence = make(store, interval=0.01)
+        asyncio.ensure_future(persistence.run())
+        await asyncio.sleep(0)
+        store.release.clear()
+        store.fail = 1
+        store.pending["a"] = 1
+        persistence.mark_dirty()
+        await asyncio.get_running_loop().run_in_executor(None, store.started.wait, 5)
+        closing = asyncio.ensure_future(persistence.close())
+        await asyncio.sleep(0.05)
+        # the write started by the cancelled flush fails, close writes its changes again
+        store.release.set()
+        await closing
+        assert store.written == {"a": 1}
+
+    asyncio.run(scenario())
@@ -0,0 +1,57 @@
+# timer_wheel.py
+
+import asyncio
+import math
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel, one ticking task drives every timer.
+
+    Scheduling, rescheduling and cancelling a timer are O(1), each tick only
+    looks at the timers in its own slot. `callback(key)` is called on the
+    event loop when a timer expires.
+    """
+
+    def __init__(self, callback, tick: float = 1.0, slots: int = 512):
+        self._callback = callback
+        self.tick = tick
+        # each slot maps key -> tick at which it expires
+        self._slots = [dict() for _ in range(slots)]
+        self._timers = dict()
+        self._now = 0
+
+    def __len__(self):
+        return len(self._timers)
+
+    def schedule(self, key, delay: float):
+        """(Re)start the timer for key, it fires after `delay` seconds."""
+        self.cancel(key)
+        expires = self._now + max(1, math.ceil(delay / self.tick))
+        slot = expires % len(self._slots)
+        self._slots[slot][key] = expires
+        self._timers[key] = slot
+
+    def cancel(self, key):
+        slot = self._timers.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self):
+        self._now += 1
+        slot = self._slots[self._now % len(self._slots)]
+        expired = [key for key, expires in slot.items() if expires <= self._now]
+        for key in expired:
+            del slot[key]
+            del self._timers[key]
+            self._callback(key)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self.tick
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            # catch up on ticks missed while the loop was busy
+            while loop.time() >= next_tick:
+                self.advance()
+                next_tick += self.tick
@@ -1,21 +1,153 @@
 # ven_registry.py
 
-import json
+import asyncio
+import re
 import uuid
-from collections import namedtuple
+from array import array
 from pathlib import Path
-from collections import deque
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
+from write_behind import WriteBehind
+from timer_wheel import TimerWheel
+# CHECK_IN_WINDOW, the number of check-in times kept per VEN, is part of the snapshot layout
+from registry_storage import CHECK_IN_WINDOW, RegistryStorage, SqliteRegistryStorage, to_timestamp
 
 # expected VEN check-in interval in seconds
 EXPECTED_INTERVAL = 10
 # define a threshold for a "missed" check-in
 MAX_INTERVAL = EXPECTED_INTERVAL * 2
-# tolerance in seconds for connection qual calc
-# if its within tolerance then connection calc is 100%
-CHECKIN_TOLERANCE = 2
+# number of check-ins the connection quality average spans
+QUALITY_WINDOW = 10
+# seconds without a check-in before a VEN is shown as offline
+OFFLINE_AFTER = EXPECTED_INTERVAL * 3
 
-VenInfo = namedtuple("VenInfo", ["ven_name", "ven_id", "registration_id", "last_report", "last_report_units", "last_report_time", "check_in_times"])
+UUID_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def pack_id(value: str):
+    """A canonical UUID string as its 128-bit int, any other id is kept as it is."""
+    if UUID_PATTERN.fullmatch(value):
+        return int(value.replace("-", ""), 16)
+    return value
+
+
+def unpack_id(value) -> str:
+    if isinstance(value, str):
+        return value
+    return str(uuid.UUID(int=value))
+
+
+class VenInfo:
+    """
+    A registered VEN. The registry updates it in place, so a report
+    changes a few attributes instead of building a new record.
+
+    The ids are kept as 128-bit ints and turned back into strings when
+    read, the last report time and the check-in times as POSIX seconds,
+    the check-ins in a ring buffer of CHECK_IN_WINDOW doubles.
+    """
+
+    __slots__ = ("ven_name", "_ven_id", "_registration_id", "last_report", "last_report_units", "_last_report_time",
+                 "_check_ins", "_check_in_next", "_check_in_count", "connection_quality", "online", "groups",
+                 "fingerprint")
+
+    def __init__(self, ven_name: str, ven_id: str, registration_id: str, last_report=None, last_report_units=None,
+                 last_report_time=None, check_in_times=(), connection_quality: float = 0.0, online: bool = False,
+                 groups=(), fingerprint: str = None):
+        self.ven_name = ven_name
+        self._ven_id = pack_id(ven_id)
+        self._registration_id = pack_id(registration_id)
+        self.last_report = last_report
+        self.last_report_units = last_report_units
+        self._last_report_time = None if last_report_time is None else to_timestamp(last_report_time)
+        self.connection_quality = connection_quality
+        self.online = online
+        self.groups = tuple(groups)
+        # fingerprint of the VEN's client certificate, as openleadr computes it
+        self.fingerprint = fingerprint
+        # allocated on the first check-in
+        self._check_ins = None
+        self._check_in_next = 0
+        self._check_in_count = 0
+        if check_in_times:
+            timestamps = [to_timestamp(check_in_time) for check_in_time in check_in_times][-CHECK_IN_WINDOW:]
+            self._check_in_count = len(timestamps)
+            self._check_in_next = self._check_in_count % CHECK_IN_WINDOW
+            self._check_ins = array("d", timestamps + [0.0] * (CHECK_IN_WINDOW - self._check_in_count))
+
+    @property
+    def ven_id(self) -> str:
+        return unpack_id(self._ven_id)
+
+    @property
+    def registration_id(self) -> str:
+        return unpack_id(self._registration_id)
+
+    @property
+    def last_report_time(self):
+        """ISO time of the last report, or None."""
+        if self._last_report_time is None:
+            return None
+        return datetime.fromtimestamp(self._last_report_time, timezone.utc).isoformat()
+
+    @property
+    def last_check_in(self):
+        """POSIX time of the last check-in, or None."""
+        if not self._check_in_count:
+            return None
+        return self._check_ins[self._check_in_next - 1]
+
+    @property
+    def check_in_times(self):
+        """The last CHECK_IN_WINDOW check-in times as datetimes, oldest first."""
+        return [datetime.fromtimestamp(timestamp, timezone.utc) for timestamp in self.check_in_timestamps()]
+
+    def check_in_timestamps(self):
+        """The last CHECK_IN_WINDOW check-in times as POSIX seconds, oldest first."""
+        start = (self._check_in_next - self._check_in_count) % CHECK_IN_WINDOW
+        return [self._check_ins[(start + i) % CHECK_IN_WINDOW] for i in range(self._check_in_count)]
+
+    def add_check_in(self, timestamp: float):
+        if self._check_ins is None:
+            self._check_ins = array("d", bytes(8 * CHECK_IN_WINDOW))
+        self._check_ins[self._check_in_next] = timestamp
+        self._check_in_next = (self._check_in_next + 1) % CHECK_IN_WINDOW
+        if self._check_in_count < CHECK_IN_WINDOW:
+            self._check_in_count += 1
+
+    def __repr__(self):
+        return (f"VenInfo(ven_name={self.ven_name!r}, ven_id={self.ven_id!r}, "
+                f"registration_id={self.registration_id!r}, online={self.online!r})")
+
+
+def ven_info_to_record(ven_info: VenInfo) -> dict:
+    # online is runtime state, every VEN starts offline until it checks in
+    return {
+        "ven_name": ven_info.ven_name,
+        "ven_id": ven_info.ven_id,
+        "registration_id": ven_info.registration_id,
+        "last_report": ven_info.last_report,
+        "last_report_units": ven_info.last_report_units,
+        "last_report_time": ven_info.last_report_time,
+        "check_in_times": ven_info.check_in_timestamps(),
+        "connection_quality": ven_info.connection_quality,
+        "groups": list(ven_info.groups),
+        "fingerprint": ven_info.fingerprint,
+    }
+
+def _record_to_ven_info(record: dict) -> VenInfo:
+    # check_in_times are POSIX seconds, or ISO strings in registries written by older versions
+    return VenInfo(
+        ven_name=record["ven_name"],
+        ven_id=record["ven_id"],
+        registration_id=record["registration_id"],
+        last_report=record.get("last_report"),
+        last_report_units=record.get("last_report_units"),
+        last_report_time=record.get("last_report_time"),
+        check_in_times=record.get("check_in_times", ()),
+        connection_quality=record.get("connection_quality", 0.0),
+        groups=record.get("groups", ()),
+        fingerprint=record.get("fingerprint"),
+    )
 
 class DuplicateVenError(Exception):
     """Raised when adding a duplicate VEN to the registry."""
@@ -24,113 +156,394 @@ class UnknownVenError(Exception):
     """Raised when requesting info on an unknown VEN."""
 
 class VenRegistry:
-    def __init__(self, directory: Path):
+    def __init__(self, directory: Path, storage: RegistryStorage = None, flush_interval: float = 5.0,
+                 flush_threshold: int = 500, quality_window: int = QUALITY_WINDOW,
+                 offline_after: float = OFFLINE_AFTER):
         self._vens = dict()
+        # secondary indexes, both map to the ven_name key of self._vens
+        self._ven_ids = dict()
+        self._registration_ids = dict()
+        # group name -> set of ven_names
+        self._groups = dict()
+        # changes since the last flush, and every VEN removed since startup so
+        # lazy lookups never resurrect a VEN whose delete is still in flight
+        self._dirty_names = set()
+        self._deleted_names = set()
+        self._removed_names = set()
+        self._fully_loaded = False
+        # set while preload() runs
+        self._preloaded = None
+        # bumped on every visible change, on changes shown in VEN listings (everything but the
+        # reports of VENs that are online already), on reports, and on VENs being added or removed
+        self.version = 0
+        self.listing_version = 0
+        self.report_version = 0
+        self.names_version = 0
+        self._sorted_names = (-1, [])
         self._directory = directory
-        self._filename = directory / "vens.json"
         if not self._directory.exists():
             self._directory.mkdir(parents=True)
-        if self._filename.exists():
+        self._storage = storage or SqliteRegistryStorage(directory / "vens.db")
+        # mutations only mark the registry dirty, the storage is written in batches
+        self.persistence = WriteBehind(self._snapshot, self._storage.write, restore=self._restore,
+                                       interval=flush_interval, threshold=flush_threshold)
+        # connection quality is an exponentially weighted average of valid
+        # check-ins, updated as reports arrive
+        self._quality_alpha = 2 / (quality_window + 1)
+        # a single timer wheel marks VENs offline when they stop checking in
+        self._offline_after = offline_after
+        self.liveness = TimerWheel(self._mark_offline)
+        # callables called with (action, ven_info) where action is "added",
+        # "updated", "reported", "offline" or "removed"
+        self.listeners = []
+        if not self._storage.lazy:
             self.load_from_file()
 
-    def add_ven(self, ven_name: str):
-        if ven_name in self._vens:
+    def __len__(self):
+        """Number of VENs held in memory."""
+        return len(self._vens)
+
+    def add_ven(self, ven_name: str, groups=(), fingerprint: str = None):
+        if self._lookup("ven_name", ven_name) is not None:
             raise DuplicateVenError
 
-        self._vens[ven_name] = VenInfo(
+        ven_info = VenInfo(
             ven_name=ven_name,
             ven_id=str(uuid.uuid4()),
             registration_id=str(uuid.uuid4()),
-            last_report=None,
-            last_report_units=None,
-            last_report_time=None,
-            check_in_times=deque(maxlen=10)
+            groups=groups,
+            fingerprint=fingerprint,
         )
-        self.save_to_file()
+        self._vens[ven_name] = ven_info
+        self._index(ven_info)
+        self._removed_names.discard(ven_name)
+        self._deleted_names.discard(ven_name)
+        self.names_version += 1
+        self._mark_dirty(ven_name)
+        self._notify("added", ven_info)
 
-    def update_ven_report(self, ven_name: str, report_value: str, units: str, timestamp: str):
-        if ven_name not in self._vens:
+    def update_ven_report(self, ven_name: str, report_value: str, units: str, timestamp):
+        """Record a report, `timestamp` is an ISO string or a datetime. The VenInfo is updated in place."""
+        ven_info = self._lookup("ven_name", ven_name)
+        if ven_info is None:
             raise UnknownVenError(f"VEN {ven_name} not found")
-        ven_info = self._vens[ven_name]
-        new_check_in_times = ven_info.check_in_times
-        new_check_in_times.append(datetime.fromisoformat(timestamp))
-        updated_ven_info = ven_info._replace(
-            last_report=report_value,
-            last_report_units=units,
-            last_report_time=timestamp,
-            check_in_times=new_check_in_times
-        )
-        self._vens[ven_name] = updated_ven_info
-        self.save_to_file()
+        came_online = self._record_report(ven_info, report_value, units, to_timestamp(timestamp))
+        self._mark_dirty(ven_name, listed=came_online)
+        self._notify("reported", ven_info)
+
+    def _record_report(self, ven_info: VenInfo, report_value: str, units: str, check_in_time: float) -> bool:
+        """Update the VenInfo with a report, returns whether the VEN came online with it."""
+        if ven_info._check_in_count:
+            interval = check_in_time - ven_info.last_check_in
+            if interval > 0:
+                score = 100.0 if interval <= MAX_INTERVAL else 0.0
+                if ven_info._check_in_count == 1:
+                    # first interval seeds the average
+                    ven_info.connection_quality = score
+                else:
+                    ven_info.connection_quality += self._quality_alpha * (score - ven_info.connection_quality)
+        ven_info.add_check_in(check_in_time)
+        ven_info.last_report = report_value
+        ven_info.last_report_units = units
+        ven_info._last_report_time = check_in_time
+        came_online = not ven_info.online
+        ven_info.online = True
+        self.liveness.schedule(ven_info.ven_name, self._offline_after)
+        self.report_version += 1
+        return came_online
+
+    def set_ven_groups(self, ven_name: str, groups):
+        """Replace the groups (tags) a VEN belongs to."""
+        ven_info = self._lookup("ven_name", ven_name)
+        if ven_info is None:
+            raise UnknownVenError(f"VEN {ven_name} not found")
+        self._unindex(ven_info)
+        ven_info.groups = tuple(groups)
+        self._index(ven_info)
+        self._mark_dirty(ven_name)
+        self._notify("updated", ven_info)
+
+    def set_ven_fingerprint(self, ven_name: str, fingerprint: str):
+        """Set the fingerprint of the client certificate the VEN connects with, None to clear it."""
+        ven_info = self._lookup("ven_name", ven_name)
+        if ven_info is None:
+            raise UnknownVenError(f"VEN {ven_name} not found")
+        ven_info.fingerprint = fingerprint
+        self._mark_dirty(ven_name)
+        self._notify("updated", ven_info)
+
+    def get_vens_in_groups(self, groups):
+        """Return every VEN that belongs to at least one of the groups."""
+        self.ensure_loaded()
+        ven_names = set()
+        for group in groups:
+            ven_names.update(self._groups.get(group, ()))
+        return [self._vens[ven_name] for ven_name in sorted(ven_names)]
+
+    def get_groups(self):
+        """Return every group with its number of VENs."""
+        self.ensure_loaded()
+        return {group: len(ven_names) for group, ven_names in sorted(self._groups.items())}
+
+    def _mark_offline(self, ven_name: str):
+        ven_info = self._vens.get(ven_name)
+        if ven_info is not None:
+            ven_info.online = False
+            self.version += 1
+            self.listing_version += 1
+            self._notify("offline", ven_info)
 
     def get_ven_info_from_name(self, ven_name: str) -> VenInfo:
         """Return information on a registered VEN from its name."""
-        try:
-            return self._vens[ven_name]
-        except KeyError:
+        ven_info = self._lookup("ven_name", ven_name)
+        if ven_info is None:
             raise UnknownVenError
+        return ven_info
 
     def get_ven_info_from_id(self, ven_id: str) -> VenInfo:
         """Return information on a registered VEN from its ID."""
-        for ven in self._vens.values():
-            if ven.ven_id == ven_id:
-                return ven
-        raise UnknownVenError
+        ven_info = self._lookup("ven_id", ven_id)
+        if ven_info is None:
+            raise UnknownVenError
+        return ven_info
+
+    def get_ven_info_from_registration_id(self, registration_id: str) -> VenInfo:
+        """Return information on a registered VEN from its registration ID."""
+        ven_info = self._lookup("registration_id", registration_id)
+        if ven_info is None:
+            raise UnknownVenError
+        return ven_info
+
+    def _lookup(self, field: str, value: str):
+        """Find a VEN in memory, falling back to the storage backend until it is fully loaded."""
+        if field == "ven_name":
+            ven_name = value
+        elif field == "ven_id":
+            ven_name = self._ven_ids.get(pack_id(value))
+        else:
+            ven_name = self._registration_ids.get(pack_id(value))
+        if ven_name is not None and ven_name in self._vens:
+            return self._vens[ven_name]
+        if self._fully_loaded:
+            return None
+        record = self._storage.get(field, value)
+        if record is None or record["ven_name"] in self._removed_names:
+            return None
+        ven_info = _record_to_ven_info(record)
+        self._vens[ven_info.ven_name] = ven_info
+        self._index(ven_info)
+        return ven_info
+
+    def _index(self, ven_info: VenInfo):
+        self._ven_ids[ven_info._ven_id] = ven_info.ven_name
+        self._registration_ids[ven_info._registration_id] = ven_info.ven_name
+        for group in ven_info.groups:
+            self._groups.setdefault(group, set()).add(ven_info.ven_name)
+
+    def _unindex(self, ven_info: VenInfo):
+        self._ven_ids.pop(ven_info._ven_id, None)
+        self._registration_ids.pop(ven_info._registration_id, None)
+        for group in ven_info.groups:
+            ven_names = self._groups.get(group)
+            if ven_names is not None:
+                ven_names.discard(ven_info.ven_name)
+                if not ven_names:
+                    del self._groups[group]
+
+    def _rebuild_indexes(self):
+        self._ven_ids = {v._ven_id: k for k, v in self._vens.items()}
+        self._registration_ids = {v._registration_id: k for k, v in self._vens.items()}
+        self._groups = dict()
+        for k, v in self._vens.items():
+            for group in v.groups:
+                self._groups.setdefault(group, set()).add(k)
+
+    def _mark_dirty(self, ven_name: str, listed: bool = True):
+        self.version += 1
+        if listed:
+            self.listing_version += 1
+        self._dirty_names.add(ven_name)
+        self.persistence.mark_dirty()
+
+    def _snapshot(self):
+        # runs on the event loop so the records are not mutated while being copied
+        if self._storage.incremental:
+            names = self._dirty_names
+        else:
+            names = self._vens.keys()
+        batch = {
+            "upserts": {k: ven_info_to_record(self._vens[k]) for k in names if k in self._vens},
+            "deletes": self._deleted_names,
+        }
+        self._dirty_names = set()
+        self._deleted_names = set()
+        return batch
+
+    def _restore(self, batch):
+        # a failed write puts its VENs back so the next flush retries them
+        for ven_name in batch["upserts"]:
+            if ven_name in self._vens:
+                self._dirty_names.add(ven_name)
+        for ven_name in batch["deletes"]:
+            if ven_name not in self._vens:
+                self._deleted_names.add(ven_name)
 
     def save_to_file(self):
-        with open(self._filename, mode="w") as file:
-            vens = {k: {**v._asdict(), "check_in_times": list(map(str, v.check_in_times))} for k, v in self._vens.items()}
-            json.dump(vens, file)
+        """Write the whole registry to storage synchronously."""
+        self._storage.write({
+            "upserts": {k: ven_info_to_record(v) for k, v in self._vens.items()},
+            "deletes": set(self._deleted_names),
+        })
+
+    async def close(self):
+        """Flush any pending changes, call this on shutdown."""
+        await self.persistence.close()
+        self._storage.close()
 
     def load_from_file(self):
-        with open(self._filename, mode="r") as file:
-            vens = json.load(file)
-            self._vens = {k: VenInfo(**{**v, 'last_report': v.get('last_report', None), 'last_report_units': v.get('last_report_units', None), 'last_report_time': v.get('last_report_time', None), 'check_in_times': deque(map(datetime.fromisoformat, v.get('check_in_times', [])), maxlen=10)}) for k, v in vens.items()}
+        """Load every VEN from storage, VENs already in memory are kept as they are."""
+        if self._storage.exists():
+            for k, v in self._storage.load_all().items():
+                if k not in self._vens and k not in self._removed_names:
+                    self._vens[k] = _record_to_ven_info(v)
+        self._rebuild_indexes()
+        self._fully_loaded = True
+        self.version += 1
+        self.listing_version += 1
+        self.names_version += 1
+
+    async def preload(self, chunk_size: int = 5000):
+        """
+        Load every VEN in the background. Records are read and decoded in a
+        worker thread and added to memory in chunks, lookups of VENs that are
+        not loaded yet keep going to the storage meanwhile.
+        """
+        if self._fully_loaded:
+            return
+        self._preloaded = asyncio.Event()
+        try:
+            ven_infos = []
+            if self._storage.exists():
+                ven_infos = await asyncio.get_running_loop().run_in_executor(None, self._load_ven_infos)
+            for start in range(0, len(ven_infos), chunk_size):
+                if self._fully_loaded:
+                    # ensure_loaded got there first
+                    return
+                for ven_info in ven_infos[start:start + chunk_size]:
+                    if ven_info.ven_name not in self._vens and ven_info.ven_name not in self._removed_names:
+                        self._vens[ven_info.ven_name] = ven_info
+                        self._index(ven_info)
+                await asyncio.sleep(0)
+            self._fully_loaded = True
+            self.version += 1
+            self.listing_version += 1
+            self.names_version += 1
+        finally:
+            self._preloaded.set()
+            self._preloaded = None
+
+    def _load_ven_infos(self):
+        # runs in a worker thread
+        return [_record_to_ven_info(record) for record in self._storage.load_all().values()]
+
+    async def wait_loaded(self):
+        """Like ensure_loaded, but waits for a running preload() instead of loading everything again."""
+        if self._preloaded is not None:
+            await self._preloaded.wait()
+        self.ensure_loaded()
+
+    def ensure_loaded(self):
+        if not self._fully_loaded:
+            self.load_from_file()
 
     def remove_ven(self, ven_name):
-        if ven_name not in self._vens:
+        ven_info = self._lookup("ven_name", ven_name)
+        if ven_info is None:
             raise UnknownVenError(f"VEN {ven_name} not found")
-        del self._vens[ven_name]
-        self.save_to_file()
+        self._unindex(self._vens.pop(ven_name))
+        self.liveness.cancel(ven_name)
+        self._removed_names.add(ven_name)
+        self._deleted_names.add(ven_name)
+        self._dirty_names.discard(ven_name)
+        self.version += 1
+        self.listing_version += 1
+        self.names_version += 1
+        self.persistence.mark_dirty()
+        self._notify("removed", ven_info)
 
-    def get_all_vens(self):
-        return list(self._vens.values())
+    def _notify(self, action: str, ven_info: VenInfo):
+        for listener in self.listeners:
+            listener(action, ven_info)
 
-    def calculate_connection_quality(self, ven_name: str) -> float:
-        ven_info = self._vens[ven_name]
-        check_in_times = ven_info.check_in_times
+    def apply_remote(self, action: str, record: dict):
+        """
+        Apply a change made by another worker process. The other worker
+        persists it, so the VEN is not marked dirty. Listeners are called as
+        for a local change.
+        """
+        ven_name = record["ven_name"]
+        current = self._vens.pop(ven_name, None)
+        if current is not None:
+            self._unindex(current)
+        self.version += 1
+        self.listing_version += 1
+        if action == "removed":
+            self.liveness.cancel(ven_name)
+            self._removed_names.add(ven_name)
+            self.names_version += 1
+            if current is not None:
+                self._notify("removed", current)
+            return
+        ven_info = _record_to_ven_info(record)
+        if current is not None:
+            ven_info.online = current.online
+        else:
+            self._removed_names.discard(ven_name)
+            self.names_version += 1
+        self._vens[ven_name] = ven_info
+        self._index(ven_info)
+        self._notify(action, ven_info)
 
-        if len(check_in_times) < 2:
-            return 0.0
+    def apply_remote_report(self, ven_name: str, report_value: str, units: str, timestamp: float):
+        """Apply a report another worker process received, in place as update_ven_report does."""
+        ven_info = self._lookup("ven_name", ven_name)
+        if ven_info is None:
+            raise UnknownVenError(f"VEN {ven_name} not found")
+        came_online = self._record_report(ven_info, report_value, units, timestamp)
+        self.version += 1
+        if came_online:
+            self.listing_version += 1
+        self._notify("reported", ven_info)
 
-        intervals = [
-            (check_in_times[i] - check_in_times[i-1]).total_seconds()
-            for i in range(1, len(check_in_times))
-        ]
+    def get_all_vens(self):
+        self.ensure_loaded()
+        return list(self._vens.values())
 
-        valid_intervals = [interval for interval in intervals if interval <= MAX_INTERVAL]
-        valid_intervals_avg = sum(valid_intervals) / len(valid_intervals)
+    def sorted_ven_names(self):
+        """All VEN names in sorted order, rebuilt only when VENs are added or removed."""
+        self.ensure_loaded()
+        if self._sorted_names[0] != self.names_version:
+            self._sorted_names = (self.names_version, sorted(self._vens))
+        return self._sorted_names[1]
 
-        if abs(valid_intervals_avg - EXPECTED_INTERVAL) > CHECKIN_TOLERANCE:
-            connection_quality = len(valid_intervals) / len(intervals) * 100
-        else:
-            connection_quality = 100.00
+    def calculate_connection_quality(self, ven_name: str) -> float:
+        """Return the connection quality kept up to date by update_ven_report."""
+        return self.get_ven_info_from_name(ven_name).connection_quality
 
-        #print(f"valid_intervals_avg: {valid_intervals_avg}")
-        #print(f"connection_quality: {connection_quality}")
-        return connection_quality
+    @staticmethod
+    def ven_with_quality(ven: VenInfo) -> dict:
+        return {
+            "ven_name": ven.ven_name,
+            "ven_id": ven.ven_id,
+            "registration_id": ven.registration_id,
+            "last_report": ven.last_report,
+            "last_report_units": ven.last_report_units,
+            "last_report_time": ven.last_report_time,
+            "connection_quality": ven.connection_quality,
+            "online": ven.online,
+            "groups": list(ven.groups),
+            "fingerprint": ven.fingerprint,
+        }
 
     def get_all_vens_with_quality(self):
-        ven_list = self.get_all_vens()
-        return [
-            {
-                "ven_name": ven.ven_name,
-                "ven_id": ven.ven_id,
-                "registration_id": ven.registration_id,
-                "last_report": ven.last_report,
-                "last_report_units": ven.last_report_units,
-                "last_report_time": ven.last_report_time,
-                "connection_quality": self.calculate_connection_quality(ven.ven_name)
-            }
-            for ven in ven_list
-        ]
+        return [self.ven_with_quality(ven) for ven in self.get_all_vens()]
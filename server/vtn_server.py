@@ -0,0 +1,298 @@
+# vtn_server.py
+
+import logging
+import ssl
+import uuid
+from datetime import datetime, timezone
+from functools import partial
+from aiohttp import web
+from openleadr import OpenADRServer, enums, messaging, utils
+from openleadr.service import VTNService, vtn_service
+from message_auth import MessageSigner
+
+logger = logging.getLogger('openleadr')
+
+
+def event_key(signal_name, signal_type, intervals):
+    """Hashable identity of an event's signal, used to detect duplicate events."""
+    return (
+        signal_name,
+        signal_type,
+        tuple(
+            (
+                utils.getmember(interval, 'dtstart').isoformat(),
+                utils.getmember(interval, 'duration').total_seconds(),
+                utils.getmember(interval, 'signal_payload'),
+            )
+            for interval in intervals
+        ),
+    )
+
+
+def _event_signal_key(event):
+    signal = utils.getmember(event, 'event_signals')[0]
+    return event_key(utils.getmember(signal, 'signal_name'),
+                     utils.getmember(signal, 'signal_type'),
+                     utils.getmember(signal, 'intervals'))
+
+
+def _next_status_change(event, now: datetime) -> float:
+    """Timestamp at which the status of an event changes next, inf if it never does."""
+    if utils.getmember(event, 'event_descriptor.event_status') == enums.EVENT_STATUS.CANCELLED:
+        return float('inf')
+    active_period = utils.getmember(event, 'active_period')
+    start = utils.getmember(active_period, 'dtstart')
+    if start.tzinfo is None:
+        start = start.astimezone(timezone.utc)
+    changes = [start, start + utils.getmember(active_period, 'duration')]
+    ramp_up_period = utils.getmember(active_period, 'ramp_up_period', missing=None)
+    if ramp_up_period is not None:
+        changes.append(start - ramp_up_period)
+    return min((change.timestamp() for change in changes if change > now), default=float('inf'))
+
+
+def tune_ssl_context(ssl_context, tls_tickets: int = 2):
+    """Require TLS 1.2 or later and issue `tls_tickets` session tickets per handshake, 0 turns them off."""
+    ssl_context.minimum_version = ssl.TLSVersion.TLSv1_2
+    if tls_tickets:
+        ssl_context.options &= ~ssl.OP_NO_TICKET
+        ssl_context.num_tickets = tls_tickets
+    else:
+        ssl_context.options |= ssl.OP_NO_TICKET
+
+
+def create_ssl_context(http_cert, http_key, http_key_passphrase, http_ca_file, tls_tickets: int = 2):
+    """The TLS context the VTN serves VENs with, as OpenADRServer builds it, or None without a certificate."""
+    if not (http_cert and http_key and http_ca_file):
+        return None
+    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ssl_context.load_verify_locations(http_ca_file)
+    ssl_context.verify_mode = ssl.CERT_REQUIRED
+    ssl_context.load_cert_chain(http_cert, http_key, http_key_passphrase)
+    tune_ssl_context(ssl_context, tls_tickets)
+    return ssl_context
+
+
+async def _authenticate_message(request, *args, **kwargs):
+    """openleadr's authenticate_message, or the `authenticator` of the VtnServer that got the request."""
+    authenticator = getattr(request.app.get('server'), 'authenticator', None)
+    if authenticator is None:
+        return await messaging.authenticate_message(request, *args, **kwargs)
+    return await authenticator.authenticate(request, *args, **kwargs)
+
+
+class PendingEvents:
+    """The ordered events of one VEN and their rendered oadrDistributeEvent message."""
+
+    __slots__ = ("events", "valid_until", "message")
+
+    def __init__(self, events, valid_until):
+        self.events = events
+        self.valid_until = valid_until
+        self.message = None
+
+
+class EventList(list):
+    """Per-VEN event list that tells the server when openleadr pops an event from it."""
+
+    def __init__(self, on_remove):
+        super().__init__()
+        self._on_remove = on_remove
+
+    def pop(self, index=-1):
+        event = super().pop(index)
+        self._on_remove(event)
+        return event
+
+
+class VtnServer(OpenADRServer):
+    """
+    OpenADRServer with an index of its events.
+
+    Events are indexed by event_id and, per VEN, by their signal (see
+    event_key) so lookups and duplicate checks don't scan the event lists.
+    The index follows every add, cancel and removal, including the removals
+    openleadr does itself once a VEN has acknowledged a cancellation or an
+    event has completed. `events_version` changes on each of those, and every
+    callable in `event_listeners` is called with (action, ven_id, event)
+    where action is "added", "cancelled" or "removed".
+
+    Outgoing messages are signed with a MessageSigner, and VEN messages
+    are checked by `authenticator` (see message_auth) when one is given.
+    Both are kept per server, other servers in the process are left as
+    they are.
+    Idle VEN connections are kept open for `keepalive_timeout` seconds and
+    the TLS context issues `tls_tickets` session tickets per handshake, so
+    a VEN that reconnects resumes its session instead of doing a full
+    handshake.
+    """
+
+    def __init__(self, *args, reuse_port: bool = False, keepalive_timeout: float = 75.0, tls_tickets: int = 2,
+                 authenticator=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # lets several worker processes listen on the same port
+        self.reuse_port = reuse_port
+        self.keepalive_timeout = keepalive_timeout
+        if self.ssl_context is not None:
+            tune_ssl_context(self.ssl_context, tls_tickets)
+        # openleadr reloads the private key for every message it signs
+        self.signer = None
+        # openleadr sets the message factory of this server on the VTNService class, it is kept per server here
+        self._sign_message = VTNService._create_message
+        signing = self._sign_message.keywords
+        if signing.get('cert') and signing.get('key'):
+            self.signer = MessageSigner(signing['cert'], signing['key'], signing.get('passphrase'))
+            self._sign_message = self.signer.create_message
+        self.authenticator = authenticator
+        vtn_service.authenticate_message = _authenticate_message
+        self.events_version = 0
+        # event_id -> (ven_id, event)
+        self._events_by_id = dict()
+        # ven_id -> {event_key: event_id}, cancelled events are left out
+        self._event_keys = dict()
+        self.event_listeners = []
+        # ven_id -> PendingEvents
+        self._pending = dict()
+        self._request_id_placeholder = f"request-id-{uuid.uuid4().hex}"
+        self._response_request_id_placeholder = f"request-id-{uuid.uuid4().hex}"
+        event_service = self.services['event_service']
+        self._request_event_uncached = event_service.request_event
+        # the poll service calls request_event directly, the message handler goes through handlers
+        event_service.request_event = event_service.handlers['oadrRequestEvent'] = self._request_event
+        for service in self.services.values():
+            service._create_message = self._create_message
+
+    async def run(self):
+        """
+        Starts the server in an already-running asyncio loop, with SO_REUSEPORT
+        set when `reuse_port` is and idle connections closed after
+        `keepalive_timeout` seconds.
+        """
+        self.app_runner = web.AppRunner(self.app, keepalive_timeout=self.keepalive_timeout)
+        await self.app_runner.setup()
+        site = web.TCPSite(self.app_runner,
+                           port=self.http_port,
+                           host=self.http_host,
+                           ssl_context=self.ssl_context,
+                           reuse_port=self.reuse_port or None)
+        await site.start()
+        protocol = 'https' if self.ssl_context else 'http'
+        logger.info(f"VTN server running at {protocol}://{self.http_host}:{self.http_port}{self.http_path_prefix}")
+
+    def add_raw_event(self, ven_id, event, callback=None, delivery_callback=None):
+        if ven_id not in self.events:
+            self.events[ven_id] = EventList(partial(self._event_removed, ven_id))
+        event_id = super().add_raw_event(ven_id, event, callback=callback, delivery_callback=delivery_callback)
+        self._events_by_id[event_id] = (ven_id, event)
+        self._event_keys.setdefault(ven_id, dict())[_event_signal_key(event)] = event_id
+        self._notify("added", ven_id, event)
+        return event_id
+
+    def cancel_event(self, ven_id, event_id):
+        """
+        Mark the indicated event as cancelled.
+        """
+        found = self._events_by_id.get(event_id)
+        if found is None or found[0] != ven_id:
+            logger.warning(f"Attempted to cancel event {event_id} for ven_id {ven_id}, "
+                           "but this event does not exist.")
+            return
+        event = found[1]
+        utils.setmember(event, 'event_descriptor.event_status', enums.EVENT_STATUS.CANCELLED)
+        utils.increment_event_modification_number(event)
+        self.events_updated[ven_id] = True
+        self._forget_key(ven_id, event_id, event)
+        self._notify("cancelled", ven_id, event)
+
+    def remove_event(self, ven_id, event_id):
+        """Drop an event and its callbacks without telling the VEN, returns the event or None."""
+        found = self._events_by_id.get(event_id)
+        if found is None or found[0] != ven_id:
+            return None
+        event = found[1]
+        events = self.events[ven_id]
+        events.pop(events.index(event))
+        self.event_callbacks.pop(event_id, None)
+        self.event_delivery_callbacks.pop(event_id, None)
+        return event
+
+    @property
+    def event_count(self):
+        return len(self._events_by_id)
+
+    def pending_events(self, ven_id):
+        """The events to send to a VEN in OpenADR order, with up to date statuses."""
+        now = datetime.now(timezone.utc)
+        pending = self._pending.get(ven_id)
+        if pending is None or pending.valid_until <= now.timestamp():
+            if not self.events.get(ven_id):
+                return []
+            events = utils.order_events(list(self.events[ven_id]))
+            valid_until = min(_next_status_change(event, now) for event in events)
+            pending = self._pending[ven_id] = PendingEvents(events, valid_until)
+        return pending.events
+
+    async def _request_event(self, payload):
+        event_service = self.services['event_service']
+        if event_service.polling_method != 'internal':
+            return await self._request_event_uncached(payload)
+        ven_id = payload['ven_id']
+        events = self.pending_events(ven_id)
+        if not events:
+            return 'oadrResponse', {}
+        for event in events:
+            event_id = utils.getmember(event, 'event_descriptor.event_id')
+            # completed events are sent one last time, as openleadr does
+            if utils.getmember(event, 'event_descriptor.event_status') == enums.EVENT_STATUS.COMPLETED:
+                event_service.completed_event_ids.setdefault(ven_id, []).append(event_id)
+                self.events[ven_id].pop(self.events[ven_id].index(event))
+        for event in events:
+            event_id = utils.getmember(event, 'event_descriptor.event_id')
+            if event_id in event_service.event_delivery_callbacks:
+                await utils.await_if_required(event_service.event_delivery_callbacks[event_id]())
+        return 'oadrDistributeEvent', {'events': events}
+
+    def _create_message(self, message_type, **payload):
+        create_message = self._sign_message
+        signed = self.signer is not None
+        pending = self._pending.get(payload.get('ven_id'))
+        response = payload.get('response') or {}
+        if (message_type != 'oadrDistributeEvent' or signed or pending is None
+                or payload.get('events') is not pending.events
+                or response.get('response_code') != 200):
+            return create_message(message_type, **payload)
+        if pending.message is None:
+            pending.message = create_message(
+                message_type, **{**payload,
+                                 'request_id': self._request_id_placeholder,
+                                 'response': {**response, 'request_id': self._response_request_id_placeholder}})
+        return (pending.message
+                .replace(self._request_id_placeholder, str(payload.get('request_id')))
+                .replace(self._response_request_id_placeholder, str(response.get('request_id'))))
+
+    def find_event(self, event_id):
+        """Return (ven_id, event) for an event_id, or None."""
+        return self._events_by_id.get(event_id)
+
+    def find_duplicate(self, ven_id, signal_name, signal_type, intervals):
+        """Return the event_id of a live event for this VEN with the same signal, or None."""
+        return self._event_keys.get(ven_id, {}).get(event_key(signal_name, signal_type, intervals))
+
+    def _forget_key(self, ven_id, event_id, event):
+        keys = self._event_keys.get(ven_id)
+        if keys is not None and keys.get(_event_signal_key(event)) == event_id:
+            del keys[_event_signal_key(event)]
+            if not keys:
+                del self._event_keys[ven_id]
+
+    def _event_removed(self, ven_id, event):
+        event_id = utils.getmember(event, 'event_descriptor.event_id')
+        self._events_by_id.pop(event_id, None)
+        self._forget_key(ven_id, event_id, event)
+        self._notify("removed", ven_id, event)
+
+    def _notify(self, action, ven_id, event):
+        self.events_version += 1
+        self._pending.pop(ven_id, None)
+        for listener in self.event_listeners:
+            listener(action, ven_id, event)
@@ -0,0 +1,139 @@
+# write_behind.py
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger('openleadr')
+
+
+def atomic_write(path: Path, data: bytes):
+    """Write data to path via a temp file + rename so readers never see a partial file."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, mode="wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+class WriteBehind:
+    """
+    Coalesces dirty marks and flushes them in batches off the event loop.
+
+    `snapshot` runs on the event loop and captures whatever has to be written,
+    `write` receives that snapshot in a worker thread. A flush happens every
+    `interval` seconds while dirty, or as soon as `threshold` marks pile up.
+    Until `run()` is started every mark is written through synchronously.
+    If a write fails, `restore` (when given) receives the snapshot back on the
+    event loop so its changes go out with the next flush.
+    """
+
+    def __init__(self, snapshot, write, interval: float = 5.0, threshold: int = 500, name: str = "registry",
+                 restore=None):
+        self._snapshot = snapshot
+        self._write = write
+        self._restore = restore
+        self.interval = interval
+        self.threshold = threshold
+        self.name = name
+        self._dirty = 0
+        self._running = False
+        self._wakeup = None
+        self._flush_lock = None
+        self._write_lock = threading.Lock()
+        self._task = None
+        self._pending_write = None
+        self.flush_count = 0
+        self.last_flush_duration = 0.0
+        self.flush_duration_total = 0.0
+
+    @property
+    def dirty(self) -> int:
+        return self._dirty
+
+    def mark_dirty(self, count: int = 1):
+        self._dirty += count
+        if not self._running:
+            self.flush_now()
+        elif self._dirty >= self.threshold:
+            self._wakeup.set()
+
+    def flush_now(self):
+        """Synchronous flush, used before the flusher is running."""
+        if not self._dirty:
+            return
+        self._dirty = 0
+        started = time.perf_counter()
+        self._write_locked(self._snapshot())
+        self._record_flush(started)
+
+    async def flush(self):
+        """Flush pending changes in the default executor."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            self._dirty = 0
+            # the write finishes and restores its changes on failure even if this flush is cancelled
+            self._pending_write = asyncio.ensure_future(self._write_snapshot(self._snapshot()))
+            await asyncio.shield(self._pending_write)
+
+    async def _write_snapshot(self, data):
+        started = time.perf_counter()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_locked, data)
+        except Exception as e:
+            # keep the changes marked so the next flush retries them
+            if self._restore is not None:
+                self._restore(data)
+            self._dirty += 1
+            logger.error("Error flushing %s: %s", self.name, e)
+            return
+        self._record_flush(started)
+
+    def _write_locked(self, data):
+        # a cancelled flush keeps running in its thread, never let two overlap
+        with self._write_lock:
+            self._write(data)
+
+    def _record_flush(self, started: float):
+        self.flush_count += 1
+        self.last_flush_duration = time.perf_counter() - started
+        self.flush_duration_total += self.last_flush_duration
+
+    async def run(self):
+        """Background flusher task, start it on the server's event loop."""
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._running = True
+        self._task = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+        finally:
+            self._running = False
+
+    async def close(self):
+        """Final flush on shutdown."""
+        if self._flush_lock is None:
+            self.flush_now()
+            return
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._running = False
+        # a write started by the cancelled flush is still running, a failed one marks its changes again
+        if self._pending_write is not None:
+            await self._pending_write
+        await self.flush()